@@ -2,18 +2,53 @@ from flask import Flask, request, jsonify, send_from_directory,Response
 from flask_cors import CORS
 import mysql.connector
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import (JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt,
+                                get_jwt_request_location)
 import datetime
+import functools
 import json
-import cv2
-from ultralytics import YOLO
+import importlib
 import os
 import numpy as np
 import threading
 import base64
+import hashlib
 import time
-# --- NEW: DeepSORT Import ---
-from deep_sort_realtime.deepsort_tracker import DeepSort
+import math
+import bisect
+import queue
+import atexit
+import re
+import shutil
+import tempfile
+import uuid
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future
+
+class LazyModule:
+    """
+    Stand-in for a heavy module that is imported on first attribute access,
+    after which it replaces itself in this module's globals.
+    """
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            module = importlib.import_module(self._name)
+            globals()[self._alias] = module
+            return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+# OpenCV takes a noticeable part of startup; routes that never touch video
+# (auth, zones, summaries) should not wait for it
+cv2 = LazyModule("cv2", "cv2")
 
 # --- APP AND CORS CONFIGURATION ---
 app = Flask(__name__)
@@ -21,8 +56,37 @@ CORS(app)
 
 app.config['JWT_SECRET_KEY'] = 'a_very_strong_and_unique_secret_key'
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = datetime.timedelta(hours=500000)
+app.config['JWT_TOKEN_LOCATION'] = ['headers']
+app.config['JWT_QUERY_STRING_NAME'] = 'token'
 jwt = JWTManager(app)
 
+# <img> and EventSource can't send an Authorization header, so the routes
+# they open also accept ?token=. Only short-lived stream tokens from
+# /stream_token go there (URLs end up in logs and history), and stream
+# tokens are refused everywhere else.
+STREAM_TOKEN_SECONDS = int(os.environ.get("STREAM_TOKEN_SECONDS", 60))
+STREAM_ENDPOINTS = set()
+
+def stream_jwt_required(fn):
+    """jwt_required() that also takes a stream token as ?token=."""
+    STREAM_ENDPOINTS.add(fn.__name__)
+
+    @functools.wraps(fn)
+    @jwt_required(locations=["query_string", "headers"])
+    def wrapper(*args, **kwargs):
+        if get_jwt_request_location() == "query_string" and get_jwt().get("scope") != "stream":
+            return jsonify({"error": "Query string tokens must come from /stream_token"}), 401
+        return fn(*args, **kwargs)
+    return wrapper
+
+@jwt.token_verification_loader
+def check_token_scope(jwt_header, jwt_data):
+    return jwt_data.get("scope") != "stream" or request.endpoint in STREAM_ENDPOINTS
+
+@jwt.token_verification_failed_loader
+def token_scope_error(jwt_header, jwt_data):
+    return jsonify({"error": "Stream tokens only work on the streaming routes"}), 401
+
 # ==============================
 # DB CONFIG
 # ==============================
@@ -33,395 +97,3593 @@ DB_CONFIG = {
     'database': 'user_auth'
 }
 
+# Every route shares one connection pool. A request waits up to
+# DB_POOL_TIMEOUT seconds for a free connection; a connection that has been
+# idle longer than DB_POOL_HEALTH_CHECK_INTERVAL seconds is pinged (and
+# reconnected or replaced) before it is handed out.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 5.0))
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get("DB_POOL_HEALTH_CHECK_INTERVAL", 30.0))
+
+class PooledConnection:
+    """Proxy for a pooled MySQL connection; close() hands it back to the pool."""
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise mysql.connector.errors.OperationalError("Connection already returned to pool")
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.put(conn)
+
+    def __del__(self):
+        # Routes that bail out early without close() must not leak a pool slot
+        try:
+            self.close()
+        except Exception:
+            pass
+
+class DBConnectionPool:
+    def __init__(self, config, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL):
+        self.config = config
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.idle = queue.LifoQueue()  # (connection, last_used)
+        self.slots = threading.BoundedSemaphore(self.size)
+        self.stats_lock = threading.Lock()
+        self.in_use = 0
+        self.created = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.health_check_failures = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def get(self):
+        started = time.monotonic()
+        if not self.slots.acquire(timeout=self.timeout):
+            with self.stats_lock:
+                self.timeouts += 1
+            raise mysql.connector.errors.PoolError(
+                f"No free database connection after {self.timeout}s (pool size {self.size})")
+        waited = time.monotonic() - started
+        try:
+            conn = self._checkout()
+        except Exception:
+            self.slots.release()
+            raise
+        with self.stats_lock:
+            self.in_use += 1
+            self.acquired += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+        return PooledConnection(self, conn)
+
+    def put(self, conn):
+        try:
+            # Don't hand the next caller an open transaction or stale snapshot
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put((conn, time.monotonic()))
+        except mysql.connector.Error:
+            self._discard(conn)
+        finally:
+            with self.stats_lock:
+                self.in_use -= 1
+            self.slots.release()
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "idle": self.idle.qsize(),
+                "created": self.created,
+                "acquired": self.acquired,
+                "timeouts": self.timeouts,
+                "health_check_failures": self.health_check_failures,
+                "wait_time_total_seconds": round(self.wait_time_total, 6),
+                "wait_time_avg_seconds": round(self.wait_time_total / self.acquired, 6) if self.acquired else 0.0,
+                "wait_time_max_seconds": round(self.wait_time_max, 6)
+            }
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, last_used = self.idle.get_nowait()
+            except queue.Empty:
+                conn = mysql.connector.connect(**self.config)
+                with self.stats_lock:
+                    self.created += 1
+                return conn
+            if time.monotonic() - last_used < self.health_check_interval:
+                return conn
+            try:
+                conn.ping(reconnect=True, attempts=1, delay=0)
+                return conn
+            except mysql.connector.Error:
+                with self.stats_lock:
+                    self.health_check_failures += 1
+                self._discard(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+db_pool = DBConnectionPool(DB_CONFIG)
+
 def get_db_connection():
     try:
-        return mysql.connector.connect(**DB_CONFIG)
+        return db_pool.get()
     except mysql.connector.Error as err:
         print(f"Database connection error: {err}")
         return None
 
 # ==============================
-# YOLO MODEL + DeepSORT
+# METRICS
 # ==============================
-try:
-    model = YOLO("yolov8n.pt")
-    print("YOLO model loaded successfully.")
-except Exception as e:
-    print("Error loading YOLO:", e)
-    model = None
+# Prometheus text-format metrics for /metrics, cheap enough to leave on: an
+# observation is a bisect plus three additions under a lock. Gauges that
+# mirror existing state (sessions, queue depths, pool stats) are only read
+# when /metrics is scraped.
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32)
 
-# Initialize DeepSORT tracker
-deepsort = DeepSort(max_age=30)
+METRIC_HELP = {
+    "crowd_stage_seconds": ("histogram", "Time spent in each pipeline stage per frame or call."),
+    "crowd_request_seconds": ("histogram", "Latency of the frame analysis routes."),
+    "crowd_inference_batch_size": ("histogram", "Frames per YOLO batch."),
+    "crowd_frames_analyzed_total": ("counter", "Frames run through analyze_frame, by source."),
+}
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}    # (name, labels) -> value
+        self.lock = threading.Lock()
+
+    def observe(self, name, value, buckets=STAGE_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram(buckets))
+        histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def render(self, extra=()):
+        """
+        Exposition text for everything recorded plus `extra`, an iterable of
+        (name, type, help, [(labels dict, value)]) read at scrape time.
+        """
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        lines = []
+        described = set()
+
+        def describe(name, kind, help_text):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), histogram in histograms:
+            describe(name, *METRIC_HELP[name])
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        for (name, labels), value in counters:
+            describe(name, *METRIC_HELP[name])
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for name, kind, help_text, samples in extra:
+            describe(name, kind, help_text)
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(tuple(labels.items()))} {value}")
+        return "\n".join(lines) + "\n"
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+metrics = MetricsRegistry()
+
+def observe_stage(stage, seconds):
+    metrics.observe("crowd_stage_seconds", seconds, stage=stage)
 
 # ==============================
-# GLOBAL STATE FOR LIVE ANALYSIS
+# YOLO MODEL (BACKGROUND LOAD)
 # ==============================
-video_sessions = {}
-session_lock = threading.Lock()
-last_zone_counts = {}
-class CameraSession:
-    def __init__(self, source=0):
-        # source=0 uses the default webcam. Change to a URL/path if needed.
-        self.cap = cv2.VideoCapture(source) 
-        self.is_running = False
-        self.frame_lock = threading.Lock()
+# ultralytics and deep_sort_realtime are imported and the model is loaded on
+# a background thread once the server starts, so the other routes serve
+# immediately. A warm-up inference runs before the model is marked ready;
+# /ready reports the state, and detection routes answer 503 until then.
+# Under `flask run` or a WSGI server __main__ never runs, so the load starts
+# when the module is imported; MODEL_PRELOAD=0 leaves it to the first use.
+#
+# DETECTOR_BACKEND picks the runtime behind model(...): "pytorch" runs the
+# weights as-is, "onnx" (ONNX Runtime) and "openvino" (OpenVINO CPU) run an
+# export of them. Exports are built on first use and cached in
+# DETECTOR_EXPORT_DIR, keyed by weights, input size and precision, and are
+# rebuilt when the weights file is newer. DETECTOR_INT8=1 quantizes the
+# export: OpenVINO calibrates on DETECTOR_INT8_DATA, ONNX quantizes the
+# weights dynamically. Every backend returns ultralytics Results, so the
+# rest of the pipeline does not know which one is running.
+MODEL_PATH = os.environ.get("YOLO_MODEL", "yolov8n.pt")
+MODEL_WARMUP_SHAPE = (640, 640, 3)
+MODEL_PRELOAD = os.environ.get("MODEL_PRELOAD", "1") == "1"
+DETECTOR_BACKEND = os.environ.get("DETECTOR_BACKEND", "pytorch").lower()
+DETECTOR_INT8 = os.environ.get("DETECTOR_INT8", "0") == "1"
+DETECTOR_EXPORT_DIR = os.environ.get("DETECTOR_EXPORT_DIR", "models")
+DETECTOR_INT8_DATA = os.environ.get("DETECTOR_INT8_DATA", "coco8.yaml")
+DETECTOR_BACKENDS = ("pytorch", "onnx", "openvino")
+
+def detector_export_path(path, backend, int8, imgsz):
+    """Where the cached export of `path` for this backend lives."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    name = f"{stem}_{imgsz}{'_int8' if int8 else ''}"
+    if backend == "onnx":
+        return os.path.join(DETECTOR_EXPORT_DIR, name + ".onnx")
+    return os.path.join(DETECTOR_EXPORT_DIR, name + "_openvino_model")
+
+def export_detector(path, backend, int8, imgsz, target):
+    """Export the weights at `path` for `backend` into `target`."""
+    from ultralytics import YOLO
+    os.makedirs(DETECTOR_EXPORT_DIR, exist_ok=True)
+    # Export from a private copy of the weights: ultralytics writes next to
+    # its input, and another server process may be exporting at the same time
+    workdir = tempfile.mkdtemp(prefix=".export-", dir=DETECTOR_EXPORT_DIR)
+    try:
+        weights = YOLO(path)  # fetches stock weights that are not on disk yet
+        source = os.path.join(workdir, os.path.basename(path))
+        shutil.copyfile(getattr(weights, "ckpt_path", None) or path, source)
+        options = {"format": backend, "imgsz": imgsz, "dynamic": True, "verbose": False}
+        if int8 and backend == "openvino":
+            options.update(int8=True, data=DETECTOR_INT8_DATA)
+        exported = YOLO(source).export(**options)
+        if int8 and backend == "onnx":
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantized = os.path.join(workdir, "int8.onnx")
+            quantize_dynamic(exported, quantized, weight_type=QuantType.QUInt8)
+            exported = quantized
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        os.replace(exported, target)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def prepare_detector(path=MODEL_PATH, backend=DETECTOR_BACKEND, int8=DETECTOR_INT8):
+    """Model file for `backend`, exporting (and caching) the weights if needed."""
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown DETECTOR_BACKEND {backend!r} (expected one of {', '.join(DETECTOR_BACKENDS)})")
+    if backend == "pytorch":
+        if int8:
+            print("DETECTOR_INT8 is ignored by the pytorch backend.")
+        return path
+    imgsz = INFERENCE_INPUT_SIZE if INFERENCE_INPUT_SIZE > 0 else MODEL_WARMUP_SHAPE[0]
+    target = detector_export_path(path, backend, int8, imgsz)
+    stale = os.path.exists(target) and os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(target)
+    if stale or not os.path.exists(target):
+        started = time.monotonic()
+        export_detector(path, backend, int8, imgsz, target)
+        print(f"Exported {path} for {backend}{' (int8)' if int8 else ''} to {target} "
+              f"in {time.monotonic() - started:.1f}s.")
+    return target
+
+def open_detector(source, backend=DETECTOR_BACKEND):
+    """YOLO model from a file made by prepare_detector (never exports)."""
+    from ultralytics import YOLO
+    return YOLO(source) if backend == "pytorch" else YOLO(source, task="detect")
+
+def load_detector(path=MODEL_PATH, backend=DETECTOR_BACKEND, int8=DETECTOR_INT8):
+    """A YOLO model for `backend`, exporting (and caching) the weights if needed."""
+    return open_detector(prepare_detector(path, backend, int8), backend)
+
+class ModelLoader:
+    def __init__(self, path=MODEL_PATH, backend=DETECTOR_BACKEND, int8=DETECTOR_INT8):
+        self.path = path
+        self.backend = backend
+        self.int8 = int8
+        # Model file the loaded model came from; inference workers open it as-is
+        self.source = None
+        self.model = None
+        self.error = None
+        self.state = "not_started"  # loading | ready | failed
+        self.load_seconds = None
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
 
     def start(self):
-        with self.frame_lock:
-            if not self.cap.isOpened():
-                 # Re-initialize the camera if it was closed
-                 self.cap = cv2.VideoCapture(0) 
-            self.is_running = True
+        with self.lock:
+            # A worker forked mid-load (e.g. gunicorn --preload) has no loading thread
+            forked = self.pid != os.getpid() and not self.ready.is_set()
+            if self.thread is None or forked:
+                self.state, self.pid = "loading", os.getpid()
+                self.thread = threading.Thread(target=self._load, daemon=True)
+                self.thread.start()
 
-    def stop(self):
-        with self.frame_lock:
-            self.is_running = False
-            if self.cap.isOpened():
-                self.cap.release()
+    def get(self, timeout=None):
+        """The loaded model, waiting for the background load (started if needed)."""
+        self.start()
+        if not self.ready.wait(timeout):
+            raise RuntimeError("Detection model is still loading")
+        if self.model is None:
+            raise RuntimeError(f"YOLO model failed to load: {self.error}")
+        return self.model
 
-    def generate_frames(self):
-        # Standard MJPEG streaming protocol
-        while self.is_running and self.cap.isOpened():
-            ret, frame = self.cap.read()
-            if not ret:
-                # If frame read fails, try to re-init camera (e.g., if it was unplugged)
-                print("Live feed: Failed to read frame.")
-                break 
-            
-            # --- IMPORTANT: No detection or zone drawing here. Raw frames only. ---
-            # Frontend will overlay the zone drawing canvas.
-            
-            ret, buffer = cv2.imencode('.jpg', frame)
-            if not ret:
-                continue
-            
-            frame_bytes = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            time.sleep(0.033) # ~30 FPS
+    def is_ready(self):
+        self.start()
+        return self.ready.is_set() and self.model is not None
 
-        # Clean up if the loop exits
-        if self.cap.isOpened():
-            self.cap.release()
+    def use(self, model):
+        """Install an already built model (e.g. a stand-in detector for benchmarks)."""
+        with self.lock:
+            # A placeholder thread keeps start() from loading the real model
+            self.thread = self.thread or threading.current_thread()
+            self.pid = os.getpid()
+            self.model, self.source, self.error, self.state = model, None, None, "ready"
+            self.ready.set()
 
-global g_live_camera_session
-g_live_camera_session = CameraSession(source=0) # Initialize with default webcam
+    def status(self):
+        return {"state": self.state, "model": self.path, "backend": self.backend, "int8": self.int8,
+                "load_seconds": self.load_seconds, "error": self.error}
 
-@app.route('/start_live_stream', methods=['POST'])
-@jwt_required()
-def start_live_stream():
-    global g_live_camera_session
-    try:
-        g_live_camera_session.start()
-        return jsonify({"message": "Live stream started"}), 200
-    except Exception as e:
-        return jsonify({"error": f"Failed to start live stream: {e}"}), 500
+    def _load(self):
+        started = time.monotonic()
+        try:
+            source = prepare_detector(self.path, self.backend, self.int8)
+            model = open_detector(source, self.backend)
+            model(np.zeros(MODEL_WARMUP_SHAPE, dtype=np.uint8), verbose=False, classes=DETECT_CLASSES)
+            importlib.import_module("deep_sort_realtime.deepsort_tracker")
+            with self.lock:
+                if self.model is None:
+                    self.model, self.source, self.state = model, source, "ready"
+            print(f"YOLO model ({self.backend}) loaded and warmed up in {time.monotonic() - started:.1f}s.")
+        except Exception as e:
+            print("Error loading YOLO:", e)
+            with self.lock:
+                if self.model is None:
+                    self.error, self.state = str(e), "failed"
+        finally:
+            self.load_seconds = round(time.monotonic() - started, 3)
+            self.ready.set()
 
-@app.route('/stop_live_stream', methods=['POST'])
-@jwt_required()
-def stop_live_stream():
-    global g_live_camera_session
-    g_live_camera_session.stop()
-    # Also attempt to reset the session object to clear its resources
-    g_live_camera_session = CameraSession(source=0)
-    return jsonify({"message": "Live stream stopped"}), 200
+model_loader = ModelLoader()
 
-@app.route('/live_feed_mjpeg')
-def live_feed_mjpeg():
-    # This is the unauthenticated route for the <img> tag to pull frames
-    return Response(g_live_camera_session.generate_frames(), 
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
-@app.route('/start_live_analysis', methods=['POST'])
-@jwt_required()
-def start_live_analysis():
+# `python app.py` starts the load in __main__ (after the reloader check), and
+# spawned inference workers open the exported model themselves
+if MODEL_PRELOAD and __name__ != "__main__" and multiprocessing.parent_process() is None:
+    model_loader.start()
+
+def new_tracker():
+    from deep_sort_realtime.deepsort_tracker import DeepSort
+    return DeepSort(max_age=30)
+
+# ==============================
+# DeepSORT TRACKER POOL
+# ==============================
+# One DeepSORT instance per analysis session so concurrent users never share
+# tracks. Each tracker carries its own appearance embedder, so the pool is
+# capped at TRACKER_POOL_MAX_TRACKERS; the least recently used tracker is
+# evicted when the cap is hit. A session's detection cadence and zone state
+# are small and kept apart from its tracker: an evicted tracker is rebuilt
+# (outside the pool lock) and the zone state takes the new tracks as a
+# baseline for TRACKER_REBUILD_QUIET_UPDATES frames instead of reporting
+# everyone as having just entered. A frame that would only predict runs a
+# detection instead when the tracker is gone, since there are no tracks to
+# predict from.
+#
+# Sessions are opened by acquire() and closed by release(); the per-frame
+# calls only use open sessions, so a frame that finishes after release()
+# cannot bring a session back. Sessions idle for TRACKER_IDLE_TIMEOUT seconds
+# are dropped together with their trackers and rebuilt, with the same
+# cadence options, if the still open session gets another frame.
+TRACKER_POOL_MAX_TRACKERS = int(os.environ.get("TRACKER_POOL_MAX_TRACKERS", 16))
+TRACKER_IDLE_TIMEOUT = float(os.environ.get("TRACKER_IDLE_TIMEOUT", 300))
+TRACKER_REBUILD_QUIET_UPDATES = 10
+
+def tracker_key(kind, user_id):
+    return f"{kind}:{user_id}"
+
+# ==============================
+# DETECTION CADENCE
+# ==============================
+# YOLO does not have to run on every frame: on skipped frames DeepSORT's
+# Kalman filter predicts where each track moved, so zone counts keep
+# updating. Modes:
+#   fixed    - detect every DETECTION_STRIDE frames
+#   adaptive - pick the stride from the measured detection latency so the
+#              session keeps up with DETECTION_TARGET_FPS (capped at
+#              DETECTION_MAX_STRIDE), and detect early when the scene changes
+#              by more than DETECTION_MOTION_THRESHOLD (mean abs. grey-level
+#              difference on a thumbnail)
+DETECTION_MODE = os.environ.get("DETECTION_MODE", "fixed")
+DETECTION_STRIDE = int(os.environ.get("DETECTION_STRIDE", 1))
+DETECTION_TARGET_FPS = float(os.environ.get("DETECTION_TARGET_FPS", 30))
+DETECTION_MAX_STRIDE = int(os.environ.get("DETECTION_MAX_STRIDE", 6))
+DETECTION_MOTION_THRESHOLD = float(os.environ.get("DETECTION_MOTION_THRESHOLD", 6.0))
+MOTION_THUMBNAIL_SIZE = (64, 36)
+
+class DetectionCadence:
+    def __init__(self, mode=DETECTION_MODE, stride=DETECTION_STRIDE, target_fps=DETECTION_TARGET_FPS,
+                 max_stride=DETECTION_MAX_STRIDE, motion_threshold=DETECTION_MOTION_THRESHOLD):
+        if mode not in ("fixed", "adaptive"):
+            raise ValueError(f"Unknown detection mode: {mode}")
+        self.mode = mode
+        self.stride = max(1, int(stride))
+        self.target_fps = max(1.0, float(target_fps))
+        self.max_stride = max(1, int(max_stride))
+        self.motion_threshold = float(motion_threshold)
+        self.frames_since_detection = None
+        self.latency_ema = None
+        self.reference_thumb = None
+
+    def current_stride(self):
+        if self.mode == "fixed" or self.latency_ema is None:
+            return self.stride
+        # Frames that arrive while one detection runs can be covered by prediction
+        return min(self.max_stride, max(1, math.ceil(self.latency_ema * self.target_fps - 1e-6)))
+
+    def should_detect(self, frame):
+        if self.frames_since_detection is None:
+            return True
+        self.frames_since_detection += 1
+        if self.frames_since_detection >= self.current_stride():
+            return True
+        if self.mode == "adaptive" and self.reference_thumb is not None:
+            diff = cv2.absdiff(self._thumbnail(frame), self.reference_thumb)
+            return float(diff.mean()) > self.motion_threshold
+        return False
+
+    def record_detection(self, frame, seconds):
+        self.frames_since_detection = 0
+        self.latency_ema = seconds if self.latency_ema is None else 0.8 * self.latency_ema + 0.2 * seconds
+        if self.mode == "adaptive":
+            self.reference_thumb = self._thumbnail(frame)
+
+    @staticmethod
+    def _thumbnail(frame):
+        small = cv2.resize(frame, MOTION_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+def cadence_options_from_request():
+    """Optional per-session overrides: detection_mode, detection_stride."""
+    data = request.get_json(silent=True) or {}
+    options = {}
+    if data.get("detection_mode"):
+        options["mode"] = data["detection_mode"]
+    if data.get("detection_stride"):
+        options["stride"] = int(data["detection_stride"])
+    return options
+
+# ==============================
+# PER-TRACK ZONE STATE
+# ==============================
+class TrackZoneTable:
     """
-    Start analyzing live camera feed (YOLO + DeepSORT + zone analysis)
-    and return processed frames with overlays and heatmaps.
+    Zone membership of every live DeepSORT track in one session, kept in
+    arrays indexed by a slot per track id (slots of dead tracks are reused).
+    An entry or exit is an actual transition of one track, so people crossing
+    in opposite directions no longer cancel out, and the time each track
+    entered a zone gives dwell time.
     """
-    global g_live_camera_session
-    user_id = get_jwt_identity()
+    def __init__(self, capacity=32):
+        self.zone_ids = ()
+        self.slot_of = {}  # track_id -> row
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.inside = np.zeros((capacity, 0), dtype=bool)
+        self.entered_at = np.zeros((capacity, 0), dtype=np.float64)
+        self.visits = np.zeros(0, dtype=np.int64)
+        self.dwell_total = np.zeros(0, dtype=np.float64)
+        # Updates left in which newly seen tracks are a baseline, not entries
+        self.quiet_updates = 0
 
-    if not g_live_camera_session.is_running:
-        return jsonify({"error": "Live stream not started. Please start first."}), 400
+    def rebase(self, quiet_updates=TRACKER_REBUILD_QUIET_UPDATES):
+        """Forget every track (the tracker was rebuilt) without counting exits or entries."""
+        self.slot_of.clear()
+        self.free_slots = list(range(self.inside.shape[0] - 1, -1, -1))
+        self.inside[:] = False
+        self.quiet_updates = quiet_updates
 
-    cap = g_live_camera_session.cap
-    ret, frame = cap.read()
-    if not ret:
-        return jsonify({"error": "Failed to read live frame"}), 500
+    def update(self, zone_ids, track_ids, membership, alive_ids, now, detected=True):
+        """
+        membership is a bool (len(track_ids), len(zone_ids)) matrix for the
+        confirmed tracks of this frame; alive_ids are all tracks DeepSORT still
+        holds. Returns per-zone (entries, exits) arrays. Only a detection can
+        end a track: on a predicted frame (detected=False) tracks missing from
+        alive_ids keep their zones.
+        """
+        self._set_zones(tuple(zone_ids))
+        entries = np.zeros(len(self.zone_ids), dtype=np.int64)
+        exits = np.zeros(len(self.zone_ids), dtype=np.int64)
 
-    # --- Get Zones ---
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT id, name, coordinates FROM zones WHERE user_id=%s", (user_id,))
-    zones = cursor.fetchall()
+        # Tracks the tracker dropped leave every zone they were in
+        dead = [tid for tid in self.slot_of if tid not in alive_ids] if detected else []
+        if dead:
+            slots = np.array([self.slot_of.pop(tid) for tid in dead], dtype=np.intp)
+            exits += self._leave(slots, self.inside[slots].copy(), now)
+            self.free_slots.extend(slots.tolist())
 
-    # --- YOLO Detection ---
-    results = model(frame, verbose=False)
-    detections = results[0].boxes
-    dets_for_tracker = []
+        if track_ids:
+            new = np.array([tid not in self.slot_of for tid in track_ids], dtype=bool)
+            slots = np.array([self._slot(tid) for tid in track_ids], dtype=np.intp)
+            prev = self.inside[slots]
+            entered = membership & ~prev
+            exits += self._leave(slots, prev & ~membership, now)
+            rows, cols = np.nonzero(entered)
+            self.entered_at[slots[rows], cols] = now
+            self.inside[slots] = membership
+            if self.quiet_updates:
+                entered = entered & ~new[:, None]
+            entries += entered.sum(axis=0)
+        self.quiet_updates = max(0, self.quiet_updates - 1)
+        return entries, exits
 
-    for det in detections:
-        cls_i = int(det.cls.item()) if hasattr(det, "cls") else 0
-        if cls_i == 0:  # person class
-            x1, y1, x2, y2 = map(int, det.xyxy[0].tolist())
-            conf = float(det.conf.item()) if hasattr(det, "conf") else 0.9
-            dets_for_tracker.append(([x1, y1, x2 - x1, y2 - y1], conf, 'person'))
+    def dwell_stats(self, now):
+        """Per zone: completed visits, their mean dwell and the mean dwell of current occupants."""
+        slots = np.fromiter(self.slot_of.values(), dtype=np.intp, count=len(self.slot_of))
+        inside = self.inside[slots]
+        current = np.where(inside, now - self.entered_at[slots], 0.0)
+        occupants = inside.sum(axis=0)
+        stats = {}
+        for i, zone_id in enumerate(self.zone_ids):
+            stats[zone_id] = {
+                "visits": int(self.visits[i]),
+                "avg_dwell_seconds": round(float(self.dwell_total[i] / self.visits[i]), 2) if self.visits[i] else 0.0,
+                "current_avg_dwell_seconds": round(float(current[:, i].sum() / occupants[i]), 2) if occupants[i] else 0.0
+            }
+        return stats
 
-    h, w, _ = frame.shape
-    overlay = frame.copy()
-    density_map = np.zeros((h, w), dtype=np.uint8)
-    person_centers = []
+    def _leave(self, slots, left, now):
+        rows, cols = np.nonzero(left)
+        if rows.size:
+            np.add.at(self.dwell_total, cols, now - self.entered_at[slots[rows], cols])
+            np.add.at(self.visits, cols, 1)
+            self.inside[slots[rows], cols] = False
+        return left.sum(axis=0)
 
-    # --- DeepSORT Tracking ---
-    tracks = deepsort.update_tracks(dets_for_tracker, frame=frame)
-    for track in tracks:
-        if not track.is_confirmed():
-            continue
-        track_id = track.track_id
-        ltrb = track.to_ltrb()
-        x1, y1, x2, y2 = map(int, ltrb)
-        cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
-        person_centers.append((cx, cy))
+    def _slot(self, track_id):
+        slot = self.slot_of.get(track_id)
+        if slot is None:
+            if not self.free_slots:
+                self._grow()
+            slot = self.free_slots.pop()
+            self.inside[slot] = False
+            self.slot_of[track_id] = slot
+        return slot
 
-        cv2.rectangle(overlay, (x1, y1), (x2, y2), (255, 0, 0), 2)
-        cv2.putText(overlay, f"ID {track_id}", (x1, y1 - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+    def _grow(self):
+        capacity = self.inside.shape[0]
+        new_capacity = max(16, capacity * 2)
+        inside = np.zeros((new_capacity, len(self.zone_ids)), dtype=bool)
+        entered_at = np.zeros((new_capacity, len(self.zone_ids)), dtype=np.float64)
+        inside[:capacity] = self.inside
+        entered_at[:capacity] = self.entered_at
+        self.inside, self.entered_at = inside, entered_at
+        self.free_slots.extend(range(new_capacity - 1, capacity - 1, -1))
 
-        if 0 <= cy < h and 0 <= cx < w:
-            density_map[cy, cx] = 255
+    def _set_zones(self, zone_ids):
+        # Zones were saved or deleted: keep the columns of zones that still exist
+        if zone_ids == self.zone_ids:
+            return
+        old_index = {zone_id: i for i, zone_id in enumerate(self.zone_ids)}
+        keep = [(j, old_index[z]) for j, z in enumerate(zone_ids) if z in old_index]
+        capacity = self.inside.shape[0]
+        inside = np.zeros((capacity, len(zone_ids)), dtype=bool)
+        entered_at = np.zeros((capacity, len(zone_ids)), dtype=np.float64)
+        visits = np.zeros(len(zone_ids), dtype=np.int64)
+        dwell_total = np.zeros(len(zone_ids), dtype=np.float64)
+        for new, old in keep:
+            inside[:, new] = self.inside[:, old]
+            entered_at[:, new] = self.entered_at[:, old]
+            visits[new] = self.visits[old]
+            dwell_total[new] = self.dwell_total[old]
+        self.zone_ids = zone_ids
+        self.inside, self.entered_at = inside, entered_at
+        self.visits, self.dwell_total = visits, dwell_total
 
-    # --- Heatmap ---
-    density_map_blurred = cv2.GaussianBlur(density_map, (41, 41), 0)
-    heatmap_colored = cv2.applyColorMap(density_map_blurred, cv2.COLORMAP_JET)
-    heatmap_overlay = cv2.addWeighted(frame, 0.5, heatmap_colored, 0.5, 0)
+class TrackerSessionClosed(LookupError):
+    """The tracker session was released (or never acquired)."""
 
-    # --- Zone Counting ---
-    zone_counts = {}
-    if user_id not in last_zone_counts:
-        last_zone_counts[user_id] = {}
+class TrackerPool:
+    def __init__(self, max_trackers=TRACKER_POOL_MAX_TRACKERS, idle_timeout=TRACKER_IDLE_TIMEOUT):
+        self.max_trackers = max(1, max_trackers)
+        self.idle_timeout = idle_timeout
+        self.options = {}              # key -> cadence options of every open session
+        self.sessions = {}             # key -> {"cadence", "zone_state", "tracked", "lock", "last_used"}
+        self.trackers = OrderedDict()  # key -> DeepSort, least recently used first
+        self.lock = threading.Lock()
 
-    for zone in zones:
-        coords = json.loads(zone["coordinates"])
-        pts = np.array([[p["x"], p["y"]] for p in coords], dtype=np.int32)
-        
-        count = sum(cv2.pointPolygonTest(pts, (cx, cy), False) >= 0 for cx, cy in person_centers)
-        previous_count = last_zone_counts[user_id].get(zone["id"], 0)
-        entries = max(0, count - previous_count)
-        exits = max(0, previous_count - count)
-        last_zone_counts[user_id][zone["id"]] = count
-        zone_counts[zone["id"]] = count
-
-        # --- Save to DB ---
+    def acquire(self, key, **cadence_options):
+        """
+        Open a session, or return the state of the open one. cadence_options
+        configure the DetectionCadence of a new session. The DeepSORT tracker
+        itself is built on the session's first detection.
+        """
+        with self.lock:
+            self._evict_idle()
+            return self.sessions.get(key) or self._new_session(
+                key, self.options.get(key, cadence_options), tracked=key in self.options)
+
+    def session(self, key):
+        """The state of an open session; raises TrackerSessionClosed after release()."""
+        with self.lock:
+            self._evict_idle()
+            if key not in self.options:
+                raise TrackerSessionClosed(key)
+            # Dropped while idle: the people it tracked are not new entries
+            return self.sessions.get(key) or self._new_session(key, self.options[key], tracked=True)
+
+    def release(self, key):
+        with self.lock:
+            self.options.pop(key, None)
+            self.sessions.pop(key, None)
+            self.trackers.pop(key, None)
+
+    def _new_session(self, key, cadence_options, tracked):
+        entry = {
+            "cadence": DetectionCadence(**cadence_options),
+            "zone_state": TrackZoneTable(),
+            # Set once a tracker was built; a later build is a rebuild
+            "tracked": tracked,
+            "lock": threading.Lock(),
+            "last_used": time.time()
+        }
+        self.options[key] = cadence_options
+        self.sessions[key] = entry
+        return entry
+
+    def update_tracks(self, key, detections, frame):
+        entry = self.session(key)
+        tracker = self._tracker(key, entry)
+        with entry["lock"]:
+            entry["last_used"] = time.time()
+            return tracker.update_tracks(detections, frame=frame)
+
+    def predict_tracks(self, key):
+        """
+        Advance every track by one frame without a detection (Kalman
+        prediction only). Returns None when the session has no tracker (before
+        its first detection or after an eviction): the caller must detect.
+        """
+        entry = self.session(key)
+        with self.lock:
+            tracker = self.trackers.get(key)
+        if tracker is None:
+            return None
+        with entry["lock"]:
+            entry["last_used"] = time.time()
+            tracker.tracker.predict()
+            return [t for t in tracker.tracker.tracks if not t.is_deleted()]
+
+    def update_zone_state(self, key, zone_ids, track_ids, membership, alive_ids, now, detected=True):
+        """Feed this frame's track/zone membership to the session's TrackZoneTable."""
+        entry = self.session(key)
+        with entry["lock"]:
+            zone_state = entry["zone_state"]
+            entries, exits = zone_state.update(zone_ids, track_ids, membership, alive_ids, now, detected)
+            return entries, exits, zone_state.dwell_stats(now)
+
+    def _tracker(self, key, entry):
+        with self.lock:
+            tracker = self.trackers.get(key)
+            if tracker is not None:
+                self.trackers.move_to_end(key)
+                return tracker
+        # DeepSORT and its embedder take a while to build: build under the
+        # session's own lock so other sessions keep going
+        with entry["lock"]:
+            with self.lock:
+                tracker = self.trackers.get(key)
+            if tracker is not None:
+                return tracker
+            tracker = new_tracker()
+            with self.lock:
+                # Released (or dropped) while building: serve this frame, keep nothing
+                if self.sessions.get(key) is entry:
+                    while len(self.trackers) >= self.max_trackers:
+                        evicted_key, _ = self.trackers.popitem(last=False)
+                        print(f"Tracker pool full, evicted {evicted_key}")
+                    self.trackers[key] = tracker
+            if entry["tracked"]:
+                # Rebuilt after an eviction: the old track ids are gone
+                entry["zone_state"].rebase()
+            entry["tracked"] = True
+        return tracker
+
+    def _evict_idle(self):
+        # The options stay: an open session is rebuilt on its next frame
+        now = time.time()
+        for k in [k for k, entry in self.sessions.items() if now - entry["last_used"] > self.idle_timeout]:
+            del self.sessions[k]
+            self.trackers.pop(k, None)
+
+tracker_pool = TrackerPool()
+
+# ==============================
+# BATCHED INFERENCE SCHEDULER
+# ==============================
+# Frames from every active session are grouped into micro-batches. A batch is
+# flushed when it reaches INFERENCE_MAX_BATCH frames, when every registered
+# source has a frame waiting, or when the oldest frame has waited
+# INFERENCE_MAX_LATENCY_MS.
+#
+# With INFERENCE_WORKERS > 0 the batches run in that many worker processes
+# instead of in this process, so YOLO no longer competes with DeepSORT, the
+# heatmap and JPEG encoding for the GIL. Each worker loads the model once and
+# gets its frames through a shared-memory buffer of INFERENCE_SHM_BYTES (no
+# pickled arrays); only the small detection arrays come back over a pipe.
+# A model installed with model_loader.use() has no file the workers could
+# open, so it always runs in this process.
+INFERENCE_MAX_BATCH = int(os.environ.get("INFERENCE_MAX_BATCH", 8))
+INFERENCE_MAX_LATENCY_MS = float(os.environ.get("INFERENCE_MAX_LATENCY_MS", 15))
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 0))
+INFERENCE_SHM_BYTES = int(os.environ.get("INFERENCE_SHM_BYTES", 1920 * 1080 * 3 * INFERENCE_MAX_BATCH))
+
+DetectionBoxes = namedtuple("DetectionBoxes", ["xyxy", "conf", "cls"])
+
+# ==============================
+# DECODE AND INFERENCE INPUT
+# ==============================
+# Captures ask OpenCV for hardware decoding (whatever the platform offers:
+# VAAPI, D3D11, VideoToolbox...) and fall back to software decoding. YOLO
+# gets one copy of the frame downscaled to INFERENCE_INPUT_SIZE on its long
+# side (it letterboxes to that size anyway), so full 1080p/4K frames are not
+# shipped to the scheduler or the worker processes; boxes are scaled back to
+# frame coordinates so they line up with the zones. 0 disables the resize.
+#
+# Only people are counted, so with DETECT_PERSONS_ONLY YOLO is asked for the
+# person class alone (NMS and output skip the other 79 COCO classes). With
+# DETECT_ZONE_ROI the frame is first cropped to the bounding box of all the
+# user's zones, grown by DETECT_ROI_MARGIN of the frame's long side so people
+# walking into a zone are picked up before they cross its edge. People
+# outside that box are not tracked, so the heatmap only covers it.
+VIDEO_HW_ACCELERATION = os.environ.get("VIDEO_HW_ACCELERATION", "any")  # any | none
+INFERENCE_INPUT_SIZE = int(os.environ.get("INFERENCE_INPUT_SIZE", 640))
+DETECT_PERSONS_ONLY = os.environ.get("DETECT_PERSONS_ONLY", "1") == "1"
+DETECT_ZONE_ROI = os.environ.get("DETECT_ZONE_ROI", "0") == "1"
+DETECT_ROI_MARGIN = float(os.environ.get("DETECT_ROI_MARGIN", 0.05))
+DETECT_CLASSES = [0] if DETECT_PERSONS_ONLY else None
+
+def open_video_capture(source):
+    if VIDEO_HW_ACCELERATION != "none" and hasattr(cv2, "CAP_PROP_HW_ACCELERATION"):
+        cap = cv2.VideoCapture(source, cv2.CAP_ANY,
+                               [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if cap.isOpened():
+            return cap
+        cap.release()
+    return cv2.VideoCapture(source)
+
+def inference_input(frame, size=INFERENCE_INPUT_SIZE):
+    """Return (frame for YOLO, (x scale, y scale) back to the original frame)."""
+    h, w = frame.shape[:2]
+    if size <= 0 or max(h, w) <= size:
+        return frame, (1.0, 1.0)
+    factor = size / max(h, w)
+    small_w, small_h = max(1, round(w * factor)), max(1, round(h * factor))
+    small = cv2.resize(frame, (small_w, small_h), interpolation=cv2.INTER_AREA)
+    return small, (w / small_w, h / small_h)
+
+def detection_roi(zones, shape, margin=DETECT_ROI_MARGIN):
+    """(x0, y0, x1, y1) around every zone plus the margin, or None for the whole frame."""
+    if not zones:
+        return None
+    h, w = shape
+    pts = np.concatenate([zone["pts"] for zone in zones])
+    pad = int(margin * max(h, w))
+    x0, y0 = np.maximum(pts.min(axis=0) - pad, 0)
+    x1, y1 = np.minimum(pts.max(axis=0) + pad + 1, (w, h))
+    if x1 <= x0 or y1 <= y0 or (x1 - x0) * (y1 - y0) >= h * w:
+        return None
+    return int(x0), int(y0), int(x1), int(y1)
+
+class DetectionResult:
+    """Detections from a worker process, exposing .boxes like an ultralytics Results."""
+    def __init__(self, xyxy, conf, cls):
+        self.boxes = DetectionBoxes(xyxy, conf, cls)
+
+def detection_arrays(result):
+    """(xyxy, conf, cls) numpy arrays of one YOLO or worker result."""
+    boxes = result.boxes
+    if isinstance(boxes, DetectionBoxes):
+        return boxes.xyxy, boxes.conf, boxes.cls
+    return boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy()
+
+def person_detections(result, scale=(1.0, 1.0), offset=(0, 0)):
+    """DeepSORT input ([x, y, w, h], conf, 'person') for the person boxes, in frame coordinates."""
+    xyxy, conf, cls = detection_arrays(result)
+    keep = cls == 0
+    boxes = (xyxy[keep] * np.tile(scale, 2) + np.tile(offset, 2)).astype(np.int64)
+    boxes[:, 2:] -= boxes[:, :2]
+    return [(box, score, 'person') for box, score in zip(boxes.tolist(), conf[keep].tolist())]
+
+def inference_worker_main(shm_name, conn, source, backend):
+    """
+    Worker process loop: read a batch from shared memory, run YOLO, send
+    detections back. source is the model file the parent already prepared,
+    so workers never export (and never race each other doing it).
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    model = open_detector(source, backend)
+    try:
+        while True:
+            layout = conn.recv()
+            if layout is None:
+                break
+            frames = [np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+                      for offset, shape in layout]
+            try:
+                results = model(frames, verbose=False, classes=DETECT_CLASSES)
+                conn.send([detection_arrays(r) for r in results])
+            except Exception as e:
+                conn.send(f"{type(e).__name__}: {e}")
+            finally:
+                del frames
+    finally:
+        shm.close()
+
+class InferenceWorkerProcess:
+    def __init__(self, shm_bytes=INFERENCE_SHM_BYTES):
+        ctx = multiprocessing.get_context("spawn")
+        self.shm = shared_memory.SharedMemory(create=True, size=shm_bytes)
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=inference_worker_main,
+                                   args=(self.shm.name, child_conn, model_loader.source, model_loader.backend),
+                                   daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def infer(self, frames):
+        """Run frames through the worker, in as many round trips as the buffer needs."""
+        results = []
+        layout = []
+        offset = 0
+        for frame in frames:
+            frame = np.ascontiguousarray(frame, dtype=np.uint8)
+            if frame.nbytes > self.shm.size:
+                raise ValueError(f"Frame of {frame.nbytes} bytes exceeds INFERENCE_SHM_BYTES")
+            if offset + frame.nbytes > self.shm.size:
+                results.extend(self._run(layout))
+                layout, offset = [], 0
+            np.ndarray(frame.shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset)[...] = frame
+            layout.append((offset, frame.shape))
+            offset += frame.nbytes
+        if layout:
+            results.extend(self._run(layout))
+        return results
+
+    def _run(self, layout):
+        self.conn.send(layout)
+        reply = self.conn.recv()
+        if isinstance(reply, str):
+            raise RuntimeError(f"Inference worker failed: {reply}")
+        return [DetectionResult(*arrays) for arrays in reply]
+
+    def close(self):
         try:
-            cursor.execute("""
-                INSERT INTO zone_analysis (user_id, timestamp, zone_id, people_count, entries, exits)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (user_id, datetime.datetime.now(), zone["id"], count, entries, exits))
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+        self.shm.close()
+        self.shm.unlink()
+
+class InferenceScheduler:
+    def __init__(self, max_batch=INFERENCE_MAX_BATCH, max_latency_ms=INFERENCE_MAX_LATENCY_MS,
+                 num_workers=INFERENCE_WORKERS):
+        self.max_batch = max(1, max_batch)
+        self.max_latency = max(0.0, max_latency_ms) / 1000.0
+        self.num_workers = max(0, num_workers)
+        self.pending = queue.Queue()
+        # Collected batches waiting for a free worker process (bounded for backpressure)
+        self.batches = queue.Queue(maxsize=max(1, self.num_workers))
+        self.lock = threading.Lock()
+        self.active_sources = 0
+        self.thread = None
+        self.workers = []
+
+    def register_source(self):
+        with self.lock:
+            self.active_sources += 1
+
+    def unregister_source(self):
+        with self.lock:
+            self.active_sources = max(0, self.active_sources - 1)
+
+    def submit(self, frame):
+        """Queue a frame for detection and return a Future for its YOLO result."""
+        future = Future()
+        self._ensure_running()
+        self.pending.put((frame, future))
+        return future
+
+    def infer(self, frame):
+        return self.submit(frame).result()
+
+    def _ensure_running(self):
+        if self.num_workers:
+            model_loader.get()  # export (if needed) here, once, before any worker starts
+            if model_loader.source is None:
+                with self.lock:
+                    if self.num_workers and not self.workers:
+                        print("Detection model was installed in-process; not starting inference workers.")
+                        self.num_workers = 0
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                for _ in range(self.num_workers - len(self.workers)):
+                    worker = InferenceWorkerProcess()
+                    self.workers.append(worker)
+                    threading.Thread(target=self._feed_worker, args=(worker,), daemon=True).start()
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def close(self):
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            worker.close()
+
+    def _collect_batch(self):
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch:
+            # No point waiting for frames from sources that do not exist
+            if len(batch) >= max(1, self.active_sources):
+                try:
+                    batch.append(self.pending.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if self.num_workers:
+                self.batches.put(batch)
+            else:
+                self._run_batch(batch, lambda frames: model_loader.get()(frames, verbose=False,
+                                                                          classes=DETECT_CLASSES))
+
+    def _feed_worker(self, worker):
+        while True:
+            batch = self.batches.get()
+            try:
+                self._run_batch(batch, worker.infer, reraise=True)
+            except (EOFError, BrokenPipeError, ConnectionResetError):
+                # The process died; replace it and keep serving
+                print("Inference worker process died, restarting it.")
+                with self.lock:
+                    if worker not in self.workers:
+                        return  # shutting down
+                    self.workers.remove(worker)
+                    try:
+                        worker.close()
+                    except Exception:
+                        pass
+                    worker = InferenceWorkerProcess()
+                    self.workers.append(worker)
+            except Exception:
+                pass
+
+    def _run_batch(self, batch, infer, reraise=False):
+        frames = [frame for frame, _ in batch]
+        metrics.observe("crowd_inference_batch_size", len(frames), buckets=BATCH_SIZE_BUCKETS)
+        started = time.perf_counter()
+        try:
+            results = infer(frames)
+            observe_stage("inference_batch", time.perf_counter() - started)
         except Exception as e:
-            print("Insert error:", e)
+            for _, future in batch:
+                future.set_exception(e)
+            if reraise:
+                raise
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
 
-        # Draw zone boundary
-        cv2.polylines(overlay, [pts], isClosed=True, color=(0, 255, 0), thickness=2)
-        cx = int(sum(p['x'] for p in coords) / len(coords))
-        cy = int(sum(p['y'] for p in coords) / len(coords))
-        cv2.putText(overlay, f"{zone['name']}: {count}", (cx, cy), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255,255,255), 2)
+inference_scheduler = InferenceScheduler()
+atexit.register(inference_scheduler.close)
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+# ==============================
+# ZONE GEOMETRY CACHE
+# ==============================
+# Zones are parsed once per user and rasterized into a label mask per frame
+# size. Every pixel holds the id of the exact set of zones covering it (label
+# 0 = no zone), so overlapping zones get their own label and counting all
+# people in all zones is a mask lookup, a bincount and a small matrix product.
+ZONE_MASK_SHAPES_PER_USER = 2
 
-    # --- Encode frames for frontend ---
-    _, buf_overlay = cv2.imencode('.jpg', overlay)
-    _, buf_heatmap = cv2.imencode('.jpg', heatmap_overlay)
-    overlay_b64 = base64.b64encode(buf_overlay).decode('utf-8')
-    heatmap_b64 = base64.b64encode(buf_heatmap).decode('utf-8')
+def build_zone_label_mask(zones, h, w):
+    labels = np.zeros((h, w), dtype=np.int32)
+    membership = [np.zeros(len(zones), dtype=np.int32)]
+    zone_mask = np.zeros((h, w), dtype=np.uint8)
+    for i, zone in enumerate(zones):
+        zone_mask.fill(0)
+        cv2.fillPoly(zone_mask, [zone["pts"]], 1)
+        inside = zone_mask.astype(bool)
+        covered = labels[inside]
+        if covered.size == 0:
+            continue
+        # Every existing label under this zone gets a new label = old set + zone i
+        remap = np.arange(len(membership), dtype=np.int32)
+        for old in np.unique(covered):
+            row = membership[old].copy()
+            row[i] = 1
+            remap[old] = len(membership)
+            membership.append(row)
+        labels[inside] = remap[covered]
+    if len(membership) <= np.iinfo(np.uint16).max:
+        labels = labels.astype(np.uint16)
+    return labels, np.array(membership, dtype=np.int32)
 
-    return jsonify({
-        "zone_counts": zone_counts,
-        "overlay_frame": overlay_b64,
-        "heatmap_frame": heatmap_b64,
-        "finished": False
-    }), 200
+class ZoneCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}   # user_id -> {"zones": [...], "masks": OrderedDict((h, w) -> (labels, membership))}
+        self.versions = {}  # user_id -> zone-set version, bumped on every change
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+
+    def fingerprint(self, user_id):
+        """Content hash of the user's zone set; stable across restarts, unlike the cache versions."""
+        zones = self.get_zones(user_id)
+        payload = json.dumps([[zone["id"], zone["pts"].tolist()] for zone in zones])
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def get_zones(self, user_id):
+        """Parsed zones for a user: id, name, np.int32 polygon and label position."""
+        return self._entry(user_id)["zones"]
+
+    def _entry(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            version = self.versions.get(user_id, 0)
+        if entry is not None:
+            return entry
+
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT id, name, coordinates FROM zones WHERE user_id=%s", (user_id,))
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+
+        zones = []
+        for row in rows:
+            coords = json.loads(row["coordinates"])
+            if not coords:
+                continue
+            zones.append({
+                "id": row["id"],
+                "name": row["name"],
+                "pts": np.array([[p["x"], p["y"]] for p in coords], dtype=np.int32),
+                "label_pos": (int(sum(p['x'] for p in coords) / len(coords)),
+                              int(sum(p['y'] for p in coords) / len(coords)))
+            })
+        entry = {"zones": zones, "masks": OrderedDict()}
+
+        with self.lock:
+            # Don't cache a result that a concurrent save/delete already made stale
+            if self.versions.get(user_id, 0) == version:
+                self.entries[user_id] = entry
+        return entry
+
+    def get_label_mask(self, user_id, shape):
+        entry = self._entry(user_id)
+        with self.lock:
+            cached = entry["masks"].get(shape)
+            if cached is not None:
+                entry["masks"].move_to_end(shape)
+                return entry["zones"], cached
+        cached = build_zone_label_mask(entry["zones"], *shape)
+        with self.lock:
+            entry["masks"][shape] = cached
+            while len(entry["masks"]) > ZONE_MASK_SHAPES_PER_USER:
+                entry["masks"].popitem(last=False)
+        return entry["zones"], cached
+
+zone_cache = ZoneCache()
+
+def zone_membership(label_mask, centers):
+    """Bool (len(centers), len(zones)) matrix: which zones each center is in."""
+    labels, membership = label_mask
+    if not centers:
+        return np.zeros((0, membership.shape[1]), dtype=bool)
+    pts = np.asarray(centers, dtype=np.intp)
+    return membership[labels[pts[:, 1], pts[:, 0]]].astype(bool)
 
 # ==============================
-# AUTH ROUTES (unchanged)
+# ZONE ANALYSIS WRITE-BEHIND BUFFER
 # ==============================
-@app.route('/register', methods=['POST'])
-def register():
-    data = request.get_json()
-    username = data.get('username', '').strip()
-    email = data.get('email', '').strip()
-    password = data.get('password', '')
+# Rows from every session are buffered in memory and written with
+# executemany() by a background thread, either once ZONE_WRITE_BATCH_SIZE
+# rows are waiting or every ZONE_WRITE_FLUSH_INTERVAL seconds. The buffer
+# holds at most ZONE_WRITE_MAX_PENDING rows; when it is full the overflow
+# policy decides what happens:
+#   drop_oldest - discard the oldest buffered row (default)
+#   drop_newest - discard the incoming row
+#   block       - make the producer wait up to ZONE_WRITE_BLOCK_TIMEOUT
+#                 seconds for space, then discard the incoming row
+# After a failed flush (database down, schema missing) the writer waits
+# ZONE_WRITE_FLUSH_INTERVAL before retrying, doubling the wait after each
+# further failure up to ZONE_WRITE_MAX_BACKOFF seconds, however many rows
+# are buffered.
+ZONE_WRITE_BATCH_SIZE = int(os.environ.get("ZONE_WRITE_BATCH_SIZE", 500))
+ZONE_WRITE_FLUSH_INTERVAL = float(os.environ.get("ZONE_WRITE_FLUSH_INTERVAL", 1.0))
+ZONE_WRITE_MAX_PENDING = int(os.environ.get("ZONE_WRITE_MAX_PENDING", 50000))
+ZONE_WRITE_OVERFLOW_POLICY = os.environ.get("ZONE_WRITE_OVERFLOW_POLICY", "drop_oldest")
+ZONE_WRITE_BLOCK_TIMEOUT = float(os.environ.get("ZONE_WRITE_BLOCK_TIMEOUT", 2.0))
+ZONE_WRITE_MAX_BACKOFF = float(os.environ.get("ZONE_WRITE_MAX_BACKOFF", 30.0))
 
-    if not all([username, email, password]):
-        return jsonify({'message': 'All fields are required'}), 400
-    if len(password) < 6:
-        return jsonify({'message': 'Password must be at least 6 characters'}), 400
+ZONE_ANALYSIS_INSERT = """
+    INSERT INTO zone_analysis (user_id, timestamp, zone_id, people_count, entries, exits)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+# ==============================
+# ZONE ROLLUPS
+# ==============================
+# Minute- and hour-level aggregates per user and zone, maintained by the
+# writer in the same transaction as the raw rows. The dashboard reads these
+# instead of scanning zone_analysis with DATE()/HOUR(), and the primary keys
+# start with (user_id, bucket_start) so range filters use the index.
+# If the rollup upsert fails, the raw rows are still committed and their
+# rollups are retried with the next flush.
+#
+# The tables are created on first use (schema_connection()), so they exist
+# under `flask run` and WSGI servers too. The zone_analysis
+# indexes can take a while on a large table and are built in the
+# background; retries after a failure are spaced SCHEMA_RETRY_INTERVAL
+# seconds apart.
+# Raw rows older than ZONE_RAW_RETENTION_DAYS and minute rollups older than
+# ZONE_MINUTE_ROLLUP_RETENTION_DAYS are purged hourly (0 keeps them forever).
+ZONE_RAW_RETENTION_DAYS = int(os.environ.get("ZONE_RAW_RETENTION_DAYS", 0))
+ZONE_MINUTE_ROLLUP_RETENTION_DAYS = int(os.environ.get("ZONE_MINUTE_ROLLUP_RETENTION_DAYS", 0))
+ZONE_RETENTION_CHECK_INTERVAL = 3600
+ZONE_PURGE_CHUNK = 10000
+SCHEMA_RETRY_INTERVAL = 30
+
+ROLLUP_TABLES = {"minute": "zone_rollup_minute", "hour": "zone_rollup_hour"}
+
+ROLLUP_SCHEMA = [f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        user_id INT NOT NULL,
+        bucket_start DATETIME NOT NULL,
+        zone_id INT NOT NULL,
+        samples INT NOT NULL,
+        count_sum BIGINT NOT NULL,
+        count_min INT NOT NULL,
+        count_max INT NOT NULL,
+        entries INT NOT NULL,
+        exits INT NOT NULL,
+        PRIMARY KEY (user_id, bucket_start, zone_id)
+    )
+""" for table in ROLLUP_TABLES.values()]
+
+ZONE_ANALYSIS_INDEXES = [
+    "CREATE INDEX idx_zone_analysis_user_time ON zone_analysis (user_id, timestamp)",
+    # Time series of one zone read raw rows in (timestamp, id) order
+    "CREATE INDEX idx_zone_analysis_user_zone_time ON zone_analysis (user_id, zone_id, timestamp, id)",
+]
+
+# Rollup tables created before count_min existed; old rows report a minimum of 0
+ROLLUP_MIGRATIONS = [f"ALTER TABLE {table} ADD COLUMN count_min INT NOT NULL DEFAULT 0 AFTER count_sum"
+                     for table in ROLLUP_TABLES.values()]
 
+ROLLUP_UPSERT = """
+    INSERT INTO {table} (user_id, bucket_start, zone_id, samples, count_sum, count_min, count_max, entries, exits)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        samples = samples + VALUES(samples),
+        count_sum = count_sum + VALUES(count_sum),
+        count_min = LEAST(count_min, VALUES(count_min)),
+        count_max = GREATEST(count_max, VALUES(count_max)),
+        entries = entries + VALUES(entries),
+        exits = exits + VALUES(exits)
+"""
+
+def apply_schema(statements, migrations=(), label="Schema"):
+    """Run CREATE statements, then migrations that may already have been applied."""
     conn = get_db_connection()
     if not conn:
-        return jsonify({'message': 'Database connection failed'}), 500
+        return False
     cursor = conn.cursor()
+    try:
+        for statement in statements:
+            cursor.execute(statement)
+        for statement in migrations:
+            try:
+                cursor.execute(statement)
+            except mysql.connector.Error as e:
+                # ER_DUP_FIELDNAME / ER_DUP_KEYNAME: already applied
+                if e.errno not in (1060, 1061):
+                    raise
+        conn.commit()
+        return True
+    except mysql.connector.Error as e:
+        print(f"{label} setup failed:", e)
+        return False
+    finally:
+        cursor.close()
+        conn.close()
 
-    cursor.execute("SELECT id FROM users WHERE email=%s", (email,))
-    if cursor.fetchone():
+def init_rollup_schema():
+    """Create the rollup tables if they are missing."""
+    return apply_schema(ROLLUP_SCHEMA, ROLLUP_MIGRATIONS, "Rollup schema")
+
+schema_lock = threading.Lock()
+schema_state = {"ready": False, "next_attempt": 0.0}
+
+def ensure_schema():
+    """Create the rollup, video and job tables once per process. Returns True once they exist."""
+    if schema_state["ready"]:
+        return True
+    with schema_lock:
+        if schema_state["ready"]:
+            return True
+        if time.monotonic() < schema_state["next_attempt"]:
+            return False
+        if not (init_rollup_schema() and init_job_schema()):
+            schema_state["next_attempt"] = time.monotonic() + SCHEMA_RETRY_INTERVAL
+            return False
+        schema_state["ready"] = True
+    threading.Thread(target=apply_schema, args=((), ZONE_ANALYSIS_INDEXES, "zone_analysis index"),
+                     daemon=True).start()
+    return True
+
+def schema_connection():
+    """get_db_connection() for code that uses the rollup, video or job tables."""
+    return get_db_connection() if ensure_schema() else None
+
+def rollup_rows(rows):
+    """
+    Aggregate raw (user_id, timestamp, zone_id, count, entries, exits) rows
+    into upsert parameters for each rollup resolution.
+    """
+    buckets = {"minute": {}, "hour": {}}
+    for user_id, timestamp, zone_id, count, entries, exits in rows:
+        minute = timestamp.replace(second=0, microsecond=0)
+        for resolution, bucket_start in (("minute", minute), ("hour", minute.replace(minute=0))):
+            key = (user_id, bucket_start, zone_id)
+            agg = buckets[resolution].get(key)
+            if agg is None:
+                buckets[resolution][key] = [1, count, count, count, entries, exits]
+            else:
+                agg[0] += 1
+                agg[1] += count
+                agg[2] = min(agg[2], count)
+                agg[3] = max(agg[3], count)
+                agg[4] += entries
+                agg[5] += exits
+    return {resolution: [key + tuple(agg) for key, agg in aggs.items()]
+            for resolution, aggs in buckets.items()}
+
+def insert_zone_rows(cursor, rows, batch_size=ZONE_WRITE_BATCH_SIZE):
+    for i in range(0, len(rows), batch_size):
+        cursor.executemany(ZONE_ANALYSIS_INSERT, rows[i:i + batch_size])
+
+def upsert_rollups(cursor, rows):
+    for resolution, params in rollup_rows(rows).items():
+        cursor.executemany(ROLLUP_UPSERT.format(table=ROLLUP_TABLES[resolution]), params)
+
+def write_zone_rows(cursor, rows, batch_size=ZONE_WRITE_BATCH_SIZE):
+    """Insert raw zone_analysis rows and fold them into the rollups (caller commits)."""
+    insert_zone_rows(cursor, rows, batch_size)
+    upsert_rollups(cursor, rows)
+
+def purge_expired_rows():
+    """Delete raw rows and minute rollups past their retention, in small chunks."""
+    targets = []
+    if ZONE_RAW_RETENTION_DAYS > 0:
+        targets.append(("zone_analysis", "timestamp", ZONE_RAW_RETENTION_DAYS))
+    if ZONE_MINUTE_ROLLUP_RETENTION_DAYS > 0:
+        targets.append((ROLLUP_TABLES["minute"], "bucket_start", ZONE_MINUTE_ROLLUP_RETENTION_DAYS))
+    if not targets:
+        return
+    conn = get_db_connection()
+    if not conn:
+        return
+    cursor = conn.cursor()
+    try:
+        for table, column, days in targets:
+            cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+            while True:
+                cursor.execute(f"DELETE FROM {table} WHERE {column} < %s LIMIT {ZONE_PURGE_CHUNK}", (cutoff,))
+                conn.commit()
+                if cursor.rowcount < ZONE_PURGE_CHUNK:
+                    break
+    except mysql.connector.Error as e:
+        print("Retention purge failed:", e)
+    finally:
         cursor.close()
         conn.close()
-        return jsonify({'message': 'User already exists'}), 400
 
-    hashed = generate_password_hash(password)
-    cursor.execute("INSERT INTO users (username, email, password) VALUES (%s, %s, %s)",
-                   (username, email, hashed))
-    conn.commit()
-    cursor.close()
-    conn.close()
+class ZoneAnalysisWriter:
+    def __init__(self, batch_size=ZONE_WRITE_BATCH_SIZE, flush_interval=ZONE_WRITE_FLUSH_INTERVAL,
+                 max_pending=ZONE_WRITE_MAX_PENDING, overflow_policy=ZONE_WRITE_OVERFLOW_POLICY):
+        if overflow_policy not in ("drop_oldest", "drop_newest", "block"):
+            raise ValueError(f"Unknown zone write overflow policy: {overflow_policy}")
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max(self.batch_size, max_pending)
+        self.overflow_policy = overflow_policy
+        self.rows = deque()
+        # Rows already written whose rollup upsert failed; retried with the next flush
+        self.rollup_backlog = []
+        self.cond = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.thread_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.dropped_rows = 0
+        self.written_rows = 0
+        self.failed_flushes = 0
+        self.failed_rollups = 0
+        self.thread = None
+
+    def add_rows(self, rows):
+        if not rows:
+            return
+        self._ensure_running()
+        with self.cond:
+            for row in rows:
+                if len(self.rows) >= self.max_pending:
+                    if self.overflow_policy == "block":
+                        self.cond.notify_all()
+                        self.cond.wait_for(lambda: len(self.rows) < self.max_pending,
+                                           timeout=ZONE_WRITE_BLOCK_TIMEOUT)
+                    if len(self.rows) >= self.max_pending:
+                        self.dropped_rows += 1
+                        if self.overflow_policy != "drop_oldest":
+                            continue
+                        self.rows.popleft()
+                self.rows.append(row)
+            if len(self.rows) >= self.batch_size:
+                self.cond.notify_all()
+
+    def pending(self):
+        with self.cond:
+            return len(self.rows)
+
+    def flush(self):
+        """Write every buffered row now. Returns the number of rows written."""
+        with self.flush_lock:
+            with self.cond:
+                batch = list(self.rows)
+                self.rows.clear()
+                self.cond.notify_all()
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            conn = schema_connection()
+            if not conn:
+                self.failed_flushes += 1
+                self._requeue(batch)
+                return 0
+            cursor = conn.cursor()
+            try:
+                insert_zone_rows(cursor, batch, self.batch_size)
+                rollup_batch = self.rollup_backlog + batch
+                # A failed rollup upsert only undoes itself; the raw rows are still committed
+                cursor.execute("SAVEPOINT zone_rollups")
+                try:
+                    upsert_rollups(cursor, rollup_batch)
+                    cursor.execute("RELEASE SAVEPOINT zone_rollups")
+                    backlog = []
+                except mysql.connector.Error as e:
+                    print("zone rollup upsert failed:", e)
+                    cursor.execute("ROLLBACK TO SAVEPOINT zone_rollups")
+                    self.failed_rollups += 1
+                    backlog = rollup_batch[-self.max_pending:]
+                conn.commit()
+                self.rollup_backlog = backlog
+            except mysql.connector.Error as e:
+                print("zone_analysis flush error:", e)
+                try:
+                    conn.rollback()
+                except mysql.connector.Error:
+                    pass
+                self.failed_flushes += 1
+                self._requeue(batch)
+                return 0
+            finally:
+                cursor.close()
+                conn.close()
+            self.written_rows += len(batch)
+            observe_stage("db_write", time.perf_counter() - started)
+            return len(batch)
+
+    def close(self):
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5)
+        self.flush()
+
+    def _requeue(self, batch):
+        # Put failed rows back in front, keeping the newest rows if over the cap
+        with self.cond:
+            self.rows.extendleft(reversed(batch))
+            while len(self.rows) > self.max_pending:
+                self.rows.popleft()
+                self.dropped_rows += 1
+
+    def _ensure_running(self):
+        with self.thread_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        next_purge = time.monotonic()
+        backoff = 0.0
+        while not self.stop_event.is_set():
+            with self.cond:
+                if backoff:
+                    # A full buffer must not trigger another attempt before the backoff ends
+                    self.cond.wait_for(self.stop_event.is_set, timeout=backoff)
+                else:
+                    self.cond.wait_for(lambda: len(self.rows) >= self.batch_size or self.stop_event.is_set(),
+                                       timeout=self.flush_interval)
+            try:
+                failures = self.failed_flushes
+                self.flush()
+                if self.failed_flushes != failures:
+                    backoff = min(max(self.flush_interval, backoff * 2), ZONE_WRITE_MAX_BACKOFF)
+                    print(f"zone_analysis flush failed, retrying in {backoff:g}s "
+                          f"({self.pending()} rows buffered)")
+                else:
+                    backoff = 0.0
+                if time.monotonic() >= next_purge:
+                    next_purge = time.monotonic() + ZONE_RETENTION_CHECK_INTERVAL
+                    purge_expired_rows()
+            except Exception as e:
+                print("zone_analysis writer error:", e)
+
+zone_writer = ZoneAnalysisWriter()
+atexit.register(zone_writer.close)
+
+# ==============================
+# SERVER-SENT EVENTS
+# ==============================
+# Each dashboard holds one authenticated /events connection. The pipeline
+# publishes per-zone counts and entry/exit deltas only when something changed,
+# so idle sessions cost nothing. Slow subscribers keep the newest events: the
+# oldest queued event is dropped when a subscriber queue is full.
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", 100))
+EVENT_KEEPALIVE_SECONDS = 15
+
+class EventBroker:
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.subscribers = {}      # user_id -> set of queues
+        self.last_published = {}   # session_key -> last zone_counts sent
+        self.dropped_events = 0
+
+    def subscribe(self, user_id):
+        q = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(q)
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self.lock:
+            subs = self.subscribers.get(user_id)
+            if subs:
+                subs.discard(q)
+                if not subs:
+                    del self.subscribers[user_id]
+
+    def publish(self, user_id, event, data):
+        with self.lock:
+            subs = list(self.subscribers.get(user_id, ()))
+        for q in subs:
+            while True:
+                try:
+                    q.put_nowait((event, data))
+                    break
+                except queue.Full:
+                    self.dropped_events += 1
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def publish_counts(self, user_id, session_key, zone_counts, entries, exits):
+        moved = any(entries.values()) or any(exits.values())
+        with self.lock:
+            changed = self.last_published.get(session_key) != zone_counts
+            self.last_published[session_key] = dict(zone_counts)
+        if not (changed or moved):
+            return
+        self.publish(user_id, "zone_counts", {
+            "source": session_key.split(":", 1)[0],
+            "zone_counts": zone_counts,
+            "entries": {k: v for k, v in entries.items() if v},
+            "exits": {k: v for k, v in exits.items() if v}
+        })
+
+    def reset(self, session_key):
+        with self.lock:
+            self.last_published.pop(session_key, None)
+
+def generate_events(user_id, q):
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event, data = q.get(timeout=EVENT_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    finally:
+        event_broker.unsubscribe(user_id, q)
+
+event_broker = EventBroker()
+
+# ==============================
+# HEATMAP ACCUMULATION
+# ==============================
+# Each session keeps a low-resolution occupancy grid (HEATMAP_SCALE of the
+# frame size). Track centers are added as points and the live grid decays
+# with a half-life of HEATMAP_HALF_LIFE seconds, so the heatmap shows recent
+# movement rather than one instant. The grid is stored unblurred; blurring is
+# linear, so blur, upscale and colorize happen only when a client asks for
+# an image. A second, non-decaying grid counts person-frames for the whole
+# session, with a snapshot every HEATMAP_SNAPSHOT_SECONDS so any time window
+# can be read back as the difference of two snapshots.
+HEATMAP_SCALE = float(os.environ.get("HEATMAP_SCALE", 0.125))
+HEATMAP_HALF_LIFE = float(os.environ.get("HEATMAP_HALF_LIFE", 2.0))
+HEATMAP_SNAPSHOT_SECONDS = float(os.environ.get("HEATMAP_SNAPSHOT_SECONDS", 60))
+HEATMAP_MAX_SNAPSHOTS = int(os.environ.get("HEATMAP_MAX_SNAPSHOTS", 240))
+HEATMAP_BLUR_PIXELS = 41  # blur size at full resolution, as before
+
+class HeatmapAccumulator:
+    def __init__(self, frame_shape, scale=HEATMAP_SCALE, half_life=HEATMAP_HALF_LIFE):
+        h, w = frame_shape[:2]
+        self.frame_shape = (h, w)
+        self.grid_shape = (max(1, math.ceil(h * scale)), max(1, math.ceil(w * scale)))
+        self.scale_y = self.grid_shape[0] / h
+        self.scale_x = self.grid_shape[1] / w
+        self.half_life = half_life
+        self.live = np.zeros(self.grid_shape, dtype=np.float32)
+        self.total = np.zeros(self.grid_shape, dtype=np.float32)
+        self.snapshots = deque(maxlen=HEATMAP_MAX_SNAPSHOTS)  # (time, copy of total)
+        self.started_at = None
+        self.last_time = None
+        self.background = None
+        self.lock = threading.Lock()
+
+    def add(self, centers, now, frame=None):
+        """Decay the live grid to `now`, then add one point per (x, y) center."""
+        with self.lock:
+            if self.started_at is None:
+                self.started_at = now
+            if self.last_time is not None and now > self.last_time and self.half_life > 0:
+                self.live *= 0.5 ** ((now - self.last_time) / self.half_life)
+            self.last_time = now
+            if frame is not None:
+                self.background = frame
+
+            if centers:
+                pts = np.asarray(centers, dtype=np.float64)
+                gx = np.clip((pts[:, 0] * self.scale_x).astype(np.intp), 0, self.grid_shape[1] - 1)
+                gy = np.clip((pts[:, 1] * self.scale_y).astype(np.intp), 0, self.grid_shape[0] - 1)
+                np.add.at(self.live, (gy, gx), 1.0)
+                np.add.at(self.total, (gy, gx), 1.0)
+
+            last_snapshot = self.snapshots[-1][0] if self.snapshots else self.started_at
+            if not self.snapshots or now - last_snapshot >= HEATMAP_SNAPSHOT_SECONDS:
+                self.snapshots.append((now, self.total.copy()))
+            return self.live.copy()
+
+    def occupancy(self, start=None, end=None):
+        """Person-frames per grid cell between two session times (whole session by default)."""
+        with self.lock:
+            end_total = self.total.copy() if end is None else self._cumulative_at(end)
+            if start is None:
+                return end_total
+            return np.maximum(end_total - self._cumulative_at(start), 0)
+
+    def _cumulative_at(self, t):
+        # Newest snapshot taken at or before t; older history than the
+        # retained snapshots is clamped to the oldest one
+        if self.last_time is not None and t >= self.last_time:
+            return self.total.copy()
+        best = None
+        for snap_time, snap in self.snapshots:
+            if snap_time > t:
+                break
+            best = snap
+        return best.copy() if best is not None else np.zeros(self.grid_shape, dtype=np.float32)
+
+def render_heatmap(frame, grid, size=None):
+    """
+    Blur, upscale and colorize a heat grid and blend it over frame. Without a
+    frame the bare heatmap is returned at size (h, w).
+    """
+    h, w = frame.shape[:2] if frame is not None else size
+    # Blur in grid cells, so frames scaled down for a viewer look the same
+    ksize = max(3, int(HEATMAP_BLUR_PIXELS * HEATMAP_SCALE) | 1)
+    blurred = cv2.GaussianBlur(grid, (ksize, ksize), 0)
+    peak = float(blurred.max())
+    scaled = np.clip(blurred * (255.0 / peak), 0, 255).astype(np.uint8) if peak > 0 else np.zeros_like(blurred, dtype=np.uint8)
+    heatmap_colored = cv2.applyColorMap(cv2.resize(scaled, (w, h), interpolation=cv2.INTER_LINEAR), cv2.COLORMAP_JET)
+    if frame is None:
+        return heatmap_colored
+    return cv2.addWeighted(frame, 0.5, heatmap_colored, 0.5, 0)
+
+class HeatmapStore:
+    """Accumulators by session key; kept after a session ends so its heatmap can still be read."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.accumulators = {}
+
+    def get(self, key, frame_shape):
+        with self.lock:
+            acc = self.accumulators.get(key)
+            if acc is None or acc.frame_shape != tuple(frame_shape[:2]):
+                acc = HeatmapAccumulator(frame_shape)
+                self.accumulators[key] = acc
+            return acc
+
+    def find(self, key):
+        with self.lock:
+            return self.accumulators.get(key)
+
+    def reset(self, key):
+        with self.lock:
+            self.accumulators.pop(key, None)
+
+heatmap_store = HeatmapStore()
+
+# ==============================
+# FRAME ANALYSIS PIPELINE
+# ==============================
+def analyze_frame(user_id, frame, session_key, frame_time=None, timestamp=None, row_buffer=None):
+    """
+    Run YOLO + DeepSORT + zone counting on one frame and queue the per-zone
+    rows for zone_analysis. session_key selects the tracker in tracker_pool;
+    frame_time (seconds, defaults to wall clock) drives dwell times and
+    timestamp (default now) stamps the rows. Rows go to zone_writer, or are
+    appended to row_buffer for callers that write them themselves.
+    Returns the zone counts, the tracked boxes and the session's heat grid;
+    the overlay and heatmap images are rendered only on request (result_image).
+    result["timings"] holds the seconds spent in each stage of this frame.
+    """
+    started_at = time.perf_counter()
+    timings = {}
+    now = time.time() if frame_time is None else frame_time
+
+    h, w, _ = frame.shape
+    # One snapshot of the zones and their label mask for the whole frame, so a
+    # zone saved or deleted meanwhile cannot mix two zone sets
+    zones, label_mask = zone_cache.get_label_mask(user_id, (h, w))
+    cadence = tracker_pool.session(session_key)["cadence"]
+    tracks = None
+    stage_start = time.perf_counter()
+    if not cadence.should_detect(frame):
+        # None when the tracker was evicted since the last detection
+        tracks = tracker_pool.predict_tracks(session_key)
+    detected = tracks is None
+
+    if detected:
+        # The detect stage is the detector only: ROI crop, resize and inference
+        stage_start = time.perf_counter()
+        roi = detection_roi(zones, (h, w)) if DETECT_ZONE_ROI else None
+        if roi:
+            x0, y0, x1, y1 = roi
+            inference_frame, scale = inference_input(np.ascontiguousarray(frame[y0:y1, x0:x1]))
+        else:
+            x0 = y0 = 0
+            inference_frame, scale = inference_input(frame)
+        result = inference_scheduler.infer(inference_frame)
+        timings["detect"] = time.perf_counter() - stage_start
+        cadence.record_detection(frame, timings["detect"])
+
+        # DeepSORT tracking; skipped frames use the predicted track positions
+        stage_start = time.perf_counter()
+        # Detections for DeepSORT, back in full-frame coordinates
+        dets_for_tracker = person_detections(result, scale, (x0, y0))
+        tracks = tracker_pool.update_tracks(session_key, dets_for_tracker, frame)
+    person_centers = []
+    track_boxes = []
+    alive_ids = set()
+    confirmed_ids = []
+    in_frame = []
+    for track in tracks:
+        alive_ids.add(track.track_id)
+        if not track.is_confirmed():
+            continue
+        track_id = track.track_id
+        ltrb = track.to_ltrb()
+        x1, y1, x2, y2 = map(int, ltrb)
+        cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
+        track_boxes.append((track_id, x1, y1, x2, y2))
+
+        confirmed_ids.append(track_id)
+        in_frame.append(0 <= cy < h and 0 <= cx < w)
+        if in_frame[-1]:
+            person_centers.append((cx, cy))
+    timings["track"] = time.perf_counter() - stage_start
+
+    # Heatmap: incremental update of the session's decaying grid
+    stage_start = time.perf_counter()
+    heat = heatmap_store.get(session_key, frame.shape).add(person_centers, now, frame)
+    timings["heatmap"] = time.perf_counter() - stage_start
+
+    # Zone counting: one mask lookup for every person in every zone. Tracks
+    # outside the frame are in no zone.
+    stage_start = time.perf_counter()
+    membership = np.zeros((len(confirmed_ids), len(zones)), dtype=bool)
+    membership[np.array(in_frame, dtype=bool)] = zone_membership(label_mask, person_centers)
+    counts = membership.sum(axis=0)
+
+    # Entries/exits are real per-track transitions between frames
+    entries, exits, zone_dwell = tracker_pool.update_zone_state(
+        session_key, [zone["id"] for zone in zones], confirmed_ids, membership, alive_ids, now, detected)
+
+    zone_counts = {}
+    timestamp = timestamp or datetime.datetime.now()
+    rows = []
+    zone_entries = {}
+    zone_exits = {}
+
+    for zone, current_count, entries_this_zone, exits_this_zone in zip(
+            zones, counts.tolist(), entries.tolist(), exits.tolist()):
+        zone_counts[zone["id"]] = current_count
+
+        rows.append((user_id, timestamp, zone["id"], current_count, entries_this_zone, exits_this_zone))
+        zone_entries[zone["id"]] = entries_this_zone
+        zone_exits[zone["id"]] = exits_this_zone
+    timings["zones"] = time.perf_counter() - stage_start
+
+    # Rows are written by the background writer, not on the request path
+    if row_buffer is not None:
+        row_buffer.extend(rows)
+    else:
+        zone_writer.add_rows(rows)
+    event_broker.publish_counts(user_id, session_key, zone_counts, zone_entries, zone_exits)
+    timings["total"] = time.perf_counter() - started_at
+    for stage, seconds in timings.items():
+        observe_stage(stage, seconds)
+    metrics.inc("crowd_frames_analyzed_total", source=session_key.split(":", 1)[0])
+
+    return {
+        "zone_counts": zone_counts,
+        "zone_dwell": zone_dwell,
+        "detected": detected,
+        "frame": frame,
+        "zones": zones,
+        "tracks": track_boxes,
+        "heat": heat,
+        "timings": timings,
+        # Filled in by result_image()/encoded_view() for the views someone watches
+        "images": {},
+        "encoded": {},
+        "render_lock": threading.Lock()
+    }
+
+def scaled_frame(frame, width=None):
+    """Frame scaled down to at most `width` pixels wide, and the scale factor used."""
+    h, w = frame.shape[:2]
+    if not width or width >= w:
+        return frame, 1.0
+    scale = width / w
+    return cv2.resize(frame, (width, max(1, round(h * scale))), interpolation=cv2.INTER_AREA), scale
+
+def render_overlay(result, width=None):
+    """Draw the tracked boxes and zone counts of an analysis result on a copy of its frame."""
+    overlay, scale = scaled_frame(result["frame"], width)
+    if overlay is result["frame"]:
+        overlay = overlay.copy()
+    for track_id, *box in result["tracks"]:
+        x1, y1, x2, y2 = (int(v * scale) for v in box)
+        cv2.rectangle(overlay, (x1, y1), (x2, y2), (255, 0, 0), 2)
+        cv2.putText(overlay, f"ID {track_id}", (x1, y1 - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+
+    for zone in result["zones"]:
+        # Draw zone boundary
+        pts = zone["pts"] if scale == 1.0 else (zone["pts"] * scale).astype(np.int32)
+        cv2.polylines(overlay, [pts], isClosed=True, color=(0, 255, 0), thickness=2)
+
+        cx, cy = (int(v * scale) for v in zone["label_pos"])
+        label = f"{zone['name']}: {result['zone_counts'][zone['id']]}"
+
+        (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+        cv2.rectangle(overlay, (cx, cy - th - 8), (cx + tw + 8, cy + 6), (0, 0, 0), -1)
+        cv2.putText(overlay, label, (cx + 4, cy - 2), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    return overlay
+
+# ==============================
+# RENDERING (ON DEMAND)
+# ==============================
+# Counting never draws anything. Images are rendered and JPEG-encoded only
+# when a client asks for a view of a result, at the width it asked for, and
+# encodes are cached on the result so every viewer of a session shares them.
+# Stream viewers are also capped at a frame rate (?fps=, default
+# STREAM_DEFAULT_FPS, 0 = every analyzed frame); frames in between are never
+# rendered.
+STREAM_DEFAULT_FPS = float(os.environ.get("STREAM_DEFAULT_FPS", 15))
+STREAM_JPEG_QUALITY = int(os.environ.get("STREAM_JPEG_QUALITY", 80))
+
+def encode_jpeg(image):
+    ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, STREAM_JPEG_QUALITY])
+    return buffer.tobytes() if ret else None
+
+def encode_jpeg_base64(data):
+    return base64.b64encode(data).decode('utf-8')
+
+def stream_options():
+    """Viewer limits from ?fps=&width=; returns (frame interval in seconds, width or None)."""
+    try:
+        fps = float(request.args.get("fps", STREAM_DEFAULT_FPS))
+        width = int(request.args.get("width", 0))
+    except ValueError:
+        raise ValueError("fps and width must be numbers")
+    return (1.0 / fps if fps > 0 else 0.0), (width if width > 0 else None)
+
+def pace(last_sent, interval):
+    """Sleep until `interval` seconds after last_sent; returns when the next frame may go out."""
+    delay = last_sent + interval - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+    return time.monotonic()
+
+ANALYSIS_VIEWS = ("overlay", "heatmap")
+
+def parse_views(value):
+    """Parse ?views=overlay,heatmap (or 'both'); defaults to both images."""
+    if not value or value == "both":
+        return set(ANALYSIS_VIEWS)
+    return {v.strip() for v in value.split(",") if v.strip() in ANALYSIS_VIEWS}
+
+def result_image(result, view, width=None):
+    """Image for one view of an analysis result, rendered on first use. Call with render_lock held."""
+    key = (view, width)
+    image = result["images"].get(key)
+    if image is None:
+        if view == "overlay":
+            image = render_overlay(result, width)
+        elif view == "heatmap":
+            image = render_heatmap(scaled_frame(result["frame"], width)[0], result["heat"])
+        else:  # both, side by side in the requested width
+            half = width // 2 if width else None
+            image = np.hstack((result_image(result, "overlay", half), result_image(result, "heatmap", half)))
+        result["images"][key] = image
+    return image
+
+def encoded_view(result, view, width=None):
+    """JPEG bytes of one view of a result, encoded once per (view, width) for all viewers."""
+    key = (view, width)
+    with result["render_lock"]:
+        data = result["encoded"].get(key)
+        if data is None:
+            image = result_image(result, view, width)
+            started = time.perf_counter()
+            data = encode_jpeg(image)
+            observe_stage("encode", time.perf_counter() - started)
+            result["encoded"][key] = data
+        return data
+
+def encode_views_base64(result, views, width=None):
+    """Base64 JPEGs for the requested views only, keyed like the JSON responses."""
+    encoded = {view: encoded_view(result, view, width) for view in ANALYSIS_VIEWS if view in views}
+    started = time.perf_counter()
+    payload = {f"{view}_frame": encode_jpeg_base64(data) for view, data in encoded.items()}
+    observe_stage("base64", time.perf_counter() - started)
+    return payload
+
+def request_width():
+    """Optional ?width= for single-image responses; invalid values mean full size."""
+    width = request.args.get("width", "")
+    return int(width) if width.isdigit() and int(width) > 0 else None
+
+def generate_analysis_frames(session, view, interval=0.0, width=None):
+    """
+    Multipart MJPEG stream of a session's analyzed frames. Only the requested
+    view is encoded, only when the worker has produced a new frame, and at
+    most once per `interval` seconds for this viewer.
+    """
+    last_frame = None
+    last_sent = time.monotonic()
+    session.add_viewer(1)
+    try:
+        while True:
+            with session.result_cond:
+                session.result_cond.wait_for(
+                    lambda: session.finished or (session.latest_result is not None
+                                                 and session.latest_result["frame_number"] != last_frame),
+                    timeout=1.0)
+                result = session.latest_result
+            if result is None or result["frame_number"] == last_frame:
+                if session.finished:
+                    break
+                continue
+            last_frame = result["frame_number"]
+
+            data = encoded_view(result, view, width)
+            if data is None:
+                continue
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n'
+                   b'X-Frame-Number: ' + str(last_frame).encode() + b'\r\n\r\n' +
+                   data + b'\r\n')
+            last_sent = pace(last_sent, interval)
+    finally:
+        session.add_viewer(-1)
+
+# ==============================
+# GLOBAL STATE FOR LIVE ANALYSIS
+# ==============================
+video_sessions = {}
+session_lock = threading.Lock()
+user_session_locks = {}  # user_id -> lock held while that user's session is replaced or stopped
+
+def user_session_lock(user_id):
+    with session_lock:
+        return user_session_locks.setdefault(user_id, threading.Lock())
+
+def stop_video_session(user_id, timeout=5):
+    """Remove and stop the user's video session (call with user_session_lock held)."""
+    with session_lock:
+        session = video_sessions.pop(user_id, None)
+    if session:
+        session.stop(timeout=timeout)
+    return session
+# ==============================
+# CAMERA REGISTRY
+# ==============================
+# Named live sources: device indexes, video files or RTSP/HTTP URLs. Extra
+# sources can be added as JSON, e.g.
+#   CAMERA_SOURCES='{"lobby": "rtsp://10.0.0.5/stream", "demo": "uploads/demo.mp4"}'
+# A local file plays in a loop at its native fps, so it can stand in for a
+# real camera during development.
+#
+# The capture thread hands every frame to one bounded FrameQueue per
+# consumer (each MJPEG viewer, each user's live analysis), so a slow
+# consumer never holds up the capture or the other consumers. When a queue
+# is full its policy decides what goes:
+#   drop_oldest - the oldest queued frame makes room (in order, with gaps)
+#   drop_newest - the new frame is dropped (in order, no skipping ahead)
+#   latest      - only the newest frame is kept (lowest latency)
+# Frames that waited longer than LIVE_MAX_LAG_MS are discarded (on read, or
+# to make room for a new frame), so end-to-end latency stays bounded
+# whatever the policy. Dropped and lagged
+# frames are counted per camera and consumer for /metrics.
+DEFAULT_CAMERA = "default"
+CAMERA_SOURCES = {DEFAULT_CAMERA: 0}
+CAMERA_SOURCES.update(json.loads(os.environ.get("CAMERA_SOURCES", "{}")))
+CAMERA_RECONNECT_DELAY = 2.0
+FRAME_QUEUE_POLICIES = ("drop_oldest", "drop_newest", "latest")
+LIVE_QUEUE_SIZE = int(os.environ.get("LIVE_QUEUE_SIZE", os.environ.get("CAMERA_RING_SIZE", 4)))
+LIVE_STREAM_QUEUE_POLICY = os.environ.get("LIVE_STREAM_QUEUE_POLICY", "latest")
+LIVE_ANALYSIS_QUEUE_POLICY = os.environ.get("LIVE_ANALYSIS_QUEUE_POLICY", "latest")
+LIVE_MAX_LAG_MS = float(os.environ.get("LIVE_MAX_LAG_MS", 1000))
+
+def parse_camera_source(source):
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+class FrameQueue:
+    """Bounded hand-off of (seq, monotonic timestamp, frame) from a capture thread to one consumer."""
+    def __init__(self, policy, maxsize=LIVE_QUEUE_SIZE, max_lag_ms=LIVE_MAX_LAG_MS):
+        if policy not in FRAME_QUEUE_POLICIES:
+            raise ValueError(f"Unknown frame queue policy {policy!r} "
+                             f"(expected one of {', '.join(FRAME_QUEUE_POLICIES)})")
+        self.policy = policy
+        self.maxsize = 1 if policy == "latest" else max(1, maxsize)
+        self.max_lag = max(0.0, max_lag_ms) / 1000.0
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.lagged = 0
+
+    def put(self, item):
+        with self.cond:
+            if self.closed:
+                return
+            # Stale frames make room before anything fresh is dropped
+            while self.items and self.max_lag and item[1] - self.items[0][1] > self.max_lag:
+                self.items.popleft()
+                self.lagged += 1
+            if len(self.items) >= self.maxsize:
+                self.dropped += 1
+                if self.policy == "drop_newest":
+                    return
+                self.items.popleft()
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, timeout=1.0):
+        """
+        Next frame that has not waited longer than the lag limit, waiting up
+        to timeout for one. Returns (seq, frame) or (None, None).
+        """
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                while self.items:
+                    seq, captured_at, frame = self.items.popleft()
+                    if self.max_lag and time.monotonic() - captured_at > self.max_lag:
+                        self.lagged += 1
+                        continue
+                    return seq, frame
+                remaining = deadline - time.monotonic()
+                if self.closed or remaining <= 0:
+                    return None, None
+                self.cond.wait(remaining)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.items.clear()
+            self.cond.notify_all()
+
+class CameraSession:
+    """
+    One capture thread per source. Each consumer (MJPEG viewer or live
+    analysis) reads from its own bounded FrameQueue, so neither consumer
+    blocks the other or steals frames from it.
+    """
+    def __init__(self, name, source=0):
+        self.name = name
+        self.source = parse_camera_source(source)
+        self.is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+        self.cap = None
+        self.is_running = False
+        self.frame_lock = threading.Lock()
+        self.queues = {}  # consumer key -> (consumer kind, FrameQueue)
+        # Dropped/lagged totals of closed queues, by consumer kind
+        self.retired = {}
+        self.seq = 0
+        self.thread = None
+        # Shared JPEG encodes of the newest frame, one per requested width
+        self.encode_lock = threading.Lock()
+        self.encoded_seq = None
+        self.encoded = {}
+        self.viewers = 0
+
+    def start(self):
+        with self.frame_lock:
+            if self.is_running:
+                return
+            if self.cap is None or not self.cap.isOpened():
+                # Re-initialize the camera if it was closed
+                self.cap = open_video_capture(self.source)
+            if not self.cap.isOpened():
+                raise RuntimeError(f"Could not open camera '{self.name}'")
+            self.is_running = True
+            self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.frame_lock:
+            self.is_running = False
+            keys = list(self.queues)
+        for key in keys:
+            self.unsubscribe(key)
+        if self.thread and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+        with self.frame_lock:
+            if self.cap is not None and self.cap.isOpened():
+                self.cap.release()
+
+    def subscribe(self, key, kind, policy):
+        """
+        A fresh FrameQueue for consumer `key`, replacing any previous one.
+        Analysis consumers count as inference sources while subscribed, so the
+        batch scheduler only waits for cameras someone is analyzing.
+        """
+        frame_queue = FrameQueue(policy)
+        self.unsubscribe(key)
+        with self.frame_lock:
+            self.queues[key] = (kind, frame_queue)
+        if kind == "analysis":
+            inference_scheduler.register_source()
+        return frame_queue
+
+    def unsubscribe(self, key):
+        with self.frame_lock:
+            entry = self.queues.pop(key, None)
+            if entry is None:
+                return
+            kind, frame_queue = entry
+            dropped, lagged = self.retired.get(kind, (0, 0))
+            self.retired[kind] = (dropped + frame_queue.dropped, lagged + frame_queue.lagged)
+        frame_queue.close()
+        if kind == "analysis":
+            inference_scheduler.unregister_source()
+
+    def queue_stats(self):
+        """{consumer kind: (dropped frames, lagged frames)} since the camera was created."""
+        with self.frame_lock:
+            stats = dict(self.retired)
+            for kind, frame_queue in self.queues.values():
+                dropped, lagged = stats.get(kind, (0, 0))
+                stats[kind] = (dropped + frame_queue.dropped, lagged + frame_queue.lagged)
+        return stats
+
+    def _capture_loop(self):
+        frame_interval = 0
+        if self.is_file:
+            fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
+            frame_interval = 1.0 / fps
+        next_frame_at = time.monotonic()
+
+        while self.is_running:
+            ret, frame = self.cap.read()
+            if not ret:
+                if not self.is_running:
+                    break
+                if self.is_file:
+                    # Loop the stand-in file like an endless feed
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                # If frame read fails, try to re-init camera (e.g., if it was unplugged)
+                print(f"Live feed '{self.name}': failed to read frame, reconnecting.")
+                self.cap.release()
+                time.sleep(CAMERA_RECONNECT_DELAY)
+                self.cap = open_video_capture(self.source)
+                continue
+
+            with self.frame_lock:
+                self.seq += 1
+                item = (self.seq, time.monotonic(), frame)
+                queues = [frame_queue for _, frame_queue in self.queues.values()]
+            for frame_queue in queues:
+                frame_queue.put(item)
+
+            if frame_interval:
+                next_frame_at += frame_interval
+                delay = next_frame_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_frame_at = time.monotonic()
+
+    def add_viewer(self, delta):
+        with self.encode_lock:
+            self.viewers += delta
+
+    def encoded_frame(self, seq, frame, width=None):
+        """JPEG of a buffered frame, encoded once per (frame, width) for all viewers."""
+        with self.encode_lock:
+            if self.encoded_seq != seq:
+                self.encoded_seq = seq
+                self.encoded = {}
+            data = self.encoded.get(width)
+            if data is None:
+                started = time.perf_counter()
+                data = encode_jpeg(scaled_frame(frame, width)[0])
+                observe_stage("encode", time.perf_counter() - started)
+                self.encoded[width] = data
+            return data
+
+    def generate_frames(self, interval=0.0, width=None):
+        # Standard MJPEG streaming protocol, paced by the capture thread and
+        # the viewer's frame rate cap; this viewer reads its own frame queue
+        key = f"viewer:{uuid.uuid4().hex}"
+        frame_queue = self.subscribe(key, "stream", LIVE_STREAM_QUEUE_POLICY)
+        last_sent = time.monotonic()
+        self.add_viewer(1)
+        try:
+            while self.is_running and not frame_queue.closed:
+                seq, frame = frame_queue.get()
+                if frame is None:
+                    continue
+
+                # --- IMPORTANT: No detection or zone drawing here. Raw frames only. ---
+                # Frontend will overlay the zone drawing canvas.
+
+                frame_bytes = self.encoded_frame(seq, frame, width)
+                if frame_bytes is None:
+                    continue
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+                last_sent = pace(last_sent, interval)
+        finally:
+            self.add_viewer(-1)
+            self.unsubscribe(key)
+
+class CameraRegistry:
+    """
+    Configured cameras and their capture sessions. A camera runs while at
+    least one user holds it (start/release), so one user stopping a shared
+    camera does not cut everyone else off.
+    """
+    def __init__(self, sources):
+        self.sources = dict(sources)
+        self.sessions = {}
+        self.holders = {}  # camera name -> user ids that started it
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        """CameraSession for a configured source name, or None if unknown."""
+        with self.lock:
+            if name not in self.sources:
+                return None
+            if name not in self.sessions:
+                self.sessions[name] = CameraSession(name, self.sources[name])
+            return self.sessions[name]
+
+    def describe(self):
+        with self.lock:
+            return [{
+                "name": name,
+                "running": name in self.sessions and self.sessions[name].is_running,
+                "users": len(self.holders.get(name, ()))
+            } for name in self.sources]
+
+    def start(self, name, holder):
+        """Start a camera on behalf of `holder`; None if the name is unknown. Raises if it can't open."""
+        camera = self.get(name)
+        if camera is None:
+            return None
+        camera.start()
+        with self.lock:
+            self.holders.setdefault(name, set()).add(holder)
+        return camera
+
+    def release(self, name, holder):
+        """Drop `holder`'s hold on a camera and stop it once nobody holds it. Returns True if it stopped."""
+        with self.lock:
+            holders = self.holders.get(name, set())
+            holders.discard(holder)
+            if holders:
+                return False
+        self.stop(name)
+        return True
+
+    def stop(self, name):
+        with self.lock:
+            session = self.sessions.pop(name, None)
+            self.holders.pop(name, None)
+        if session:
+            session.stop()
+
+    def stop_all(self):
+        with self.lock:
+            names = list(self.sessions)
+        for name in names:
+            self.stop(name)
+
+camera_registry = CameraRegistry(CAMERA_SOURCES)
+atexit.register(camera_registry.stop_all)
+
+def requested_camera():
+    data = request.get_json(silent=True) or {}
+    return data.get("camera") or request.args.get("camera") or DEFAULT_CAMERA
+
+def live_tracker_key(user_id, camera_name):
+    return tracker_key("live", f"{user_id}:{camera_name}")
+
+# ==============================
+# LIVE ANALYSIS SESSIONS
+# ==============================
+# Live analysis runs on a worker thread per (user, camera), like uploads do:
+# the worker drains the user's analysis FrameQueue, zone counts go out over
+# /events and the analyzed frames over /live_analysis_mjpeg. Nothing is
+# polled, and frames the worker can't keep up with are dropped by
+# LIVE_ANALYSIS_QUEUE_POLICY.
+class LiveAnalysisSession:
+    def __init__(self, user_id, camera):
+        self.user_id = user_id
+        self.camera = camera
+        self.tracker_key = live_tracker_key(user_id, camera.name)
+        self.frame_queue = None
+        self.latest_result = None
+        # Notified whenever latest_result changes so stream readers can wait on it
+        self.result_cond = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.finished = False
+        self.error = None
+        self.viewers = 0
+        self.viewer_lock = threading.Lock()
+
+    def add_viewer(self, delta):
+        with self.viewer_lock:
+            self.viewers += delta
+
+    def start(self):
+        self.frame_queue = self.camera.subscribe(self.tracker_key, "analysis", LIVE_ANALYSIS_QUEUE_POLICY)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        # Closing the queue wakes a worker waiting for a frame
+        self.camera.unsubscribe(self.tracker_key)
+        if self.thread and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=timeout)
+
+    def _run(self):
+        try:
+            while not self.stop_event.is_set():
+                seq, frame = self.frame_queue.get()
+                if frame is None:
+                    if self.frame_queue.closed:
+                        break
+                    continue
+                result = analyze_frame(self.user_id, frame, self.tracker_key)
+                with self.result_cond:
+                    result["frame_number"] = seq
+                    self.latest_result = result
+                    self.result_cond.notify_all()
+        except TrackerSessionClosed:
+            pass  # the live stream was stopped during a frame
+        except Exception as e:
+            print(f"Live analysis worker error ({self.tracker_key}):", e)
+            self.error = str(e)
+        finally:
+            with self.result_cond:
+                self.finished = True
+                self.result_cond.notify_all()
+            if not self.stop_event.is_set():
+                # The camera stopped or the pipeline failed, not the user
+                event_broker.publish(self.user_id, "live_analysis_finished",
+                                     {"camera": self.camera.name, "error": self.error})
+
+live_sessions = {}  # live_tracker_key -> LiveAnalysisSession
+live_session_lock = threading.Lock()
+
+def stop_live_session(user_id, camera_name):
+    with live_session_lock:
+        session = live_sessions.pop(live_tracker_key(user_id, camera_name), None)
+    if session:
+        session.stop()
+    return session
+
+@app.route('/cameras', methods=['GET'])
+@jwt_required()
+def list_cameras():
+    return jsonify({"cameras": camera_registry.describe()}), 200
+
+@app.route('/start_live_stream', methods=['POST'])
+@jwt_required()
+def start_live_stream():
+    user_id = get_jwt_identity()
+    camera_name = requested_camera()
+    if camera_name not in camera_registry.sources:
+        return jsonify({"error": f"Unknown camera: {camera_name}"}), 404
+    try:
+        options = cadence_options_from_request()
+        DetectionCadence(**options)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid detection options: {e}"}), 400
+    try:
+        camera_registry.start(camera_name, user_id)
+        key = live_tracker_key(user_id, camera_name)
+        tracker_pool.release(key)
+        tracker_pool.acquire(key, **options)
+        event_broker.reset(key)
+        heatmap_store.reset(key)
+        return jsonify({"message": "Live stream started", "camera": camera_name}), 200
+    except Exception as e:
+        return jsonify({"error": f"Failed to start live stream: {e}"}), 500
+
+@app.route('/stop_live_stream', methods=['POST'])
+@jwt_required()
+def stop_live_stream():
+    user_id = get_jwt_identity()
+    camera_name = requested_camera()
+    stop_live_session(user_id, camera_name)
+    tracker_pool.release(live_tracker_key(user_id, camera_name))
+    if not camera_registry.release(camera_name, user_id):
+        return jsonify({"message": "Live stream stopped; the camera stays on for its other users"}), 200
+    return jsonify({"message": "Live stream stopped"}), 200
+
+@app.route('/stop_live_analysis', methods=['POST'])
+@jwt_required()
+def stop_live_analysis():
+    """Stop the user's analysis worker for the camera; the raw stream keeps running."""
+    stop_live_session(get_jwt_identity(), requested_camera())
+    return jsonify({"message": "Live analysis stopped"}), 200
+
+@app.route('/live_feed_mjpeg')
+@stream_jwt_required
+def live_feed_mjpeg():
+    """Raw frames of a camera for the <img> tag: ?camera=, with optional ?fps= and ?width=."""
+    camera = camera_registry.get(request.args.get("camera", DEFAULT_CAMERA))
+    if not camera:
+        return jsonify({"error": "Unknown camera"}), 404
+    try:
+        interval, width = stream_options()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return Response(camera.generate_frames(interval, width), 
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+@app.route('/start_live_analysis', methods=['POST'])
+@jwt_required()
+def start_live_analysis():
+    """
+    Start analyzing a live camera (YOLO + DeepSORT + zone analysis) on a
+    worker thread. Zone counts arrive as zone_counts events on /events
+    (source "live"); analyzed frames on /live_analysis_mjpeg.
+    """
+    user_id = get_jwt_identity()
+    camera_name = requested_camera()
+    camera = camera_registry.get(camera_name)
+
+    if not camera or not camera.is_running:
+        return jsonify({"error": "Live stream not started. Please start first."}), 400
+
+    if not model_loader.is_ready():
+        return jsonify({"error": "Detection model is not ready", **model_loader.status()}), 503
+
+    key = live_tracker_key(user_id, camera_name)
+    with live_session_lock:
+        session = live_sessions.get(key)
+        if session and not session.finished:
+            return jsonify({"message": "Live analysis already running", "camera": camera_name}), 200
+        session = LiveAnalysisSession(user_id, camera)
+        live_sessions[key] = session
+        # Counts published before this start belong to an earlier run
+        event_broker.reset(key)
+        session.start()
+    return jsonify({"message": "Live analysis started", "camera": camera_name}), 200
+
+@app.route('/live_analysis_mjpeg')
+@stream_jwt_required
+def live_analysis_mjpeg():
+    """
+    Binary stream of a live camera's analyzed frames: ?camera=&view=overlay|heatmap|both,
+    with optional ?fps= and ?width= caps for this viewer.
+    """
+    user_id = get_jwt_identity()
+    view = request.args.get("view", "overlay")
+    if view not in ANALYSIS_VIEWS + ("both",):
+        return jsonify({"error": f"Unknown view: {view}"}), 400
+    try:
+        interval, width = stream_options()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with live_session_lock:
+        session = live_sessions.get(live_tracker_key(user_id, request.args.get("camera", DEFAULT_CAMERA)))
+    if not session:
+        return jsonify({"error": "Live analysis not started."}), 400
+
+    return Response(generate_analysis_frames(session, view, interval, width),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+# ==============================
+# AUTH ROUTES (unchanged)
+# ==============================
+@app.route('/register', methods=['POST'])
+def register():
+    data = request.get_json()
+    username = data.get('username', '').strip()
+    email = data.get('email', '').strip()
+    password = data.get('password', '')
+
+    if not all([username, email, password]):
+        return jsonify({'message': 'All fields are required'}), 400
+    if len(password) < 6:
+        return jsonify({'message': 'Password must be at least 6 characters'}), 400
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'message': 'Database connection failed'}), 500
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT id FROM users WHERE email=%s", (email,))
+    if cursor.fetchone():
+        cursor.close()
+        conn.close()
+        return jsonify({'message': 'User already exists'}), 400
+
+    hashed = generate_password_hash(password)
+    cursor.execute("INSERT INTO users (username, email, password) VALUES (%s, %s, %s)",
+                   (username, email, hashed))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    return jsonify({'message': 'User registered successfully'}), 201
+
+@app.route('/login', methods=['POST'])
+def login():
+    data = request.get_json()
+    email = data.get('email', '').strip()
+    password = data.get('password', '')
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'message': 'Database connection failed'}), 500
+    cursor = conn.cursor(dictionary=True)
+
+    cursor.execute("SELECT id, username, password FROM users WHERE email=%s", (email,))
+    user = cursor.fetchone()
+    cursor.close()
+    conn.close()
+
+    if user and check_password_hash(user['password'], password):
+        token = create_access_token(identity=str(user['id']))
+        return jsonify({'message': 'Login successful',
+                        'token': token,
+                        'username': user['username']}), 200
+    return jsonify({'message': 'Invalid credentials'}), 401
+
+@app.route('/stream_token', methods=['POST'])
+@jwt_required()
+def stream_token():
+    """Short-lived token for ?token= on the MJPEG and /events routes."""
+    token = create_access_token(identity=get_jwt_identity(), additional_claims={"scope": "stream"},
+                                expires_delta=datetime.timedelta(seconds=STREAM_TOKEN_SECONDS))
+    return jsonify({"token": token, "expires_in": STREAM_TOKEN_SECONDS}), 200
+
+# ==============================
+# ZONE ROUTES (unchanged)
+# ==============================
+@app.route('/save_zone', methods=['POST'])
+@jwt_required()
+def save_zone():
+    user_id = get_jwt_identity()
+    data = request.get_json()
+    name = data.get("name")
+    coords = data.get("coordinates")
+
+    if not name or not coords:
+        return jsonify({"message": "Invalid zone data"}), 400
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"message": "Database connection failed"}), 500
+    cursor = conn.cursor()
+
+    cursor.execute("INSERT INTO zones (user_id, name, coordinates) VALUES (%s, %s, %s)",
+                   (user_id, name, json.dumps(coords)))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    zone_cache.invalidate(user_id)
+
+    return jsonify({"message": "Zone saved"}), 201
+
+@app.route('/get_zones', methods=['GET'])
+@jwt_required()
+def get_zones():
+    user_id = get_jwt_identity()
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"message": "Database connection failed"}), 500
+    cursor = conn.cursor(dictionary=True)
+
+    cursor.execute("SELECT id, name, coordinates FROM zones WHERE user_id=%s", (user_id,))
+    zones = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    for z in zones:
+        z["coordinates"] = json.loads(z["coordinates"])
+
+    return jsonify({"zones": zones}), 200
+
+@app.route('/delete_zone/<int:zone_id>', methods=['DELETE'])
+@jwt_required()
+def delete_zone(zone_id):
+    user_id = get_jwt_identity()
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"message": "Database connection failed"}), 500
+    cursor = conn.cursor()
+
+    cursor.execute("DELETE FROM zones WHERE id=%s AND user_id=%s", (zone_id, user_id))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    zone_cache.invalidate(user_id)
+
+    return jsonify({"message": f"Zone {zone_id} deleted"}), 200
+
+# ==============================
+# VIDEO UPLOAD
+# ==============================
+# Every upload gets its own file under uploads/<user_id>/ so queued jobs keep
+# their input when the user uploads the next video. Upload responses return
+# the video_id and /start_analysis takes it back; without one, analysis uses
+# the video this process last stored or matched for the user (a duplicate
+# upload reuses an older id), then the newest file (ids start with the
+# upload time).
+UPLOAD_DIR = 'uploads'
+VIDEO_ID_PATTERN = re.compile(r"^[0-9]{14}_[0-9a-f]{8}$")
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+UPLOAD_READ_SIZE = 1 << 20
+UPLOAD_MAX_CHUNK_BYTES = int(os.environ.get("UPLOAD_MAX_CHUNK_BYTES", 64 << 20))
+
+# Content hashes of stored uploads, so the same file is stored (and analyzed) once
+VIDEOS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS videos (
+        user_id INT NOT NULL,
+        video_id VARCHAR(32) NOT NULL,
+        content_hash CHAR(64) NOT NULL,
+        size BIGINT NOT NULL,
+        filename VARCHAR(255),
+        created_at DATETIME NOT NULL,
+        PRIMARY KEY (user_id, video_id),
+        UNIQUE KEY uq_videos_user_hash (user_id, content_hash)
+    )
+"""
+
+# user_id -> video_id of the user's last upload, duplicates included
+last_uploads = {}
+last_uploads_lock = threading.Lock()
+
+def new_video_id():
+    return f"{datetime.datetime.now():%Y%m%d%H%M%S}_{uuid.uuid4().hex[:8]}"
+
+def remember_upload(user_id, video_id):
+    if video_id:
+        with last_uploads_lock:
+            last_uploads[str(user_id)] = video_id
+    return video_id
+
+def upload_path(user_id, video_id):
+    if not VIDEO_ID_PATTERN.match(video_id or ""):
+        return None
+    return os.path.join(UPLOAD_DIR, str(user_id), f"{video_id}.mp4")
+
+def latest_upload_path(user_id):
+    with last_uploads_lock:
+        video_id = last_uploads.get(str(user_id))
+    path = upload_path(user_id, video_id)
+    if path and os.path.exists(path):
+        return path
+    user_dir = os.path.join(UPLOAD_DIR, str(user_id))
+    if os.path.isdir(user_dir):
+        names = sorted(name for name in os.listdir(user_dir) if VIDEO_ID_PATTERN.match(name[:-4]))
+        if names:
+            return os.path.join(user_dir, names[-1])
+    legacy = os.path.join(UPLOAD_DIR, f"video_{user_id}.mp4")
+    return legacy if os.path.exists(legacy) else None
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(UPLOAD_READ_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def find_video_by_hash(user_id, content_hash):
+    """video_id of the user's stored upload with this content, if any."""
+    conn = schema_connection()
+    if not conn:
+        raise ConnectionError("Database connection failed")
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT video_id FROM videos WHERE user_id = %s AND content_hash = %s",
+                       (user_id, content_hash))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+    if row and os.path.exists(upload_path(user_id, row[0])):
+        return row[0]
+    return None
+
+def video_content_hash(user_id, video_path):
+    """Content hash of an upload, hashing files that predate the videos table."""
+    video_id = os.path.basename(video_path)[:-4]
+    conn = schema_connection()
+    if conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT content_hash FROM videos WHERE user_id = %s AND video_id = %s",
+                           (user_id, video_id))
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+            conn.close()
+        if row:
+            return row[0]
+    return hash_file(video_path)
+
+def store_upload(user_id, temp_path, content_hash, size, filename=None):
+    """
+    Move a fully received upload into place, or drop it if the user already
+    has a video with the same content. Returns (video_id, duplicate).
+    """
+    existing = find_video_by_hash(user_id, content_hash)
+    if existing:
+        os.remove(temp_path)
+        return remember_upload(user_id, existing), True
+
+    video_id = new_video_id()
+    path = upload_path(user_id, video_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = schema_connection()
+    if not conn:
+        raise ConnectionError("Database connection failed")
+    cursor = conn.cursor()
+    try:
+        # Any stale row for this hash points at a file that no longer exists
+        cursor.execute("DELETE FROM videos WHERE user_id = %s AND content_hash = %s", (user_id, content_hash))
+        cursor.execute("""
+            INSERT INTO videos (user_id, video_id, content_hash, size, filename, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (user_id, video_id, content_hash, size, (filename or "")[:255], datetime.datetime.now()))
+        os.replace(temp_path, path)
+        conn.commit()
+    except mysql.connector.IntegrityError:
+        # The same content finished uploading concurrently
+        conn.rollback()
+        os.remove(temp_path)
+        return remember_upload(user_id, find_video_by_hash(user_id, content_hash)), True
+    except Exception:
+        conn.rollback()
+        if os.path.exists(path):
+            os.replace(path, temp_path)
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    return remember_upload(user_id, video_id), False
+
+class UploadOffsetError(Exception):
+    def __init__(self, offset):
+        super().__init__(f"Expected offset {offset}")
+        self.offset = offset
+
+class ChunkedUpload:
+    """
+    A resumable upload written straight to uploads/<user_id>/.partial/ and
+    hashed as it arrives. Chunks must be sent in order; a client that lost its
+    connection asks for the current offset and continues from there.
+    """
+    def __init__(self, user_id, upload_id, size, filename=None):
+        self.user_id = user_id
+        self.upload_id = upload_id
+        self.size = size
+        self.filename = filename
+        partial_dir = os.path.join(UPLOAD_DIR, str(user_id), ".partial")
+        self.part_path = os.path.join(partial_dir, f"{upload_id}.part")
+        self.meta_path = os.path.join(partial_dir, f"{upload_id}.json")
+        self.hasher = hashlib.sha256()
+        self.received = 0
+        self.result = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, user_id, size, filename=None):
+        upload = cls(user_id, uuid.uuid4().hex, size, filename)
+        os.makedirs(os.path.dirname(upload.part_path), exist_ok=True)
+        open(upload.part_path, 'wb').close()
+        with open(upload.meta_path, 'w') as f:
+            json.dump({"size": size, "filename": filename}, f)
+        return upload
+
+    @classmethod
+    def load(cls, user_id, upload_id):
+        """Pick up an upload left by a previous server process, re-hashing what arrived."""
+        upload = cls(user_id, upload_id, 0)
+        if not os.path.exists(upload.meta_path) or not os.path.exists(upload.part_path):
+            return None
+        with open(upload.meta_path) as f:
+            meta = json.load(f)
+        upload.size = meta["size"]
+        upload.filename = meta.get("filename")
+        with open(upload.part_path, 'rb') as f:
+            for block in iter(lambda: f.read(UPLOAD_READ_SIZE), b''):
+                upload.hasher.update(block)
+                upload.received += len(block)
+        return upload
+
+    def write(self, offset, stream, length):
+        """Append `length` bytes from stream at `offset`; returns the new offset."""
+        with self.lock:
+            if offset != self.received:
+                raise UploadOffsetError(self.received)
+            if self.received + length > self.size:
+                raise ValueError("Chunk runs past the declared upload size")
+            with open(self.part_path, 'ab') as f:
+                remaining = length
+                while remaining > 0:
+                    block = stream.read(min(UPLOAD_READ_SIZE, remaining))
+                    if not block:
+                        break
+                    self.hasher.update(block)
+                    f.write(block)
+                    self.received += len(block)
+                    remaining -= len(block)
+            return self.received
+
+    def complete(self):
+        """Store the finished upload once; returns (video_id, duplicate)."""
+        with self.lock:
+            if self.result is None:
+                self.result = store_upload(self.user_id, self.part_path, self.hasher.hexdigest(),
+                                           self.size, self.filename)
+                os.remove(self.meta_path)
+            return self.result
+
+class UploadStore:
+    def __init__(self):
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    def create(self, user_id, size, filename=None):
+        upload = ChunkedUpload.create(user_id, size, filename)
+        with self.lock:
+            self.uploads[(user_id, upload.upload_id)] = upload
+        return upload
+
+    def get(self, user_id, upload_id):
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            return None
+        with self.lock:
+            upload = self.uploads.get((user_id, upload_id))
+        if upload is not None:
+            return upload
+        # Re-hashing the partial file can take a while; don't hold up other uploads
+        upload = ChunkedUpload.load(user_id, upload_id)
+        if upload is None:
+            return None
+        with self.lock:
+            # Another request may have loaded (and appended to) it meanwhile
+            return self.uploads.setdefault((user_id, upload_id), upload)
+
+    def finish(self, upload):
+        with self.lock:
+            self.uploads.pop((upload.user_id, upload.upload_id), None)
+
+upload_store = UploadStore()
+
+def requested_upload_path(user_id, video_id):
+    """Path of the given upload, or of the user's last upload when video_id is empty."""
+    if not video_id:
+        return latest_upload_path(user_id)
+    path = upload_path(user_id, video_id)
+    return path if path and os.path.exists(path) else None
+
+@app.route('/upload_video', methods=['POST'])
+@jwt_required()
+def upload_video():
+    if 'video' not in request.files:
+        return jsonify({'error': 'No video'}), 400
+    file = request.files['video']
+    
+    user_id = get_jwt_identity()
+    # Copy in blocks, hashing on the way, then dedupe like the chunked uploads
+    partial_dir = os.path.join(UPLOAD_DIR, str(user_id), ".partial")
+    os.makedirs(partial_dir, exist_ok=True)
+    temp_path = os.path.join(partial_dir, f"{uuid.uuid4().hex}.part")
+    hasher = hashlib.sha256()
+    size = 0
+    with open(temp_path, 'wb') as f:
+        for block in iter(lambda: file.stream.read(UPLOAD_READ_SIZE), b''):
+            hasher.update(block)
+            f.write(block)
+            size += len(block)
+    try:
+        video_id, duplicate = store_upload(user_id, temp_path, hasher.hexdigest(), size, file.filename)
+    except (ConnectionError, mysql.connector.Error) as e:
+        os.remove(temp_path)
+        return jsonify({'error': str(e)}), 500
+    
+    with user_session_lock(user_id):
+        stop_video_session(user_id)
+
+    return jsonify({'message': 'Uploaded and ready for analysis', 'video_id': video_id,
+                    'duplicate': duplicate}), 200
+
+@app.route('/uploads', methods=['POST'])
+@jwt_required()
+def create_upload():
+    """
+    Start a chunked upload: JSON {size, filename, sha256 (optional)}. If the
+    client sends the content hash of a video it already uploaded, the stored
+    video is returned and nothing needs to be sent.
+    """
+    user_id = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    try:
+        size = int(data.get("size", 0))
+    except (TypeError, ValueError):
+        size = 0
+    if size <= 0:
+        return jsonify({"error": "size must be a positive number of bytes"}), 400
+
+    try:
+        if data.get("sha256"):
+            video_id = find_video_by_hash(user_id, str(data["sha256"]).lower())
+            if video_id:
+                remember_upload(user_id, video_id)
+                return jsonify({"video_id": video_id, "duplicate": True, "complete": True}), 200
+        upload = upload_store.create(user_id, size, data.get("filename"))
+    except (ConnectionError, mysql.connector.Error) as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"upload_id": upload.upload_id, "offset": 0,
+                    "max_chunk_bytes": UPLOAD_MAX_CHUNK_BYTES}), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+@jwt_required()
+def upload_status(upload_id):
+    upload = upload_store.get(get_jwt_identity(), upload_id)
+    if not upload:
+        return jsonify({"error": "Upload not found"}), 404
+    return jsonify({"upload_id": upload_id, "offset": upload.received, "size": upload.size}), 200
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+@jwt_required()
+def upload_chunk(upload_id):
+    """
+    Append the raw request body at ?offset=N. The body is streamed to disk in
+    UPLOAD_READ_SIZE blocks. A wrong offset gets 409 with the offset the
+    server expects; the last chunk returns the stored video_id.
+    """
+    upload = upload_store.get(get_jwt_identity(), upload_id)
+    if not upload:
+        return jsonify({"error": "Upload not found"}), 404
+    length = request.content_length
+    if length is None or length > UPLOAD_MAX_CHUNK_BYTES:
+        return jsonify({"error": f"Chunks need a Content-Length of at most {UPLOAD_MAX_CHUNK_BYTES} bytes"}), 411
+    try:
+        offset = int(request.args.get("offset", -1))
+        received = upload.write(offset, request.stream, length)
+    except UploadOffsetError as e:
+        return jsonify({"error": str(e), "offset": e.offset}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e), "offset": upload.received}), 400
+
+    if received < upload.size:
+        return jsonify({"upload_id": upload_id, "offset": received, "complete": False}), 200
+    try:
+        video_id, duplicate = upload.complete()
+    except (ConnectionError, mysql.connector.Error) as e:
+        return jsonify({"error": str(e), "offset": received}), 500
+    upload_store.finish(upload)
+    return jsonify({"video_id": video_id, "duplicate": duplicate, "complete": True}), 200
+
+# ==============================
+# LIVE ANALYSIS SESSIONS
+# ==============================
+class VideoAnalysisSession:
+    """
+    Background worker for an uploaded video. Reads the capture end-to-end at
+    full speed, runs every frame through analyze_frame() and keeps the latest
+    result so clients can read progress without driving the pipeline. Rows
+    are stamped with video_start (default: when the session starts) plus the
+    frame's position in the video.
+    """
+    def __init__(self, user_id, video_path, cadence_options=None, session_key=None, start_frame=0,
+                 video_start=None):
+        self.user_id = user_id
+        self.tracker_key = session_key or tracker_key("video", user_id)
+        self.cadence_options = cadence_options or {}
+        self.cap = open_video_capture(video_path)
+        self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if start_frame:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        self.start_frame = start_frame
+        self.current_frame = start_frame
+        self.video_start = video_start
+        # None sends rows to zone_writer; a list collects them for the subclass
+        self.row_buffer = None
+        self.served_frame = 0
+        self.latest_result = None
+        # Notified whenever latest_result changes so stream readers can wait on it
+        self.result_cond = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.started_at = None
+        self.finished = False
+        self.error = None
+        self.viewers = 0
+        self.viewer_lock = threading.Lock()
+
+    def add_viewer(self, delta):
+        with self.viewer_lock:
+            self.viewers += delta
+
+    def start(self):
+        self.started_at = time.time()
+        self.video_start = self.video_start or datetime.datetime.now()
+        # A new video always starts with fresh tracks
+        tracker_pool.release(self.tracker_key)
+        entry = tracker_pool.acquire(self.tracker_key, **self.cadence_options)
+        if self.start_frame:
+            # Resuming mid-video: people already in a zone were counted before the checkpoint
+            entry["zone_state"].rebase()
+        event_broker.reset(self.tracker_key)
+        heatmap_store.reset(self.tracker_key)
+        inference_scheduler.register_source()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=timeout)
+
+    def _run(self):
+        try:
+            while not self.stop_event.is_set():
+                started = time.perf_counter()
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                observe_stage("decode", time.perf_counter() - started)
+                video_time = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                result = analyze_frame(self.user_id, frame, self.tracker_key, video_time,
+                                       self.video_start + datetime.timedelta(seconds=video_time),
+                                       self.row_buffer)
+                with self.result_cond:
+                    self.current_frame += 1
+                    result["frame_number"] = self.current_frame
+                    self.latest_result = result
+                    self.result_cond.notify_all()
+                self.after_frame()
+        except Exception as e:
+            print(f"Analysis worker error ({self.tracker_key}):", e)
+            self.error = str(e)
+        finally:
+            self.cap.release()
+            inference_scheduler.unregister_source()
+            tracker_pool.release(self.tracker_key)
+            zone_writer.flush()
+            with self.result_cond:
+                self.finished = True
+                self.result_cond.notify_all()
+            self.on_finished()
+
+    def after_frame(self):
+        """Hook called after each analyzed frame."""
+
+    def on_finished(self):
+        if not self.stop_event.is_set():
+            event_broker.publish(self.user_id, "analysis_finished", self.progress())
+
+    def progress(self):
+        elapsed = time.time() - self.started_at if self.started_at else 0
+        fps = (self.current_frame - self.start_frame) / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, self.total_frames - self.current_frame)
+        return {
+            "frame_number": self.current_frame,
+            "total_frames": self.total_frames,
+            "fps": round(fps, 2),
+            "eta_seconds": round(remaining / fps, 1) if fps > 0 else None,
+            "finished": self.finished,
+            "error": self.error
+        }
+
+@app.route('/start_analysis', methods=['POST'])
+@jwt_required()
+def start_analysis():
+    user_id = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    video_path = requested_upload_path(user_id, data.get("video_id"))
+
+    if not video_path:
+        return jsonify({"error": "No uploaded video found for analysis. Please upload one."}), 404
+
+    if not model_loader.is_ready():
+        return jsonify({"error": "Detection model is not ready", **model_loader.status()}), 503
+
+    try:
+        cadence_options = cadence_options_from_request()
+        DetectionCadence(**cadence_options)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid detection options: {e}"}), 400
+
+    # Replacing is one step per user: a double click waits here, and the old
+    # worker has fully exited (releasing its tracker key) before the new one starts
+    with user_session_lock(user_id):
+        stop_video_session(user_id, timeout=None)
+        session = VideoAnalysisSession(user_id, video_path, cadence_options)
+        if not session.cap.isOpened():
+            session.cap.release()
+            return jsonify({"error": "Failed to open video file."}), 500
+        with session_lock:
+            video_sessions[user_id] = session
+        session.start()
+
+    return jsonify({"message": "Analysis session started.", "total_frames": session.total_frames}), 200
+
+@app.route('/analysis_progress', methods=['GET'])
+@jwt_required()
+def analysis_progress():
+    user_id = get_jwt_identity()
+    with session_lock:
+        session = video_sessions.get(user_id)
+    if not session:
+        return jsonify({"error": "Analysis session not started."}), 400
+
+    progress = session.progress()
+    with session.result_cond:
+        result = session.latest_result
+    progress["zone_counts"] = result["zone_counts"] if result else {}
+    progress["zone_dwell"] = result["zone_dwell"] if result else {}
+    return jsonify(progress), 200
+
+@app.route('/occupancy_heatmap', methods=['GET'])
+@jwt_required()
+def occupancy_heatmap():
+    """
+    Cumulative occupancy heatmap (JPEG) of the user's last uploaded video
+    (?source=video, default) or of a live camera (?source=live&camera=...).
+    Optional ?start=&end= limit it to a time window: seconds into the video,
+    or Unix timestamps for live cameras. ?blend=0 returns the bare heatmap.
+    """
+    user_id = get_jwt_identity()
+    source = request.args.get("source", "video")
+    if source == "video":
+        key = tracker_key("video", user_id)
+    elif source == "live":
+        key = live_tracker_key(user_id, request.args.get("camera", DEFAULT_CAMERA))
+    else:
+        return jsonify({"error": f"Unknown source: {source}"}), 400
+
+    acc = heatmap_store.find(key)
+    if acc is None:
+        return jsonify({"error": "No heatmap data for this source yet."}), 404
+    try:
+        start = float(request.args["start"]) if "start" in request.args else None
+        end = float(request.args["end"]) if "end" in request.args else None
+    except ValueError:
+        return jsonify({"error": "start and end must be numbers"}), 400
+
+    grid = acc.occupancy(start, end)
+    background = acc.background if request.args.get("blend", "1") != "0" else None
+    image = render_heatmap(background, grid, acc.frame_shape)
+    _, buffer = cv2.imencode('.jpg', image)
+    return Response(buffer.tobytes(), mimetype='image/jpeg')
+
+@app.route('/analysis_stream_mjpeg')
+@stream_jwt_required
+def analysis_stream_mjpeg():
+    """
+    Binary stream of the analyzed upload: ?view=overlay|heatmap|both, with
+    optional ?fps= and ?width= caps for this viewer.
+    Zone counts are not embedded; read them from /analysis_progress.
+    """
+    user_id = get_jwt_identity()
+    view = request.args.get("view", "overlay")
+    if view not in ANALYSIS_VIEWS + ("both",):
+        return jsonify({"error": f"Unknown view: {view}"}), 400
+    try:
+        interval, width = stream_options()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with session_lock:
+        session = video_sessions.get(user_id)
+    if not session:
+        return jsonify({"error": "Analysis session not started."}), 400
+
+    return Response(generate_analysis_frames(session, view, interval, width),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+# ==============================
+# OFFLINE ANALYSIS JOBS
+# ==============================
+# Headless analysis of uploaded videos, for long recordings processed without
+# a browser attached. Jobs live in the analysis_jobs table and run on a fixed
+# number of worker threads. A job buffers its own zone rows and, every
+# ANALYSIS_JOB_CHECKPOINT_FRAMES frames, writes them and the frame number in
+# one transaction, so a stopped or crashed job resumes from its last
+# checkpoint without writing any frame's rows twice. Rows are stamped with
+# the job's creation time plus the position in the video, so a resumed job
+# produces the same timestamps. A resumed job takes the tracks it first sees
+# as already present rather than as entries. Its occupancy heatmap is not
+# checkpointed and restarts from the resume point.
+ANALYSIS_JOB_CONCURRENCY = int(os.environ.get("ANALYSIS_JOB_CONCURRENCY", 1))
+ANALYSIS_JOB_CHECKPOINT_FRAMES = int(os.environ.get("ANALYSIS_JOB_CHECKPOINT_FRAMES", 250))
+
+ANALYSIS_JOBS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS analysis_jobs (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        video_path VARCHAR(512) NOT NULL,
+        content_hash CHAR(64),
+        zone_version CHAR(40),
+        options TEXT,
+        status VARCHAR(16) NOT NULL,
+        total_frames INT NOT NULL DEFAULT 0,
+        checkpoint_frame INT NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at DATETIME NOT NULL,
+        updated_at DATETIME NOT NULL,
+        INDEX idx_analysis_jobs_user (user_id, id),
+        INDEX idx_analysis_jobs_content (user_id, content_hash)
+    )
+"""
+
+# queued -> running -> completed | failed | stopped; stopped and failed jobs can be resumed
+JOB_ACTIVE_STATUSES = ("queued", "running")
+
+def init_job_schema():
+    return apply_schema((VIDEOS_SCHEMA, ANALYSIS_JOBS_SCHEMA), label="Job schema")
+
+def update_job_row(job_id, **fields):
+    conn = schema_connection()
+    if not conn:
+        return False
+    fields["updated_at"] = datetime.datetime.now()
+    assignments = ", ".join(f"{name} = %s" for name in fields)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"UPDATE analysis_jobs SET {assignments} WHERE id = %s", (*fields.values(), job_id))
+        conn.commit()
+        return True
+    except mysql.connector.Error as e:
+        print(f"Job {job_id} update failed:", e)
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def commit_job_checkpoint(job_id, rows, frame):
+    """Write a job's buffered zone rows and advance its checkpoint in one transaction."""
+    conn = schema_connection()
+    if not conn:
+        return False
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    try:
+        write_zone_rows(cursor, rows)
+        cursor.execute("UPDATE analysis_jobs SET checkpoint_frame = %s, updated_at = %s WHERE id = %s",
+                       (frame, datetime.datetime.now(), job_id))
+        conn.commit()
+    except mysql.connector.Error as e:
+        print(f"Job {job_id} checkpoint failed:", e)
+        try:
+            conn.rollback()
+        except mysql.connector.Error:
+            pass
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+    observe_stage("db_write", time.perf_counter() - started)
+    return True
+
+def fetch_job_rows(where, params):
+    conn = schema_connection()
+    if not conn:
+        return None
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"SELECT * FROM analysis_jobs WHERE {where} ORDER BY id", params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+class AnalysisJob(VideoAnalysisSession):
+    """A VideoAnalysisSession that checkpoints its progress to analysis_jobs."""
+    def __init__(self, job_id, user_id, video_path, cadence_options=None, start_frame=0, video_start=None):
+        super().__init__(user_id, video_path, cadence_options, session_key=tracker_key("job", job_id),
+                         start_frame=start_frame, video_start=video_start)
+        self.job_id = job_id
+        self.checkpoint_frame = start_frame
+        self.row_buffer = []
+        # Set when the server shuts down, so the job is picked up again on restart
+        self.interrupted = False
+
+    def after_frame(self):
+        if self.current_frame - self.checkpoint_frame >= ANALYSIS_JOB_CHECKPOINT_FRAMES:
+            if not self.checkpoint():
+                # Fail rather than buffer rows without bound; the job resumes from its last checkpoint
+                raise RuntimeError("Could not save the job checkpoint")
 
-    return jsonify({'message': 'User registered successfully'}), 201
+    def checkpoint(self):
+        if commit_job_checkpoint(self.job_id, self.row_buffer, self.current_frame):
+            self.row_buffer.clear()
+            self.checkpoint_frame = self.current_frame
+            return True
+        return False
 
-@app.route('/login', methods=['POST'])
-def login():
-    data = request.get_json()
-    email = data.get('email', '').strip()
-    password = data.get('password', '')
+    def on_finished(self):
+        if not self.checkpoint() and not self.error:
+            self.error = "Could not save the job checkpoint"
+        if self.error:
+            status = "failed"
+        elif self.interrupted:
+            status = "queued"
+        elif self.stop_event.is_set():
+            status = "stopped"
+        else:
+            status = "completed"
+        update_job_row(self.job_id, status=status, error=self.error)
+        # Nothing reads a job's heat grid or last published counts once it ends
+        heatmap_store.reset(self.tracker_key)
+        event_broker.reset(self.tracker_key)
+        event_broker.publish(self.user_id, "job_finished", {"job_id": self.job_id, "status": status, **self.progress()})
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'message': 'Database connection failed'}), 500
-    cursor = conn.cursor(dictionary=True)
+class AnalysisJobQueue:
+    def __init__(self, concurrency=ANALYSIS_JOB_CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+        self.pending = queue.Queue()
+        self.running = {}
+        self.cancelled = set()
+        self.lock = threading.Lock()
+        self.workers = []
 
-    cursor.execute("SELECT id, username, password FROM users WHERE email=%s", (email,))
-    user = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    def create(self, user_id, video_path, cadence_options):
+        """
+        Queue a job and return (job_id, cached). A video with the same content,
+        zone set and options that was already analyzed (or is being analyzed)
+        returns that job instead of running again.
+        """
+        content_hash = video_content_hash(user_id, video_path)
+        zone_version = zone_cache.fingerprint(user_id)
+        options = json.dumps(cadence_options, sort_keys=True)
+        cached = fetch_job_rows(
+            "user_id = %s AND content_hash = %s AND zone_version = %s AND options = %s"
+            " AND status IN ('queued', 'running', 'completed')",
+            (user_id, content_hash, zone_version, options))
+        if cached:
+            return cached[-1]["id"], True
 
-    if user and check_password_hash(user['password'], password):
-        token = create_access_token(identity=str(user['id']))
-        return jsonify({'message': 'Login successful',
-                        'token': token,
-                        'username': user['username']}), 200
-    return jsonify({'message': 'Invalid credentials'}), 401
+        cap = open_video_capture(video_path)
+        opened = cap.isOpened()
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if opened else 0
+        cap.release()
+        if not opened:
+            raise ValueError("Failed to open video file.")
 
-# ==============================
-# ZONE ROUTES (unchanged)
-# ==============================
-@app.route('/save_zone', methods=['POST'])
-@jwt_required()
-def save_zone():
-    user_id = get_jwt_identity()
-    data = request.get_json()
-    name = data.get("name")
-    coords = data.get("coordinates")
+        conn = schema_connection()
+        if not conn:
+            raise ConnectionError("Database connection failed")
+        now = datetime.datetime.now()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                INSERT INTO analysis_jobs (user_id, video_path, content_hash, zone_version, options,
+                                           status, total_frames, created_at, updated_at)
+                VALUES (%s, %s, %s, %s, %s, 'queued', %s, %s, %s)
+            """, (user_id, video_path, content_hash, zone_version, options, total_frames, now, now))
+            conn.commit()
+            job_id = cursor.lastrowid
+        finally:
+            cursor.close()
+            conn.close()
+        self.enqueue(job_id)
+        return job_id, False
 
-    if not name or not coords:
-        return jsonify({"message": "Invalid zone data"}), 400
+    def enqueue(self, job_id):
+        self._ensure_running()
+        with self.lock:
+            self.cancelled.discard(job_id)
+        self.pending.put(job_id)
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"message": "Database connection failed"}), 500
-    cursor = conn.cursor()
+    def cancel(self, job_id):
+        """Stop a queued or running job; it keeps its checkpoint and can be resumed."""
+        with self.lock:
+            job = self.running.get(job_id)
+            if job is None:
+                self.cancelled.add(job_id)
+        if job is not None:
+            job.stop(timeout=30)
+        else:
+            update_job_row(job_id, status="stopped")
 
-    cursor.execute("INSERT INTO zones (user_id, name, coordinates) VALUES (%s, %s, %s)",
-                   (user_id, name, json.dumps(coords)))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    def progress(self, job_id):
+        with self.lock:
+            job = self.running.get(job_id)
+        return job.progress() if job else None
 
-    return jsonify({"message": "Zone saved"}), 201
+    def recover(self):
+        """Requeue jobs that were queued or running when the server last exited."""
+        rows = fetch_job_rows("status IN ('queued', 'running')", ())
+        for row in rows or []:
+            self.enqueue(row["id"])
+        return len(rows or [])
 
-@app.route('/get_zones', methods=['GET'])
-@jwt_required()
-def get_zones():
-    user_id = get_jwt_identity()
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"message": "Database connection failed"}), 500
-    cursor = conn.cursor(dictionary=True)
+    def close(self):
+        with self.lock:
+            jobs = list(self.running.values())
+        for job in jobs:
+            job.interrupted = True
+            job.stop()
 
-    cursor.execute("SELECT id, name, coordinates FROM zones WHERE user_id=%s", (user_id,))
-    zones = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    def _ensure_running(self):
+        with self.lock:
+            self.workers = [t for t in self.workers if t.is_alive()]
+            while len(self.workers) < self.concurrency:
+                worker = threading.Thread(target=self._run, daemon=True)
+                worker.start()
+                self.workers.append(worker)
 
-    for z in zones:
-        z["coordinates"] = json.loads(z["coordinates"])
+    def _run(self):
+        while True:
+            job_id = self.pending.get()
+            try:
+                self._run_job(job_id)
+            except Exception as e:
+                print(f"Job {job_id} error:", e)
+                update_job_row(job_id, status="failed", error=str(e))
 
-    return jsonify({"zones": zones}), 200
+    def _run_job(self, job_id):
+        rows = fetch_job_rows("id = %s", (job_id,))
+        if not rows:
+            return
+        row = rows[0]
+        with self.lock:
+            if job_id in self.running:
+                return
+            if job_id in self.cancelled:
+                self.cancelled.discard(job_id)
+                return
+            if row["status"] not in JOB_ACTIVE_STATUSES:
+                return
+            job = AnalysisJob(job_id, str(row["user_id"]), row["video_path"],
+                              json.loads(row["options"] or "{}"), row["checkpoint_frame"], row["created_at"])
+            self.running[job_id] = job
+        try:
+            if not job.cap.isOpened():
+                job.cap.release()
+                update_job_row(job_id, status="failed", error="Failed to open video file.")
+                return
+            update_job_row(job_id, status="running", error=None)
+            job.start()
+            job.thread.join()
+        finally:
+            with self.lock:
+                self.running.pop(job_id, None)
 
-@app.route('/delete_zone/<int:zone_id>', methods=['DELETE'])
-@jwt_required()
-def delete_zone(zone_id):
-    user_id = get_jwt_identity()
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"message": "Database connection failed"}), 500
-    cursor = conn.cursor()
+analysis_jobs = AnalysisJobQueue()
+atexit.register(analysis_jobs.close)
 
-    cursor.execute("DELETE FROM zones WHERE id=%s AND user_id=%s", (zone_id, user_id))
-    conn.commit()
-    cursor.close()
-    conn.close()
+def job_response(row):
+    progress = analysis_jobs.progress(row["id"])
+    if progress is None:
+        progress = {
+            "frame_number": row["checkpoint_frame"],
+            "total_frames": row["total_frames"],
+            "fps": 0.0,
+            "eta_seconds": None
+        }
+    return {
+        "job_id": row["id"],
+        "status": row["status"],
+        "video": os.path.basename(row["video_path"]),
+        "checkpoint_frame": row["checkpoint_frame"],
+        "frame_number": progress["frame_number"],
+        "total_frames": progress["total_frames"],
+        "fps": progress["fps"],
+        "eta_seconds": progress["eta_seconds"],
+        "error": row["error"],
+        "created_at": row["created_at"].isoformat(),
+        "updated_at": row["updated_at"].isoformat()
+    }
 
-    return jsonify({"message": f"Zone {zone_id} deleted"}), 200
+def user_job_row(user_id, job_id):
+    rows = fetch_job_rows("id = %s AND user_id = %s", (job_id, user_id))
+    return rows[0] if rows else None
 
-# ==============================
-# VIDEO UPLOAD (unchanged)
-# ==============================
-@app.route('/upload_video', methods=['POST'])
+@app.route('/jobs', methods=['POST'])
 @jwt_required()
-def upload_video():
-    if 'video' not in request.files:
-        return jsonify({'error': 'No video'}), 400
-    file = request.files['video']
-    upload_dir = 'uploads'
-    os.makedirs(upload_dir, exist_ok=True)
-    
+def create_job():
+    """Queue an uploaded video (JSON video_id, default the latest upload) for offline analysis."""
     user_id = get_jwt_identity()
-    path = os.path.join(upload_dir, f"video_{user_id}.mp4")
-    file.save(path)
-    
-    with session_lock:
-        if user_id in video_sessions:
-            video_sessions[user_id]['cap'].release()
-            del video_sessions[user_id]
-            
-    return jsonify({'message': 'Uploaded and ready for analysis'}), 200
+    data = request.get_json(silent=True) or {}
+    video_path = requested_upload_path(user_id, data.get("video_id"))
+    if not video_path:
+        return jsonify({"error": "No uploaded video found for analysis. Please upload one."}), 404
 
-# ==============================
-# LIVE ANALYSIS SESSIONS
-# ==============================
-@app.route('/start_analysis', methods=['POST'])
+    try:
+        cadence_options = cadence_options_from_request()
+        DetectionCadence(**cadence_options)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid detection options: {e}"}), 400
+
+    try:
+        job_id, cached = analysis_jobs.create(user_id, video_path, cadence_options)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except (ConnectionError, RuntimeError, mysql.connector.Error) as e:
+        return jsonify({"error": str(e)}), 500
+    if cached:
+        return jsonify({"message": "This video was already analyzed with the current zones.",
+                        "job_id": job_id, "cached": True}), 200
+    return jsonify({"message": "Job queued.", "job_id": job_id, "cached": False}), 202
+
+@app.route('/jobs', methods=['GET'])
 @jwt_required()
-def start_analysis():
+def list_jobs():
     user_id = get_jwt_identity()
-    video_path = os.path.join("uploads", f"video_{user_id}.mp4")
+    rows = fetch_job_rows("user_id = %s", (user_id,))
+    if rows is None:
+        return jsonify({"error": "Database connection failed"}), 500
+    return jsonify([job_response(row) for row in rows]), 200
 
-    if not os.path.exists(video_path):
-        return jsonify({"error": "No uploaded video found for analysis. Please upload one."}), 404
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    row = user_job_row(get_jwt_identity(), job_id)
+    if not row:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_response(row)), 200
 
-    with session_lock:
-        if user_id in video_sessions:
-            try:
-                video_sessions[user_id]['cap'].release()
-            except Exception:
-                pass
-            del video_sessions[user_id]
-        
-        if user_id in last_zone_counts:
-            del last_zone_counts[user_id]
-            
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            return jsonify({"error": "Failed to open video file."}), 500
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@jwt_required()
+def cancel_job(job_id):
+    row = user_job_row(get_jwt_identity(), job_id)
+    if not row:
+        return jsonify({"error": "Job not found"}), 404
+    if row["status"] not in JOB_ACTIVE_STATUSES:
+        return jsonify({"error": f"Job is already {row['status']}"}), 409
+    analysis_jobs.cancel(job_id)
+    return jsonify({"message": "Job stopped."}), 200
 
-        video_sessions[user_id] = {
-            'cap': cap,
-            'total_frames': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
-            'current_frame': 0
-        }
-    
-    return jsonify({"message": "Analysis session started.", "total_frames": video_sessions[user_id]['total_frames']}), 200
+@app.route('/jobs/<int:job_id>/resume', methods=['POST'])
+@jwt_required()
+def resume_job(job_id):
+    row = user_job_row(get_jwt_identity(), job_id)
+    if not row:
+        return jsonify({"error": "Job not found"}), 404
+    if row["status"] not in ("stopped", "failed"):
+        return jsonify({"error": f"Job is {row['status']}"}), 409
+    update_job_row(job_id, status="queued")
+    analysis_jobs.enqueue(job_id)
+    return jsonify({"message": "Job queued.", "checkpoint_frame": row["checkpoint_frame"]}), 202
 # ==============================
 # PROFILES ROUTE (NEW)
 # ==============================
@@ -491,171 +3753,163 @@ def get_current_user():
 @app.route('/get_frame_data', methods=['GET'])
 @jwt_required()
 def get_frame_data():
+    """
+    Return the most recent result produced by the user's background worker.
+    Polling no longer advances the video; it only reads what has been analyzed.
+    """
     user_id = get_jwt_identity()
     
     with session_lock:
-        if user_id not in video_sessions:
-            return jsonify({"error": "Analysis session not started."}), 400
-        
-        session = video_sessions[user_id]
-        cap = session['cap']
-        
-        if session['current_frame'] >= session['total_frames']:
-            try: cap.release()
-            except Exception: pass
-            del video_sessions[user_id]
-            return jsonify({"message": "Video has ended.", "finished": True}), 200
-
-        ret, frame = cap.read()
-        if not ret:
-            try: cap.release()
-            except Exception: pass
-            del video_sessions[user_id]
-            return jsonify({"error": "Failed to read frame.", "finished": True}), 500
-        
-        session['current_frame'] += 1
-
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT id, name, coordinates FROM zones WHERE user_id=%s", (user_id,))
-    zones = cursor.fetchall()
-    
-    if not model:
-        conn.close()
-        return jsonify({"error": "YOLO model not loaded"}), 500
-
-    h, w, _ = frame.shape
-    results = model(frame, verbose=False)
-    detections = results[0].boxes
-
-    # Prepare detections for DeepSORT
-    dets_for_tracker = []
-    for det in detections:
-        try:
-            cls_i = int(det.cls.item())
-        except Exception:
-            cls_i = int(det.cls) if hasattr(det, 'cls') else 0
-
-        if cls_i == 0:  # person
-            x1, y1, x2, y2 = map(int, det.xyxy[0].tolist())
-            conf = float(det.conf.item()) if hasattr(det, "conf") else 0.9
-            dets_for_tracker.append(([x1, y1, x2 - x1, y2 - y1], conf, 'person'))
+        session = video_sessions.get(user_id)
+    if not session:
+        return jsonify({"error": "Analysis session not started."}), 400
 
-    overlay = frame.copy()
-    density_map = np.zeros((h, w), dtype=np.uint8) 
-    person_centers = []
+    with session.result_cond:
+        result = session.latest_result
 
-    # DeepSORT tracking
-    tracks = deepsort.update_tracks(dets_for_tracker, frame=frame)
-    for track in tracks:
-        if not track.is_confirmed():
-            continue
-        track_id = track.track_id
-        ltrb = track.to_ltrb()
-        x1, y1, x2, y2 = map(int, ltrb)
-        cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
+    if session.finished and (result is None or result["frame_number"] == session.served_frame):
+        with session_lock:
+            if video_sessions.get(user_id) is session:
+                del video_sessions[user_id]
+        if session.error:
+            return jsonify({"error": session.error, "finished": True}), 500
+        return jsonify({"message": "Video has ended.", "finished": True}), 200
 
-        cv2.rectangle(overlay, (x1, y1), (x2, y2), (255, 0, 0), 2)
-        cv2.putText(overlay, f"ID {track_id}", (x1, y1 - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+    if result is None:
+        # Worker has not finished its first frame yet
+        return jsonify({
+            "zone_counts": {},
+            "frame_number": 0,
+            "total_frames": session.total_frames,
+            "finished": False
+        }), 200
 
-        if 0 <= cy < h and 0 <= cx < w:
-            density_map[cy, cx] = 255
-            person_centers.append((cx, cy))
+    session.served_frame = result["frame_number"]
+    started = time.perf_counter()
+    response = jsonify({
+        "zone_counts": result["zone_counts"],
+        "frame_number": result["frame_number"],
+        "total_frames": session.total_frames,
+        **encode_views_base64(result, parse_views(request.args.get("views")), request_width()),
+        "finished": False
+    })
+    metrics.observe("crowd_request_seconds", time.perf_counter() - started, route="get_frame_data")
+    return response, 200
 
-    # Generate heatmap
-    density_map_blurred = cv2.GaussianBlur(density_map, (41, 41), 0)
-    heatmap_colored = cv2.applyColorMap(density_map_blurred, cv2.COLORMAP_JET)
-    frame_float = frame.astype(np.float32) / 255.0
-    heatmap_float = heatmap_colored.astype(np.float32) / 255.0
-    heatmap_overlay = cv2.addWeighted(frame_float, 0.5, heatmap_float, 0.5, 0)
-    heatmap_overlay = (heatmap_overlay * 255).astype(np.uint8)
+@app.route('/stop_analysis', methods=['POST'])
+@jwt_required()
+def stop_analysis_route():
+    user_id = get_jwt_identity()
 
-    # Zone counting
-    zone_counts = {}
-    if user_id not in last_zone_counts:
-        last_zone_counts[user_id] = {}
+    with user_session_lock(user_id):
+        with session_lock:
+            session = video_sessions.get(user_id)
+        running = session is not None and not session.finished
+        if running:
+            print(f"Stopping analysis worker for user {user_id}...")
+        # Signal the worker to exit its loop and wait for it to release the capture
+        stop_video_session(user_id)
 
-    for zone in zones:
-        coords = json.loads(zone["coordinates"])
-        pts = np.array([[p["x"], p["y"]] for p in coords], dtype=np.int32)
-        
-        current_count = 0
-        for cx, cy in person_centers:
-            if cv2.pointPolygonTest(pts, (cx, cy), False) >= 0:
-                current_count += 1
-                        
-        previous_count = last_zone_counts[user_id].get(zone["id"], 0)
-        entries_this_zone = max(0, current_count - previous_count)
-        exits_this_zone = max(0, previous_count - current_count)
+    if running:
+        zone_writer.flush()
+        print("Analysis stopped.")
+        return jsonify({"message": "Analysis stopped successfully"}), 200
+    else:
+        return jsonify({"message": "No active analysis to stop"}), 200
 
-        zone_counts[zone["id"]] = current_count
-        last_zone_counts[user_id][zone["id"]] = current_count
+@app.route('/events')
+@stream_jwt_required
+def events():
+    """Server-Sent Events channel for the dashboard (zone counts, analysis status)."""
+    user_id = get_jwt_identity()
+    q = event_broker.subscribe(user_id)
+    return Response(generate_events(user_id, q), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-        insert_query = """
-        INSERT INTO zone_analysis (user_id, timestamp, zone_id, people_count, entries, exits) 
-        VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        try:
-            cursor.execute(insert_query, (user_id, datetime.datetime.now(), zone["id"], current_count, entries_this_zone, exits_this_zone))
-        except Exception as e:
-            print("DB insert error:", e)
+@app.route('/db_pool_stats', methods=['GET'])
+@jwt_required()
+def db_pool_stats():
+    return jsonify(db_pool.stats()), 200
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+# (metric name, db_pool.stats() key)
+DB_POOL_COUNTERS = (
+    ("crowd_db_pool_created_total", "created"),
+    ("crowd_db_pool_acquired_total", "acquired"),
+    ("crowd_db_pool_timeouts_total", "timeouts"),
+    ("crowd_db_pool_health_check_failures_total", "health_check_failures"),
+    ("crowd_db_pool_wait_seconds_total", "wait_time_total_seconds"),
+)
 
-    # Draw zone boundaries
-    for zone in zones:
-        coords = json.loads(zone["coordinates"])
-        pts = np.array([[p["x"], p["y"]] for p in coords], dtype=np.int32)
-        cv2.polylines(overlay, [pts], isClosed=True, color=(0, 255, 0), thickness=2)
-        
-        cx = int(sum([p['x'] for p in coords]) / len(coords))
-        cy = int(sum([p['y'] for p in coords]) / len(coords))
-        label = f"{zone['name']}: {zone_counts.get(zone['id'], 0)}"
-        
-        (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-        cv2.rectangle(overlay, (cx, cy - th - 8), (cx + tw + 8, cy + 6), (0, 0, 0), -1)
-        cv2.putText(overlay, label, (cx + 4, cy - 2), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+def collect_state_metrics():
+    """Gauges and counters read from live state when /metrics is scraped."""
+    with session_lock:
+        sessions = list(video_sessions.values())
+    with camera_registry.lock:
+        cameras = list(camera_registry.sessions.values())
+    with live_session_lock:
+        live = list(live_sessions.values())
+    queue_stats = [(c.name, kind, dropped, lagged)
+                   for c in cameras for kind, (dropped, lagged) in c.queue_stats().items()]
+    with analysis_jobs.lock:
+        running_jobs = list(analysis_jobs.running.values())
+    with event_broker.lock:
+        subscribers = sum(len(subs) for subs in event_broker.subscribers.values())
+    pool = db_pool.stats()
 
-    _, buffer_overlay = cv2.imencode('.jpg', overlay)
-    overlay_base64 = base64.b64encode(buffer_overlay).decode('utf-8')
+    return [
+        ("crowd_video_sessions", "gauge", "Upload analysis sessions (running or finished, not yet read).",
+         [({"state": "running"}, sum(not s.finished for s in sessions)),
+          ({"state": "finished"}, sum(s.finished for s in sessions))]),
+        ("crowd_analysis_jobs", "gauge", "Offline analysis jobs in this process.",
+         [({"state": "running"}, len(running_jobs)), ({"state": "queued"}, analysis_jobs.pending.qsize())]),
+        ("crowd_cameras_running", "gauge", "Cameras with a capture thread.",
+         [({}, sum(c.is_running for c in cameras))]),
+        ("crowd_stream_viewers", "gauge", "Connected MJPEG viewers.",
+         [({"source": "video"}, sum(s.viewers for s in sessions) + sum(j.viewers for j in running_jobs)),
+          ({"source": "camera"}, sum(c.viewers for c in cameras)),
+          ({"source": "live"}, sum(s.viewers for s in live))]),
+        ("crowd_camera_frames_captured_total", "counter", "Frames read by each camera's capture thread.",
+         [({"camera": c.name}, c.seq) for c in cameras]),
+        ("crowd_camera_frames_dropped_total", "counter", "Frames dropped by a full consumer frame queue.",
+         [({"camera": name, "consumer": kind}, dropped) for name, kind, dropped, _ in queue_stats]),
+        ("crowd_camera_frames_lagged_total", "counter", "Frames skipped for waiting longer than LIVE_MAX_LAG_MS.",
+         [({"camera": name, "consumer": kind}, lagged) for name, kind, _, lagged in queue_stats]),
+        ("crowd_trackers", "gauge", "DeepSORT trackers held in the tracker pool.",
+         [({}, len(tracker_pool.trackers))]),
+        ("crowd_inference_queue_depth", "gauge", "Frames waiting for YOLO, and batches waiting for a worker.",
+         [({"queue": "frames"}, inference_scheduler.pending.qsize()),
+          ({"queue": "batches"}, inference_scheduler.batches.qsize())]),
+        ("crowd_zone_writer_pending_rows", "gauge", "zone_analysis rows waiting to be written.",
+         [({}, zone_writer.pending())]),
+        ("crowd_zone_writer_rows_total", "counter", "zone_analysis rows written or dropped by the writer.",
+         [({"outcome": "written"}, zone_writer.written_rows), ({"outcome": "dropped"}, zone_writer.dropped_rows)]),
+        ("crowd_zone_writer_failed_flushes_total", "counter", "Writer flushes that failed and were retried.",
+         [({}, zone_writer.failed_flushes)]),
+        ("crowd_zone_writer_failed_rollups_total", "counter",
+         "Flushes whose rollup upsert failed; the raw rows were kept and the rollups retried.",
+         [({}, zone_writer.failed_rollups)]),
+        ("crowd_model_ready", "gauge", "1 once the YOLO model is loaded and warmed up.",
+         [({}, int(model_loader.ready.is_set() and model_loader.model is not None))]),
+        ("crowd_event_subscribers", "gauge", "Open /events streams.", [({}, subscribers)]),
+        ("crowd_events_dropped_total", "counter", "Events dropped because a subscriber fell behind.",
+         [({}, event_broker.dropped_events)]),
+        ("crowd_db_pool_connections", "gauge", "Database pool connections.",
+         [({"state": "in_use"}, pool["in_use"]), ({"state": "idle"}, pool["idle"]), ({"state": "max"}, pool["size"])]),
+        ("crowd_db_pool_wait_max_seconds", "gauge", "Longest wait for a pooled connection.",
+         [({}, pool["wait_time_max_seconds"])]),
+    ] + [(name, "counter", f"Database pool {key.replace('_', ' ')}.", [({}, pool[key])])
+         for name, key in DB_POOL_COUNTERS]
 
-    _, buffer_heatmap = cv2.imencode('.jpg', heatmap_overlay)
-    heatmap_base64 = base64.b64encode(buffer_heatmap).decode('utf-8')
-    
-    return jsonify({
-        "zone_counts": zone_counts,
-        "frame_number": session['current_frame'],
-        "overlay_frame": overlay_base64,
-        "heatmap_frame": heatmap_base64,
-        "finished": False
-    }), 200
+@app.route('/ready')
+def ready():
+    """Readiness probe: 200 once the detection model is loaded and warmed up."""
+    is_ready = model_loader.is_ready()  # starts the load if nothing has yet
+    return jsonify({"ready": is_ready, **model_loader.status()}), 200 if is_ready else 503
 
-@app.route('/stop_analysis', methods=['POST'])
-@jwt_required()
-def stop_analysis_route():
-    global g_analysis_thread, g_analysis_stop_event
-    
-    if g_analysis_thread and g_analysis_thread.is_alive():
-        print("Stopping analysis thread...")
-        # 1. Set the stop event to signal the thread to exit its loop
-        g_analysis_stop_event.set()
-        
-        # 2. Wait for the thread to finish (optional, but good practice)
-        g_analysis_thread.join(timeout=5)
-        
-        # 3. Reset the globals for the next analysis
-        g_analysis_thread = None
-        g_analysis_stop_event.clear() # Clear the event for the next run
-        print("Analysis stopped and globals reset.")
-        
-        return jsonify({"message": "Analysis stopped successfully"}), 200
-    else:
-        return jsonify({"message": "No active analysis to stop"}), 200
+@app.route('/metrics')
+def metrics_route():
+    """Prometheus scrape endpoint (unauthenticated)."""
+    return Response(metrics.render(collect_state_metrics()), mimetype='text/plain; version=0.0.4')
 
 # ==============================
 # DAILY SUMMARY (unchanged)
@@ -669,36 +3923,85 @@ def get_daily_summary():
         return jsonify({"error": "Database connection failed"}), 500
     cursor = conn.cursor(dictionary=True)
 
-    today = datetime.date.today()
-
-    cursor.execute("""
-        SELECT SUM(entries) as total_entries, SUM(exits) as total_exits
-        FROM zone_analysis
-        WHERE user_id = %s AND DATE(timestamp) = %s
-    """, (user_id, today))
-    daily_summary = cursor.fetchone()
-
-    total_entries = int(daily_summary['total_entries']) if daily_summary and daily_summary['total_entries'] else 0
-    total_exits = int(daily_summary['total_exits']) if daily_summary and daily_summary['total_exits'] else 0
-
-    cursor.execute("""
-        SELECT 
-            HOUR(za.timestamp) as hour, 
-            AVG(za.people_count) as avg_people_count,
-            z.name as zone_name
-        FROM zone_analysis za
-        JOIN zones z ON za.zone_id = z.id
-        WHERE za.user_id = %s AND DATE(za.timestamp) = %s
-        GROUP BY HOUR(za.timestamp), z.name
-        ORDER BY HOUR(za.timestamp)
-    """, (user_id, today))
-    hourly_data_raw = cursor.fetchall()
-    
+    # Read the hourly rollups with a plain range on the indexed bucket column
+    day_start = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+    day_end = day_start + datetime.timedelta(days=1)
+
+    # Rows written before the rollups existed have no rollup buckets: the
+    # part of the day before the first minute bucket (or all of it, if the
+    # rollup tables are missing) is read from zone_analysis
+    try:
+        cursor.execute("""
+            SELECT MIN(bucket_start) as first_bucket
+            FROM zone_rollup_minute
+            WHERE user_id = %s AND bucket_start >= %s AND bucket_start < %s
+        """, (user_id, day_start, day_end))
+        first_bucket = cursor.fetchone()
+        raw_end = first_bucket['first_bucket'] if first_bucket and first_bucket['first_bucket'] else day_end
+
+        cursor.execute("""
+            SELECT SUM(entries) as total_entries, SUM(exits) as total_exits
+            FROM zone_rollup_hour
+            WHERE user_id = %s AND bucket_start >= %s AND bucket_start < %s
+        """, (user_id, day_start, day_end))
+        summaries = [cursor.fetchone()]
+
+        cursor.execute("""
+            SELECT 
+                zr.bucket_start as bucket_start, 
+                SUM(zr.count_sum) as count_sum,
+                SUM(zr.samples) as samples,
+                z.name as zone_name
+            FROM zone_rollup_hour zr
+            JOIN zones z ON zr.zone_id = z.id
+            WHERE zr.user_id = %s AND zr.bucket_start >= %s AND zr.bucket_start < %s
+            GROUP BY zr.bucket_start, z.name
+        """, (user_id, day_start, day_end))
+        hourly_data_raw = [(row['zone_name'], row['bucket_start'].hour, row['count_sum'], row['samples'])
+                           for row in cursor.fetchall()]
+    except mysql.connector.Error as e:
+        if e.errno != 1146:  # ER_NO_SUCH_TABLE
+            raise
+        raw_end, summaries, hourly_data_raw = day_end, [], []
+
+    if raw_end > day_start:
+        cursor.execute("""
+            SELECT SUM(entries) as total_entries, SUM(exits) as total_exits
+            FROM zone_analysis
+            WHERE user_id = %s AND timestamp >= %s AND timestamp < %s
+        """, (user_id, day_start, raw_end))
+        summaries.append(cursor.fetchone())
+
+        cursor.execute("""
+            SELECT 
+                HOUR(za.timestamp) as hour, 
+                SUM(za.people_count) as count_sum,
+                COUNT(*) as samples,
+                z.name as zone_name
+            FROM zone_analysis za
+            JOIN zones z ON za.zone_id = z.id
+            WHERE za.user_id = %s AND za.timestamp >= %s AND za.timestamp < %s
+            GROUP BY HOUR(za.timestamp), z.name
+        """, (user_id, day_start, raw_end))
+        hourly_data_raw.extend((row['zone_name'], int(row['hour']), row['count_sum'], row['samples'])
+                               for row in cursor.fetchall())
+
+    total_entries = total_exits = 0
+    for daily_summary in summaries:
+        if daily_summary:
+            total_entries += int(daily_summary['total_entries'] or 0)
+            total_exits += int(daily_summary['total_exits'] or 0)
+
+    # The hour the rollups started in has rows from both sources: add them up
+    hourly_totals = {}
+    for zone_name, hour, count_sum, samples in hourly_data_raw:
+        totals = hourly_totals.setdefault((zone_name, hour), [0, 0])
+        totals[0] += int(count_sum or 0)
+        totals[1] += int(samples or 0)
+
     hourly_trend_by_zone = {}
-    for row in hourly_data_raw:
-        zone_name = row['zone_name']
-        hour = row['hour']
-        avg_count = float(row['avg_people_count']) if row['avg_people_count'] else 0
+    for (zone_name, hour), (count_sum, samples) in hourly_totals.items():
+        avg_count = count_sum / samples if samples else 0
         
         if zone_name not in hourly_trend_by_zone:
             hourly_trend_by_zone[zone_name] = [0] * 24
@@ -714,6 +4017,287 @@ def get_daily_summary():
         "hourly_trend_by_zone": hourly_trend_by_zone
     }), 200
 
+@app.route('/get_zone_rollups', methods=['GET'])
+@jwt_required()
+def get_zone_rollups():
+    """
+    Rollup rows for a time range: ?resolution=minute|hour&start=&end=
+    (ISO datetimes, default the last 24 hours) and an optional &zone_id=.
+    """
+    user_id = get_jwt_identity()
+    resolution = request.args.get("resolution", "hour")
+    if resolution not in ROLLUP_TABLES:
+        return jsonify({"error": f"Unknown resolution: {resolution}"}), 400
+    try:
+        end = datetime.datetime.fromisoformat(request.args["end"]) if "end" in request.args else datetime.datetime.now()
+        start = datetime.datetime.fromisoformat(request.args["start"]) if "start" in request.args else end - datetime.timedelta(days=1)
+        zone_id = int(request.args["zone_id"]) if "zone_id" in request.args else None
+    except ValueError:
+        return jsonify({"error": "start/end must be ISO datetimes and zone_id an integer"}), 400
+
+    conn = schema_connection()
+    if not conn:
+        return jsonify({"error": "Database connection failed"}), 500
+    cursor = conn.cursor(dictionary=True)
+
+    query = f"""
+        SELECT bucket_start, zone_id, samples, count_sum, count_min, count_max, entries, exits
+        FROM {ROLLUP_TABLES[resolution]}
+        WHERE user_id = %s AND bucket_start >= %s AND bucket_start < %s
+    """
+    params = [user_id, start, end]
+    if zone_id is not None:
+        query += " AND zone_id = %s"
+        params.append(zone_id)
+    cursor.execute(query + " ORDER BY bucket_start, zone_id", params)
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    return jsonify({
+        "resolution": resolution,
+        "rollups": [{
+            "bucket_start": row["bucket_start"].isoformat(),
+            "zone_id": row["zone_id"],
+            "avg_count": round(row["count_sum"] / row["samples"], 3) if row["samples"] else 0.0,
+            "min_count": row["count_min"],
+            "max_count": row["count_max"],
+            "entries": row["entries"],
+            "exits": row["exits"]
+        } for row in rows]
+    }), 200
+
+# ==============================
+# ZONE TIME SERIES
+# ==============================
+# Counts of one zone over an arbitrary range, reduced to about `points`
+# buckets. Each bucket is read from the coarsest table whose rows line up
+# with the buckets (hour rollups, minute rollups or raw rows); the part of
+# the range before the table's first rollup (rows written before the
+# rollups existed) is read from the raw rows. Source rows are read in
+# keyset pages of TIMESERIES_PAGE_ROWS and the JSON is streamed, so memory
+# stays bounded whatever the range. A response holds at most
+# TIMESERIES_MAX_POINTS buckets; "next" gives the parameters for the rest.
+TIMESERIES_MAX_POINTS = int(os.environ.get("TIMESERIES_MAX_POINTS", 2000))
+TIMESERIES_PAGE_ROWS = int(os.environ.get("TIMESERIES_PAGE_ROWS", 5000))
+TIMESERIES_DEFAULT_POINTS = 500
+
+TIMESERIES_ROW_SECONDS = (("hour", 3600), ("minute", 60))
+
+def timeseries_source(start, bucket_seconds):
+    """
+    Coarsest table whose rows each fall inside one output bucket: the row
+    width divides the bucket size and start is on a row boundary.
+    """
+    offset = (start - start.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()
+    for source, width in TIMESERIES_ROW_SECONDS:
+        if bucket_seconds % width == 0 and offset % width == 0:
+            return source
+    return "raw"
+
+def first_rollup_bucket(user_id, zone_id, source, start, end):
+    """Earliest rollup bucket of the zone in [start, end), or None (also when the table is missing)."""
+    conn = get_db_connection()
+    if not conn:
+        raise ConnectionError("Database connection failed")
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT MIN(bucket_start) FROM {ROLLUP_TABLES[source]}
+            WHERE user_id = %s AND zone_id = %s AND bucket_start >= %s AND bucket_start < %s
+        """, (user_id, zone_id, start, end))
+        row = cursor.fetchone()
+    except mysql.connector.Error as e:
+        if e.errno != 1146:  # ER_NO_SUCH_TABLE
+            raise
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+    return row[0] if row else None
+
+def iter_series_rows(user_id, zone_id, source, start, end):
+    """iter_zone_rows() over `source`, with raw rows for the part of the range before its first rollup."""
+    rollup_start = end
+    if source != "raw":
+        rollup_start = first_rollup_bucket(user_id, zone_id, source, start, end) or end
+    if rollup_start > start:
+        yield from iter_zone_rows(user_id, zone_id, "raw", start, rollup_start)
+    if rollup_start < end:
+        yield from iter_zone_rows(user_id, zone_id, source, rollup_start, end)
+
+def iter_zone_rows(user_id, zone_id, source, start, end, page_rows=TIMESERIES_PAGE_ROWS):
+    """
+    (time, samples, count_sum, count_min, count_max) for one zone in time
+    order, fetched page by page with a keyset on the sort key.
+    """
+    if source == "raw":
+        select = """
+            SELECT timestamp, 1, people_count, people_count, people_count, id
+            FROM zone_analysis
+            WHERE user_id = %s AND zone_id = %s AND timestamp >= %s AND timestamp < %s"""
+        after = " AND (timestamp > %s OR (timestamp = %s AND id > %s))"
+        order = " ORDER BY timestamp, id"
+    else:
+        select = f"""
+            SELECT bucket_start, samples, count_sum, count_min, count_max
+            FROM {ROLLUP_TABLES[source]}
+            WHERE user_id = %s AND zone_id = %s AND bucket_start >= %s AND bucket_start < %s"""
+        after = " AND bucket_start > %s"
+        order = " ORDER BY bucket_start"
+
+    last = None
+    while True:
+        query, params = select, [user_id, zone_id, start, end]
+        if last is not None:
+            query += after
+            params += [last[0], last[0], last[5]] if source == "raw" else [last[0]]
+        conn = get_db_connection()
+        if not conn:
+            raise ConnectionError("Database connection failed")
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"{query}{order} LIMIT {int(page_rows)}", params)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+        for row in rows:
+            yield row[:5]
+        if len(rows) < page_rows:
+            return
+        last = rows[-1]
+
+def minmax_buckets(rows, start, bucket_seconds):
+    """Fold time-ordered source rows into (bucket index, samples, sum, min, max)."""
+    current = None
+    for t, samples, total, low, high in rows:
+        index = int((t - start).total_seconds() // bucket_seconds)
+        if current is not None and current[0] == index:
+            current[1] += samples
+            current[2] += total
+            current[3] = min(current[3], low)
+            current[4] = max(current[4], high)
+            continue
+        if current is not None:
+            yield tuple(current)
+        current = [index, samples, total, low, high]
+    if current is not None:
+        yield tuple(current)
+
+def lttb_points(buckets):
+    """
+    Largest-Triangle-Three-Buckets over (index, [(x, y), ...]) buckets: keeps
+    the first and last points and, from every bucket in between, the point
+    that forms the largest triangle with the previously kept point and the
+    next bucket's average. Only two buckets are held at a time.
+    """
+    buckets = iter(buckets)
+    current = next(buckets, None)
+    if current is None:
+        return
+    previous = current[1][0]
+    yield current[0], previous
+    current = next(buckets, None)
+    while current is not None:
+        following = next(buckets, None)
+        if following is None:
+            yield current[0], current[1][-1]
+            return
+        avg_x = sum(p[0] for p in following[1]) / len(following[1])
+        avg_y = sum(p[1] for p in following[1]) / len(following[1])
+        px, py = previous
+        previous = max(current[1], key=lambda p: abs((px - avg_x) * (p[1] - py) - (px - p[0]) * (avg_y - py)))
+        yield current[0], previous
+        current = following
+
+def point_buckets(rows, start, bucket_seconds):
+    """Group source rows into (bucket index, [(seconds from start, average count)])."""
+    current = None
+    for t, samples, total, _, _ in rows:
+        x = (t - start).total_seconds()
+        index = int(x // bucket_seconds)
+        if current is None or current[0] != index:
+            if current is not None:
+                yield current
+            current = (index, [])
+        current[1].append((x, total / samples if samples else 0.0))
+    if current is not None:
+        yield current
+
+def generate_timeseries(user_id, zone_id, start, end, bucket_seconds, mode):
+    """Stream the time series as one JSON document, bucket by bucket."""
+    source = timeseries_source(start, bucket_seconds)
+    rows = iter_series_rows(user_id, zone_id, source, start, end)
+    yield json.dumps({"zone_id": zone_id, "start": start.isoformat(), "end": end.isoformat(),
+                      "bucket_seconds": bucket_seconds, "source": source, "mode": mode})[:-1] + ', "points": ['
+
+    if mode == "lttb":
+        points = ((index, {"t": (start + datetime.timedelta(seconds=x)).isoformat(), "value": round(y, 3)})
+                  for index, (x, y) in lttb_points(point_buckets(rows, start, bucket_seconds)))
+    else:
+        points = ((index, {"t": (start + datetime.timedelta(seconds=index * bucket_seconds)).isoformat(),
+                           "min": low, "avg": round(total / samples, 3) if samples else 0.0, "max": high,
+                           "samples": samples})
+                  for index, samples, total, low, high in minmax_buckets(rows, start, bucket_seconds))
+
+    emitted = 0
+    next_page = None
+    try:
+        for index, point in points:
+            if emitted == TIMESERIES_MAX_POINTS:
+                resume = start + datetime.timedelta(seconds=index * bucket_seconds)
+                next_page = {"start": resume.isoformat(), "end": end.isoformat(), "bucket_seconds": bucket_seconds}
+                break
+            yield ("," if emitted else "") + json.dumps(point)
+            emitted += 1
+    except (ConnectionError, mysql.connector.Error) as e:
+        # Headers are gone already; report the error inside the document
+        yield '], "error": ' + json.dumps(str(e)) + ', "next": null}'
+        return
+    finally:
+        rows.close()
+    yield '], "next": ' + json.dumps(next_page) + '}'
+
+@app.route('/zone_timeseries', methods=['GET'])
+@jwt_required()
+def zone_timeseries():
+    """
+    ?zone_id=&start=&end= (ISO datetimes, default the last 24 hours) and
+    either &points= (target bucket count) or &bucket_seconds=.
+    &mode=minmax (default: min/avg/max per bucket) or lttb (one
+    representative point per bucket).
+    """
+    user_id = get_jwt_identity()
+    mode = request.args.get("mode", "minmax")
+    if mode not in ("minmax", "lttb"):
+        return jsonify({"error": f"Unknown mode: {mode}"}), 400
+    try:
+        zone_id = int(request.args["zone_id"])
+        end = datetime.datetime.fromisoformat(request.args["end"]) if "end" in request.args else datetime.datetime.now()
+        start = datetime.datetime.fromisoformat(request.args["start"]) if "start" in request.args else end - datetime.timedelta(days=1)
+        points = int(request.args.get("points", TIMESERIES_DEFAULT_POINTS))
+        bucket_seconds = int(request.args["bucket_seconds"]) if "bucket_seconds" in request.args else None
+    except KeyError:
+        return jsonify({"error": "zone_id is required"}), 400
+    except ValueError:
+        return jsonify({"error": "start/end must be ISO datetimes; zone_id, points and bucket_seconds integers"}), 400
+    if end <= start or points <= 0 or (bucket_seconds is not None and bucket_seconds <= 0):
+        return jsonify({"error": "Empty range or non-positive bucket size"}), 400
+
+    if bucket_seconds is None:
+        bucket_seconds = max(1, math.ceil((end - start).total_seconds() / points))
+        # Round to whole rollup rows and start on a row boundary, so the buckets can be read from a rollup table
+        for _, width in TIMESERIES_ROW_SECONDS:
+            if bucket_seconds >= width:
+                bucket_seconds = math.ceil(bucket_seconds / width) * width
+                midnight = start.replace(hour=0, minute=0, second=0, microsecond=0)
+                start = midnight + datetime.timedelta(
+                    seconds=(start - midnight).total_seconds() // width * width)
+                break
+    return Response(generate_timeseries(user_id, zone_id, start, end, bucket_seconds, mode),
+                    mimetype='application/json')
+
 # ==============================
 # STATIC ROUTES
 # ==============================
@@ -732,4 +4316,12 @@ def static_files(filename):
 if __name__ == '__main__':
     print("Start app. Make sure table `zones` exists with: id, user_id, name, coordinates(JSON)")
     print("Also, create table `zone_analysis` with columns: id INT AUTO_INCREMENT PRIMARY KEY, user_id INT, timestamp DATETIME, zone_id INT, people_count INT, entries INT, exits INT")
-    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
+    debug = True
+    # With the reloader, the parent process only watches files; only the
+    # serving child loads the model and runs jobs
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        model_loader.start()
+        if ensure_schema():
+            print("Rollup, video and job tables are ready.")
+            print(f"Resumed {analysis_jobs.recover()} analysis job(s).")
+    app.run(debug=debug, host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
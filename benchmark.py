@@ -0,0 +1,542 @@
+"""
+Offline benchmark for the frame analysis pipeline.
+
+Runs app.analyze_frame() on synthetic video (or a bundled clip with --video)
+against an SQLite stand-in for MySQL, and reports throughput and p50/p95/p99
+latency per stage: decode, detect (YOLO), track (DeepSORT), zones, heatmap,
+encode (JPEG + base64, as /get_frame_data returns it) and db_write (one
+zone_writer flush). Every combination of the swept zone counts, people
+counts, resolutions and concurrent sessions is run, and the results are
+written as JSON so runs can be diffed in CI:
+
+    python benchmark.py --zones 1,8 --people 5,25 --resolutions 640x360,1280x720 \\
+        --sessions 1,4 --frames 60 --output benchmark.json
+
+--detector synthetic swaps YOLO for a color-threshold detector that finds the
+drawn people, so the tracker and zone stages see the swept people counts
+(YOLO does not recognize the synthetic figures as persons).
+
+--backend/--int8 pick the detector runtime for the run (DETECTOR_BACKEND and
+DETECTOR_INT8 in app.py). --compare-backends checks that other runtimes find
+the same persons as PyTorch on frames sampled from the first input (use
+--video with a real clip); it reports recall, precision and mean IoU against
+the PyTorch boxes plus per-frame latency, and fails the run when recall or
+precision drops below --min-agreement:
+
+    python benchmark.py --video clip.mp4 --compare-backends onnx,onnx:int8,openvino,openvino:int8
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import mysql.connector
+import numpy as np
+
+# The detector is picked by --detector; don't load the YOLO model on import
+os.environ.setdefault("MODEL_PRELOAD", "0")
+import app
+
+STAGES = ("decode", "detect", "track", "zones", "heatmap", "pipeline", "encode", "db_write")
+PERSON_COLOR = (40, 40, 220)  # BGR; the synthetic background never contains it
+
+# ==============================
+# SQLITE STAND-IN FOR MYSQL
+# ==============================
+MYSQL_TO_SQLITE = [
+    (re.compile(r"ON DUPLICATE KEY UPDATE"), "ON CONFLICT (user_id, bucket_start, zone_id) DO UPDATE SET"),
+    (re.compile(r"VALUES\((\w+)\)"), r"excluded.\1"),
+    (re.compile(r"GREATEST\("), "MAX("),
+    (re.compile(r"LEAST\("), "MIN("),
+    (re.compile(r"%s"), "?"),
+]
+
+SQLITE_SCHEMA = [
+    "CREATE TABLE zones (id INTEGER PRIMARY KEY, user_id INT, name TEXT, coordinates TEXT)",
+    """CREATE TABLE zone_analysis (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INT, timestamp DATETIME,
+                                   zone_id INT, people_count INT, entries INT, exits INT)""",
+] + [f"""CREATE TABLE {table} (user_id INT, bucket_start DATETIME, zone_id INT, samples INT, count_sum INT,
+                               count_min INT, count_max INT, entries INT, exits INT, PRIMARY KEY (user_id, bucket_start, zone_id))"""
+     for table in app.ROLLUP_TABLES.values()]
+
+# Read DATETIME columns back as datetime objects, like mysql.connector does
+sqlite3.register_converter("DATETIME", lambda value: datetime.datetime.fromisoformat(value.decode()))
+
+def to_sqlite(query):
+    for pattern, replacement in MYSQL_TO_SQLITE:
+        query = pattern.sub(replacement, query)
+    return query
+
+def sqlite_params(params):
+    return tuple(p.isoformat(" ") if isinstance(p, datetime.datetime) else p for p in params)
+
+class SQLiteDatabase:
+    """One shared SQLite connection; every statement runs under a lock."""
+    def __init__(self, path=":memory:"):
+        self.db = sqlite3.connect(path, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.lock = threading.Lock()
+        for statement in SQLITE_SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def connect(self):
+        return SQLiteConnection(self)
+
+class SQLiteConnection:
+    """Just enough of a mysql.connector connection for the queries the pipeline runs."""
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self, dictionary=False):
+        return SQLiteCursor(self.database, dictionary)
+
+    @property
+    def in_transaction(self):
+        return self.database.db.in_transaction
+
+    def commit(self):
+        with self.database.lock:
+            self.database.db.commit()
+
+    def rollback(self):
+        with self.database.lock:
+            self.database.db.rollback()
+
+    def close(self):
+        pass
+
+class SQLiteCursor:
+    def __init__(self, database, dictionary):
+        self.database = database
+        self.dictionary = dictionary
+        self.rows = []
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, query, params=()):
+        self._run(lambda db: db.execute(to_sqlite(query), sqlite_params(params)))
+
+    def executemany(self, query, seq_params):
+        self._run(lambda db: db.executemany(to_sqlite(query), [sqlite_params(p) for p in seq_params]))
+
+    def _run(self, statement):
+        with self.database.lock:
+            try:
+                cursor = statement(self.database.db)
+            except sqlite3.Error as e:
+                raise mysql.connector.Error(msg=str(e))
+            self.rowcount, self.lastrowid = cursor.rowcount, cursor.lastrowid
+            rows = cursor.fetchall()
+            if self.dictionary and cursor.description:
+                names = [column[0] for column in cursor.description]
+                rows = [dict(zip(names, row)) for row in rows]
+            self.rows = rows
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+# ==============================
+# SYNTHETIC INPUT
+# ==============================
+def synthetic_video(path, width, height, people, frames, fps=25, seed=0):
+    """Write an MJPG clip of `people` figures walking over a textured background."""
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(60, 180, width, dtype=np.float32)[None, :, None]
+    background = np.clip(gradient + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+    background[..., 2] = background[..., 1]  # keep the person color out of the background
+
+    pw, ph = max(6, width // 40), max(14, height // 8)
+    pos = rng.uniform([0, 0], [width - pw, height - ph], (people, 2))
+    vel = rng.uniform(-1, 1, (people, 2)) * (width / 150)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    try:
+        for _ in range(frames):
+            frame = background.copy()
+            for x, y in pos.astype(int):
+                cv2.rectangle(frame, (x, y + ph // 4), (x + pw, y + ph), PERSON_COLOR, -1)
+                cv2.circle(frame, (x + pw // 2, y + ph // 8), max(2, pw // 3), PERSON_COLOR, -1)
+            writer.write(frame)
+            pos += vel
+            out = (pos < 0) | (pos > [width - pw, height - ph])
+            vel[out] *= -1
+            pos = np.clip(pos, 0, [width - pw, height - ph])
+    finally:
+        writer.release()
+
+def synthetic_zones(count, width, height):
+    """`count` overlapping rectangles laid out on a grid, in the coordinates script.js saves."""
+    cols = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / cols)
+    cw, ch = width / cols, height / rows
+    zones = []
+    for i in range(count):
+        x0, y0 = (i % cols) * cw, (i // cols) * ch
+        x1, y1 = min(width - 1, x0 + cw * 1.2), min(height - 1, y0 + ch * 1.2)
+        zones.append([{"x": int(x0), "y": int(y0)}, {"x": int(x1), "y": int(y0)},
+                      {"x": int(x1), "y": int(y1)}, {"x": int(x0), "y": int(y1)}])
+    return zones
+
+def synthetic_detector(frames, **kwargs):
+    """Stand-in for the YOLO model: boxes around the person-colored blobs in each frame."""
+    results = []
+    for frame in frames:
+        mask = cv2.inRange(frame, np.array(PERSON_COLOR) - 30, np.array(PERSON_COLOR) + 30)
+        n, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        boxes = stats[1:n]
+        boxes = boxes[boxes[:, cv2.CC_STAT_AREA] >= 12]
+        xyxy = np.column_stack((boxes[:, 0], boxes[:, 1], boxes[:, 0] + boxes[:, 2],
+                                boxes[:, 1] + boxes[:, 3])).astype(np.float32)
+        results.append(app.DetectionResult(xyxy, np.full(len(xyxy), 0.9, np.float32),
+                                           np.zeros(len(xyxy), np.float32)))
+    return results
+
+# ==============================
+# MEASUREMENT
+# ==============================
+class StageRecorder:
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self.items = {stage: 0 for stage in STAGES}
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds, items=1):
+        with self.lock:
+            self.samples[stage].append(seconds)
+            self.items[stage] += items
+
+    def summary(self):
+        report = {}
+        for stage in STAGES:
+            samples = np.array(self.samples[stage], dtype=np.float64)
+            if not len(samples):
+                continue
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000
+            total = float(samples.sum())
+            report[stage] = {
+                "count": int(len(samples)),
+                "items": self.items[stage],
+                "mean_ms": round(float(samples.mean()) * 1000, 3),
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+                # Items per second of time spent in the stage (rows for db_write)
+                "throughput_per_s": round(self.items[stage] / total, 1) if total > 0 else None
+            }
+        return report
+
+def timed_flush(writer, recorder):
+    """Wrap writer.flush so every flush that writes rows is recorded as db_write."""
+    flush = writer.flush
+
+    def wrapper():
+        started = time.perf_counter()
+        written = flush()
+        if written:
+            recorder.add("db_write", time.perf_counter() - started, written)
+        return written
+    writer.flush = wrapper
+    return flush
+
+def run_session(user_id, session_key, video_path, frames, warmup, views, recorder, errors):
+    cap = app.open_video_capture(video_path)
+    app.tracker_pool.release(session_key)
+    app.tracker_pool.acquire(session_key)
+    app.heatmap_store.reset(session_key)
+    app.inference_scheduler.register_source()
+    try:
+        for index in range(warmup + frames):
+            started = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret, frame = cap.read()
+                if not ret:
+                    raise RuntimeError(f"Cannot read {video_path}")
+            decode = time.perf_counter() - started
+
+            result = app.analyze_frame(user_id, frame, session_key)
+
+            started = time.perf_counter()
+            app.encode_views_base64(result, views)
+            encode = time.perf_counter() - started
+
+            if index < warmup:
+                continue
+            recorder.add("decode", decode)
+            for stage, seconds in result["timings"].items():
+                recorder.add("pipeline" if stage == "total" else stage, seconds)
+            recorder.add("encode", encode)
+    except Exception as e:
+        errors.append(f"{session_key}: {type(e).__name__}: {e}")
+    finally:
+        cap.release()
+        app.inference_scheduler.unregister_source()
+        app.tracker_pool.release(session_key)
+
+def run_config(database, config, user_id, video_path, args):
+    width, height = config["resolution"]
+    zones = synthetic_zones(config["zones"], width, height)
+    conn = database.connect()
+    cursor = conn.cursor()
+    cursor.executemany("INSERT INTO zones (user_id, name, coordinates) VALUES (%s, %s, %s)",
+                       [(user_id, f"Zone {i + 1}", json.dumps(z)) for i, z in enumerate(zones)])
+    conn.commit()
+    app.zone_cache.invalidate(user_id)
+
+    recorder = StageRecorder()
+    flush = timed_flush(app.zone_writer, recorder)
+    errors = []
+    threads = [threading.Thread(target=run_session,
+                                args=(user_id, f"bench:{user_id}:{s}", video_path, args.frames,
+                                      args.warmup, args.views, recorder, errors))
+               for s in range(config["sessions"])]
+    started = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        app.zone_writer.flush()
+    finally:
+        app.zone_writer.flush = flush
+    wall = time.perf_counter() - started
+
+    analyzed = args.frames * config["sessions"]
+    return {
+        "config": {**config, "resolution": f"{width}x{height}"},
+        "frames": analyzed,
+        "wall_seconds": round(wall, 3),
+        "fps": round(analyzed / wall, 2) if wall > 0 else None,
+        "stages": recorder.summary(),
+        "errors": errors
+    }
+
+# ==============================
+# BACKEND EQUIVALENCE
+# ==============================
+def sample_frames(path, count):
+    """`count` frames spread evenly over the clip at `path`."""
+    cap = app.open_video_capture(path)
+    frames = []
+    try:
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or count
+        for index in np.linspace(0, total - 1, min(count, total)).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ret, frame = cap.read()
+            if ret:
+                frames.append(frame)
+    finally:
+        cap.release()
+    return frames
+
+def person_boxes(result, scale):
+    """Person boxes of one ultralytics result, in original frame coordinates."""
+    xyxy, _, cls = app.detection_arrays(result)
+    return xyxy[cls == 0] * np.tile(scale, 2)
+
+def iou_matrix(a, b):
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+def match_boxes(reference, candidate, threshold=0.5):
+    """Greedy one-to-one matching by IoU; returns the IoUs of the matched pairs."""
+    if not len(reference) or not len(candidate):
+        return []
+    iou = iou_matrix(reference, candidate)
+    matched = []
+    while True:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[i, j] < threshold:
+            return matched
+        matched.append(float(iou[i, j]))
+        iou[i, :] = -1
+        iou[:, j] = -1
+
+def compare_backends(specs, frames, min_agreement):
+    """Run every (backend, int8) in `specs` on `frames` and compare with PyTorch."""
+    inputs = [app.inference_input(frame) for frame in frames]
+    reference = None
+    report = []
+    for backend, int8 in [("pytorch", False)] + [s for s in specs if s != ("pytorch", False)]:
+        model = app.load_detector(app.MODEL_PATH, backend, int8)
+        model(np.zeros(app.MODEL_WARMUP_SHAPE, dtype=np.uint8), verbose=False, classes=app.DETECT_CLASSES)
+        latencies, detections = [], []
+        for small, scale in inputs:
+            started = time.perf_counter()
+            result = model([small], verbose=False, classes=app.DETECT_CLASSES)[0]
+            latencies.append(time.perf_counter() - started)
+            detections.append(person_boxes(result, scale))
+        entry = {
+            "backend": backend,
+            "int8": int8,
+            "persons": int(sum(len(d) for d in detections)),
+            "mean_ms": round(float(np.mean(latencies)) * 1000, 3),
+            "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3)
+        }
+        if reference is None:
+            reference = detections
+        else:
+            ious = [iou for ref, cand in zip(reference, detections) for iou in match_boxes(ref, cand)]
+            expected = sum(len(d) for d in reference)
+            recall = len(ious) / expected if expected else 1.0
+            precision = len(ious) / entry["persons"] if entry["persons"] else 1.0
+            entry.update({
+                "recall": round(recall, 4),
+                "precision": round(precision, 4),
+                "mean_iou": round(float(np.mean(ious)), 4) if ious else None,
+                "equivalent": recall >= min_agreement and precision >= min_agreement
+            })
+        report.append(entry)
+        print(f"backend={backend + (':int8' if int8 else ''):<14} persons={entry['persons']:<5} "
+              f"mean={entry['mean_ms']}ms recall={entry.get('recall')} precision={entry.get('precision')}",
+              file=sys.stderr)
+    return report
+
+# ==============================
+# COMMAND LINE
+# ==============================
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+def resolution_list(value):
+    return [tuple(int(n) for n in v.lower().split("x")) for v in value.split(",") if v]
+
+def backend_list(value):
+    """'onnx,openvino:int8' -> [("onnx", False), ("openvino", True)]"""
+    specs = []
+    for v in value.split(","):
+        if v:
+            backend, _, precision = v.lower().partition(":")
+            if backend not in app.DETECTOR_BACKENDS or precision not in ("", "int8"):
+                raise argparse.ArgumentTypeError(f"invalid backend {v!r}")
+            specs.append((backend, precision == "int8"))
+    return specs
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the crowd analysis pipeline.")
+    parser.add_argument("--zones", type=int_list, default=[1, 8], help="zone counts to sweep")
+    parser.add_argument("--people", type=int_list, default=[5, 25], help="people per synthetic frame to sweep")
+    parser.add_argument("--resolutions", type=resolution_list, default=[(640, 360), (1280, 720)],
+                        help="WxH resolutions to sweep")
+    parser.add_argument("--sessions", type=int_list, default=[1, 4], help="concurrent sessions to sweep")
+    parser.add_argument("--frames", type=int, default=60, help="measured frames per session")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured frames per session")
+    parser.add_argument("--views", default="overlay,heatmap", help="views to encode per frame, as ?views=")
+    parser.add_argument("--detector", choices=("yolo", "synthetic"), default="yolo")
+    parser.add_argument("--backend", choices=app.DETECTOR_BACKENDS, default=app.DETECTOR_BACKEND,
+                        help="runtime for the YOLO detector")
+    parser.add_argument("--int8", action="store_true", default=app.DETECTOR_INT8,
+                        help="use the INT8-quantized export of the detector")
+    parser.add_argument("--compare-backends", type=backend_list, default=[],
+                        help="backends to check against pytorch, e.g. onnx,openvino:int8")
+    parser.add_argument("--compare-frames", type=int, default=30, help="frames sampled for --compare-backends")
+    parser.add_argument("--min-agreement", type=float, default=0.9,
+                        help="lowest recall/precision against pytorch that counts as equivalent")
+    parser.add_argument("--video", help="benchmark this clip instead of synthetic video "
+                                        "(the people and resolution sweeps are skipped)")
+    parser.add_argument("--db", default=":memory:", help="SQLite database file")
+    parser.add_argument("--output", default="benchmark.json", help="JSON results file ('-' for stdout)")
+    args = parser.parse_args(argv)
+    args.views = app.parse_views(args.views)
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    database = SQLiteDatabase(args.db)
+    app.get_db_connection = database.connect
+    app.schema_state["ready"] = True  # SQLITE_SCHEMA already created the tables
+    if args.detector == "synthetic":
+        app.model_loader.use(synthetic_detector)
+    else:
+        app.model_loader.backend, app.model_loader.int8 = args.backend, args.int8
+        app.model_loader.get()  # load and warm up before anything is timed
+
+    workdir = tempfile.mkdtemp(prefix="crowd-bench-")
+    if args.video:
+        cap = app.open_video_capture(args.video)
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        cap.release()
+        inputs = [(None, size, args.video)]
+    else:
+        inputs = []
+        for resolution in args.resolutions:
+            for people in args.people:
+                path = os.path.join(workdir, f"synthetic_{resolution[0]}x{resolution[1]}_{people}.avi")
+                synthetic_video(path, resolution[0], resolution[1], people, min(args.frames + args.warmup, 250))
+                inputs.append((people, resolution, path))
+
+    equivalence = None
+    if args.compare_backends:
+        equivalence = compare_backends(args.compare_backends, sample_frames(inputs[0][2], args.compare_frames),
+                                       args.min_agreement)
+
+    results = []
+    user_id = 0
+    for people, resolution, path in inputs:
+        for zones in args.zones:
+            for sessions in args.sessions:
+                user_id += 1
+                config = {"zones": zones, "people": people, "resolution": resolution, "sessions": sessions}
+                result = run_config(database, config, user_id, path, args)
+                results.append(result)
+                pipeline = result["stages"].get("pipeline", {})
+                print(f"zones={zones:<3} people={people} res={result['config']['resolution']:<9} "
+                      f"sessions={sessions:<2} fps={result['fps']:<8} pipeline p50={pipeline.get('p50_ms')}ms "
+                      f"p95={pipeline.get('p95_ms')}ms", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "opencv": cv2.__version__,
+            "detector": args.detector,
+            "backend": args.backend if args.detector == "yolo" else None,
+            "int8": args.int8 if args.detector == "yolo" else None,
+            "video": args.video,
+            "frames_per_session": args.frames,
+            "warmup_frames": args.warmup,
+            "views": sorted(args.views),
+            "inference_input_size": app.INFERENCE_INPUT_SIZE,
+            "detect_persons_only": app.DETECT_PERSONS_ONLY,
+            "detect_zone_roi": app.DETECT_ZONE_ROI,
+            "inference_max_batch": app.INFERENCE_MAX_BATCH,
+            "inference_workers": app.inference_scheduler.num_workers
+        },
+        "results": results,
+        "equivalence": equivalence
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    failed = any(r["errors"] for r in results)
+    failed = failed or any(e.get("equivalent") is False for e in equivalence or [])
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -39,6 +39,20 @@ document.addEventListener("DOMContentLoaded", () => {
             "Authorization": `Bearer ${token}`
         } : {};
     };
+    // <img> and EventSource can't send headers; their URLs carry a short-lived stream token instead
+    const fetchStreamToken = async () => {
+        try {
+            const res = await fetch(`${API_BASE}/stream_token`, {
+                method: "POST",
+                headers: { ...authHeaders() }
+            });
+            if (!res.ok) return "";
+            const data = await res.json();
+            return data.token || "";
+        } catch (err) {
+            return "";
+        }
+    };
 
     // ---------- LOGIN / REGISTER ----------
     const loginForm = document.querySelector(".login-form");
@@ -165,8 +179,7 @@ const liveHeatmapImage = document.getElementById("liveHeatmapFrame");
 const liveAnalysisList = document.getElementById("live-analysis-list");
 
 // ---------- STATE (Add to existing state block) ----------
-let liveAnalysisInterval = null;
-const LIVE_ANALYSIS_POLL_RATE = 1000; // Poll backend every 1 second (1000ms)
+let liveAnalysisRunning = false;
     const liveVideoContainer = document.getElementById("live-video-container");
     const liveVideoFeed = document.getElementById("live-video-feed");
     const liveCanvas = document.getElementById("live-zone-canvas");
@@ -201,10 +214,11 @@ const LIVE_ANALYSIS_POLL_RATE = 1000; // Poll backend every 1 second (1000ms)
     const MAX_POINTS = 4;
 
     // Analysis state
-    let analysisInterval = null;
     let hourlyChart = null;
     let zoneChart = null;
     let totalFrames = 0;
+    // video_id of the upload to analyze; duplicates come back with the stored copy's id
+    let uploadedVideoId = null;
     let analysisData = {
         currentCount: 0,
         totalEntries: 0,
@@ -304,6 +318,44 @@ if (menuItems.length > 0) {
         });
     }
 
+    // Chunked, resumable upload: each chunk is retried from the offset the server reports
+    const UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024;
+    const UPLOAD_CHUNK_RETRIES = 3;
+
+    async function uploadInChunks(file) {
+        const startRes = await fetch(`${API_BASE}/uploads`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json", ...authHeaders() },
+            body: JSON.stringify({ size: file.size, filename: file.name })
+        });
+        let data = await startRes.json();
+        if (!startRes.ok) throw new Error(data.error || "Upload failed");
+        if (data.complete) return data;
+
+        const uploadId = data.upload_id;
+        const chunkBytes = Math.min(UPLOAD_CHUNK_BYTES, data.max_chunk_bytes || UPLOAD_CHUNK_BYTES);
+        let offset = data.offset || 0;
+        let failures = 0;
+        while (true) {
+            try {
+                const res = await fetch(`${API_BASE}/uploads/${uploadId}?offset=${offset}`, {
+                    method: "PUT",
+                    headers: { "Content-Type": "application/octet-stream", ...authHeaders() },
+                    body: file.slice(offset, offset + chunkBytes)
+                });
+                data = await res.json();
+                if (res.ok && data.complete) return data;
+                if (!res.ok && res.status !== 409) throw new Error(data.error || "Upload failed");
+                offset = data.offset;
+                failures = 0;
+            } catch (err) {
+                if (++failures > UPLOAD_CHUNK_RETRIES) throw err;
+                const statusRes = await fetch(`${API_BASE}/uploads/${uploadId}`, { headers: { ...authHeaders() } });
+                if (statusRes.ok) offset = (await statusRes.json()).offset;
+            }
+        }
+    }
+
     if (uploadToServerBtn) {
         uploadToServerBtn.addEventListener("click", async () => {
             const file = videoUploadInput && videoUploadInput.files ? videoUploadInput.files[0] : null;
@@ -311,24 +363,13 @@ if (menuItems.length > 0) {
             const token = getToken();
             if (!token) return alert("Login required to upload video to server.");
 
-            const form = new FormData();
-            form.append("video", file);
-
             try {
-                const res = await fetch(`${API_BASE}/upload_video`, {
-                    method: "POST",
-                    headers: { ...authHeaders() },
-                    body: form
-                });
-                const data = await res.json();
-                if (res.ok) {
-                    alert(data.message || "Uploaded to server");
-                } else {
-                    alert(data.error || data.message || "Upload failed");
-                }
+                const data = await uploadInChunks(file);
+                uploadedVideoId = data.video_id || null;
+                alert(data.duplicate ? "This video was already uploaded; using the stored copy." : "Uploaded to server");
             } catch (err) {
                 console.error(err);
-                alert("Network error during upload.");
+                alert(err.message || "Network error during upload.");
             }
         });
     }
@@ -355,7 +396,8 @@ if (startLiveBtn) {
                 if (startLiveAnalysisBtn) startLiveAnalysisBtn.style.display = "block";
                 // Set the image source to start pulling the MJPEG stream
                 // We add a timestamp to prevent browser caching.
-                liveVideoFeed.src = `${API_BASE}/live_feed_mjpeg?t=${new Date().getTime()}`;
+                const streamToken = await fetchStreamToken();
+                liveVideoFeed.src = `${API_BASE}/live_feed_mjpeg?token=${encodeURIComponent(streamToken)}&t=${new Date().getTime()}`;
                 
                 // Once the stream starts, set the canvas size and draw zones
                 liveVideoFeed.onload = () => {
@@ -402,79 +444,72 @@ if (stopLiveBtn) {
 }
 // --- LIVE ANALYSIS FUNCTIONS ---
 
+// The server analyzes the camera on its own thread: analyzed frames arrive as
+// MJPEG and zone counts as "zone_counts" events with source "live".
+const liveAnalysisStreamUrl = (view, token) =>
+    `${API_BASE}/live_analysis_mjpeg?view=${view}&token=${encodeURIComponent(token)}&t=${new Date().getTime()}`;
+
+/**
+ * Shows the latest live zone counts pushed by the server.
+ */
+function renderLiveZoneCounts(zoneCounts) {
+    if (!liveAnalysisList) return;
+    liveAnalysisList.innerHTML = "";
+    for (const zoneId in zoneCounts) {
+        const count = zoneCounts[zoneId];
+        // Find zone name from locally stored zones (assuming loadZones was called)
+        const zone = savedZones.find(z => z.id == zoneId);
+        const zoneName = zone ? zone.name : `Zone ${zoneId}`;
+
+        // Mock analysis update (reusing existing logic/mocks)
+        const capacity = ZONE_CAPACITIES_MOCK(zoneName);
+        const percentage = (count / capacity) * 100;
+
+        let listItem = document.createElement("li");
+        listItem.innerHTML = `<strong>${zoneName}</strong>: ${count} people (${percentage.toFixed(0)}% capacity)`;
+        
+        // Add alert styling if needed (using existing ALERT_THRESHOLD or capacity logic)
+        if (percentage > 90) {
+            listItem.classList.add('alert-error');
+        } else if (percentage > 70) {
+            listItem.classList.add('alert-warning');
+        }
+        
+        liveAnalysisList.appendChild(listItem);
+    }
+}
+
 /**
- * Polls the backend for a new analyzed frame and updates the display.
+ * Starts server-side analysis of the live camera and shows its streams.
  */
-async function fetchAndDisplayLiveAnalysis() {
+async function startLiveAnalysis() {
+    if (liveAnalysisRunning) return alert("Live analysis is already running.");
+    if (!liveVideoFeed.src) return alert("Please start the camera feed first.");
+
+    // Listen before starting, so the first counts aren't missed
+    await openEventStream();
     try {
-        // Calls the backend route that handles YOLO, DeepSORT, and zone counting on the current live camera frame
         const res = await fetch(`${API_BASE}/start_live_analysis`, {
             method: "POST",
             headers: { ...authHeaders() }
         });
         const data = await res.json();
-
-        if (res.ok && !data.finished) {
-            // 1. Display analyzed frames by decoding Base64
-            if (liveOverlayImage) {
-                liveOverlayImage.src = `data:image/jpeg;base64,${data.overlay_frame}`;
-                liveOverlayImage.style.display = "block";
-            }
-            if (liveHeatmapImage) {
-                liveHeatmapImage.src = `data:image/jpeg;base64,${data.heatmap_frame}`;
-                liveHeatmapImage.style.display = "block";
-            }
-
-            // 2. Update live zone counts (similar to your video analysis update)
-            if (liveAnalysisList) {
-                liveAnalysisList.innerHTML = "";
-                for (const zoneId in data.zone_counts) {
-                    const count = data.zone_counts[zoneId];
-                    // Find zone name from locally stored zones (assuming loadZones was called)
-                    const zone = savedZones.find(z => z.id == zoneId);
-                    const zoneName = zone ? zone.name : `Zone ${zoneId}`;
-
-                    // Mock analysis update (reusing existing logic/mocks)
-                    const capacity = ZONE_CAPACITIES_MOCK(zoneName);
-                    const percentage = (count / capacity) * 100;
-
-                    let listItem = document.createElement("li");
-                    listItem.innerHTML = `<strong>${zoneName}</strong>: ${count} people (${percentage.toFixed(0)}% capacity)`;
-                    
-                    // Add alert styling if needed (using existing ALERT_THRESHOLD or capacity logic)
-                    if (percentage > 90) {
-                        listItem.classList.add('alert-error');
-                    } else if (percentage > 70) {
-                        listItem.classList.add('alert-warning');
-                    }
-                    
-                    liveAnalysisList.appendChild(listItem);
-                }
-            }
-        } else {
-             console.error("Live analysis failed or finished.", data.error || data.message);
-        }
+        if (!res.ok) return alert(data.error || data.message || "Failed to start live analysis");
     } catch (err) {
-        console.error("Network error during live analysis poll:", err);
+        console.error("Network error starting live analysis:", err);
+        return alert("Network error. Could not start live analysis.");
     }
-}
-
-/**
- * Starts the continuous analysis polling loop.
- */
-function startLiveAnalysis() {
-    if (liveAnalysisInterval) return alert("Live analysis is already running.");
-    if (!liveVideoFeed.src) return alert("Please start the camera feed first.");
+    const streamToken = await fetchStreamToken();
+    liveAnalysisRunning = true;
 
     // Hide the raw MJPEG feed and show the analyzed overlays
     liveVideoFeed.style.display = "none";
     liveCanvas.style.display = "none";
+    liveOverlayImage.src = liveAnalysisStreamUrl("overlay", streamToken);
     liveOverlayImage.style.display = "block";
+    liveHeatmapImage.src = liveAnalysisStreamUrl("heatmap", streamToken);
     liveHeatmapImage.style.display = "block";
     
-    // Start the polling loop (treating each poll as a "next frame" process)
-    liveAnalysisInterval = setInterval(fetchAndDisplayLiveAnalysis, LIVE_ANALYSIS_POLL_RATE);
-    
     // Update button states
     startLiveAnalysisBtn.style.display = "none";
     stopLiveAnalysisBtn.style.display = "block";
@@ -483,25 +518,33 @@ function startLiveAnalysis() {
 }
 
 /**
- * Stops the continuous analysis polling loop.
+ * Stops the live analysis and returns to the raw camera feed.
+ * notifyServer is false when the server already ended it.
  */
-function stopLiveAnalysis() {
-    if (liveAnalysisInterval) {
-        clearInterval(liveAnalysisInterval);
-        liveAnalysisInterval = null;
+function stopLiveAnalysis(notifyServer = true) {
+    if (liveAnalysisRunning) {
+        liveAnalysisRunning = false;
+        if (notifyServer) {
+            fetch(`${API_BASE}/stop_live_analysis`, { method: "POST", headers: { ...authHeaders() } })
+                .catch(() => console.warn("Failed to stop live analysis on backend."));
+        }
         
         // Show the raw MJPEG feed again (if it's still running)
         if (liveVideoFeed.src) {
             liveVideoFeed.style.display = "block";
             liveCanvas.style.display = "block";
         }
+        // Clearing src closes the MJPEG connections to the server
+        liveOverlayImage.removeAttribute("src");
         liveOverlayImage.style.display = "none";
+        liveHeatmapImage.removeAttribute("src");
         liveHeatmapImage.style.display = "none";
         liveAnalysisList.innerHTML = "<li>Live analysis stopped.</li>";
         
         // Update button states
         startLiveAnalysisBtn.style.display = "block";
         stopLiveAnalysisBtn.style.display = "none";
+        if (!analysisRunning) closeEventStream();
         
         alert("Live analysis stopped.");
     }
@@ -901,7 +944,7 @@ async function loadProfiles() {
     const updateBubbleChart = () => {
         if (!bubbleChart || !savedZones || savedZones.length === 0) return;
 
-        // analysisData.zoneData holds the latest live counts from fetchLiveZoneCounts
+        // analysisData.zoneData holds the latest live counts from applyZoneCounts
         const liveZoneData = analysisData.zoneData;
 
         const datasets = savedZones.map((zone, index) => {
@@ -1024,19 +1067,28 @@ async function loadProfiles() {
     }
 
     function stopAnalysis() {
-        if (analysisInterval) {
-            clearInterval(analysisInterval);
-            analysisInterval = null;
-        }
+        analysisRunning = false;
+        if (!liveAnalysisRunning) closeEventStream();
         resetAnalysisDisplay();
         if (startAnalysisBtn) startAnalysisBtn.disabled = false;
         if (stopAnalysisBtn) stopAnalysisBtn.disabled = true;
 
-        if (overlayImage) overlayImage.style.display = 'none';
+        // Clearing src closes the MJPEG connections to the server
+        if (overlayImage) {
+            overlayImage.style.display = 'none';
+            overlayImage.removeAttribute('src');
+        }
         // NEW: Hide the heatmap image
-        if (heatmapImage) heatmapImage.style.display = 'none';
+        if (heatmapImage) {
+            heatmapImage.style.display = 'none';
+            heatmapImage.removeAttribute('src');
+        }
     }
 
+    // Analyzed frames arrive as binary MJPEG; <img> can't send headers, so a stream token goes in the query string
+    const analysisStreamUrl = (view, token) =>
+        `${API_BASE}/analysis_stream_mjpeg?view=${view}&token=${encodeURIComponent(token)}&t=${new Date().getTime()}`;
+
     function resetAnalysisDisplay() {
         analysisData = {
             currentCount: 0,
@@ -1049,126 +1101,171 @@ async function loadProfiles() {
         updateAnalysisDisplay();
     }
 
-    async function fetchLiveZoneCounts() {
-        if (!getToken()) {
-            stopAnalysis();
-            return;
-        }
+    // ---------- SERVER-PUSHED EVENTS ----------
+    // One EventSource per dashboard; the server only sends zone counts when they change.
+    // EventSource can't send headers, so a stream token goes in the query string.
+    let eventSource = null;
+    let eventStreamOpen = null;
+    let analysisRunning = false;
+
+    // Resolves once the stream is connected, so a caller can start work without missing its events
+    function openEventStream() {
+        if (eventStreamOpen) return eventStreamOpen;
+        if (!getToken()) return Promise.resolve();
+        const opening = fetchStreamToken().then((token) => new Promise((resolve) => {
+            if (eventStreamOpen !== opening || !token) {
+                // Closed while the token was on its way, or no token; a later open tries again
+                if (eventStreamOpen === opening) eventStreamOpen = null;
+                return resolve();
+            }
+            connectEventSource(token, resolve);
+        }));
+        eventStreamOpen = opening;
+        return opening;
+    }
 
+    function connectEventSource(token, resolve) {
+        const source = new EventSource(`${API_BASE}/events?token=${encodeURIComponent(token)}`);
+        eventSource = source;
+        source.addEventListener("open", resolve, { once: true });
+        // Don't hold up a start if the stream can't connect; the progress sync catches up
+        source.addEventListener("error", resolve, { once: true });
+
+        source.addEventListener("open", () => {
+            // Events sent while (re)connecting are lost; catch up on a finish we missed
+            if (analysisRunning) syncAnalysisProgress();
+        });
+
+        source.addEventListener("zone_counts", (e) => {
+            const data = JSON.parse(e.data);
+            if (data.source === "video") applyZoneCounts(data);
+            else if (data.source === "live" && liveAnalysisRunning) renderLiveZoneCounts(data.zone_counts);
+        });
+
+        source.addEventListener("analysis_finished", (e) => {
+            finishAnalysis(JSON.parse(e.data));
+        });
+
+        source.addEventListener("live_analysis_finished", (e) => {
+            const data = JSON.parse(e.data);
+            if (data.error) alert(`Live analysis stopped due to error: ${data.error}`);
+            stopLiveAnalysis(false);
+        });
+
+        source.onerror = () => {
+            if (source.readyState !== EventSource.CLOSED) {
+                // The browser reconnects on its own (server sends a retry interval)
+                console.warn("Event stream interrupted, reconnecting...");
+            } else if (eventSource === source) {
+                // The reconnect was refused, most likely because the stream token expired
+                closeEventStream();
+                if (analysisRunning || liveAnalysisRunning) setTimeout(openEventStream, 3000);
+            }
+        };
+    }
+
+    async function finishAnalysis(data) {
+        if (!analysisRunning) return;
+        analysisRunning = false;
+        if (data.error) {
+            alert(`Analysis stopped due to error: ${data.error}`);
+        } else {
+            alert("Analysis complete. Video has ended.");
+        }
         try {
-            const res = await fetch(`${API_BASE}/get_frame_data`, {
-                method: "GET",
+            await fetch(`${API_BASE}/stop_analysis`, {
+                method: "POST",
                 headers: { ...authHeaders() }
             });
+        } catch (err) { /* ignore */ }
+        stopAnalysis();
+    }
 
+    async function syncAnalysisProgress() {
+        try {
+            const res = await fetch(`${API_BASE}/analysis_progress`, { headers: { ...authHeaders() } });
+            if (!res.ok) return;
             const data = await res.json();
+            if (data.finished) finishAnalysis(data);
+        } catch (err) { /* the next reconnect tries again */ }
+    }
 
-            if (!res.ok || data.finished) {
-                console.warn("Analysis finished or failed:", data.error || data.message);
-                if (data.finished) {
-                    alert("Analysis complete. Video has ended.");
-                } else {
-                    alert(`Analysis stopped due to error: ${data.error || data.message}`);
-                }
-                try {
-                    await fetch(`${API_BASE}/stop_analysis`, {
-                        method: "POST",
-                        headers: { ...authHeaders() }
-                    });
-                } catch (e) { /* ignore */ }
-                stopAnalysis();
-                return;
-            }
+    function closeEventStream() {
+        eventStreamOpen = null;
+        if (eventSource) {
+            eventSource.close();
+            eventSource = null;
+        }
+    }
 
-            // Existing logic for detection overlay
-            if (data.overlay_frame && overlayImage) {
-                overlayImage.src = `data:image/jpeg;base64,${data.overlay_frame}`;
-                overlayImage.style.display = 'block';
+    function applyZoneCounts(data) {
+        const zoneCountsRaw = data.zone_counts || {};
+        const sumValues = (obj) => Object.values(obj || {}).reduce((sum, n) => sum + (Number(n) || 0), 0);
+        analysisData.totalEntries += sumValues(data.entries);
+        analysisData.totalExits += sumValues(data.exits);
+        const totalCount = Object.values(zoneCountsRaw).reduce((sum, count) => sum + (Number(count) || 0), 0);
+        analysisData.currentCount = totalCount;
+        analysisData.peakCount = Math.max(analysisData.peakCount, totalCount);
+
+        const idToName = {};
+        savedZones.forEach(z => {
+            if (z.id !== undefined && z.id !== null) {
+                idToName[String(z.id)] = z.name || (`Zone ${z.id}`);
             }
+        });
 
-            // NEW: Logic for heatmap overlay
-            if (data.heatmap_frame && heatmapImage) {
-                heatmapImage.src = `data:image/jpeg;base64,${data.heatmap_frame}`;
-                heatmapImage.style.display = 'block';
-            } else if (heatmapImage) {
-                heatmapImage.style.display = 'none';
+        const mappedZoneData = {};
+        for (const key in zoneCountsRaw) {
+            if (Object.prototype.hasOwnProperty.call(zoneCountsRaw, key)) {
+                const count = zoneCountsRaw[key];
+                const name = idToName[key] || `Zone ${key}`;
+                mappedZoneData[name] = count;
             }
-
-            const zoneCountsRaw = data.zone_counts || {};
-            const totalCount = Object.values(zoneCountsRaw).reduce((sum, count) => sum + (Number(count) || 0), 0);
-            analysisData.currentCount = totalCount;
-            analysisData.peakCount = Math.max(analysisData.peakCount, totalCount);
-
-            const idToName = {};
-            savedZones.forEach(z => {
-                if (z.id !== undefined && z.id !== null) {
-                    idToName[String(z.id)] = z.name || (`Zone ${z.id}`);
+        }
+        analysisData.zoneData = mappedZoneData;
+
+        // Update the hourly chart with live data for the current hour
+        if (hourlyChart && mappedZoneData) {
+            const currentHour = new Date().getHours();
+            hourlyChart.data.datasets.forEach(dataset => {
+                const zoneName = dataset.label;
+                const liveCountForZone = mappedZoneData[zoneName] || 0;
+                if (Object.prototype.hasOwnProperty.call(mappedZoneData, zoneName)) {
+                    dataset.data[currentHour] = liveCountForZone;
                 }
             });
+            hourlyChart.update("none");
+        }
 
-            const mappedZoneData = {};
-            for (const key in zoneCountsRaw) {
-                if (Object.prototype.hasOwnProperty.call(zoneCountsRaw, key)) {
-                    const count = zoneCountsRaw[key];
-                    const name = idToName[key] || `Zone ${key}`;
-                    mappedZoneData[name] = count;
-                }
-            }
-            analysisData.zoneData = mappedZoneData;
-
-            // Update the hourly chart with live data for the current hour
-            if (hourlyChart && mappedZoneData) {
-                const currentHour = new Date().getHours();
-                hourlyChart.data.datasets.forEach(dataset => {
-                    const zoneName = dataset.label;
-                    const liveCountForZone = mappedZoneData[zoneName] || 0;
-                    if (Object.prototype.hasOwnProperty.call(mappedZoneData, zoneName)) {
-                        dataset.data[currentHour] = liveCountForZone;
-                    }
-                });
-                hourlyChart.update("none");
-            }
-
-            for (const [zoneName, count] of Object.entries(mappedZoneData)) {
-                if (Number(count) >= ALERT_THRESHOLD) {
-                    const alreadyShown = document.querySelector(`#alert-${zoneName.replace(/\s+/g,'-')}`);
-                    if (!alreadyShown) {
-                        const alertEl = document.createElement("div");
-                        alertEl.id = `alert-${zoneName.replace(/\s+/g,'-')}`;
-                        alertEl.className = "alert-box capacity-alert alert-error";
-                        alertEl.innerHTML =  `<i class='bx bxs-error-alt'></i> <span><strong>Alert:</strong> ${zoneName} has reached a capacity threshold (${count})</span>`;
-                        document.body.appendChild(alertEl);
-                        setTimeout(() => {
-                            try { alertEl.remove(); } catch(e) {}
-                        }, 3000);
-                    }
-                    try {
-                        const ctx = new (window.AudioContext || window.webkitAudioContext)();
-                        const o = ctx.createOscillator();
-                        const g = ctx.createGain();
-                        o.type = "sine";
-                        o.frequency.value = 880;
-                        o.connect(g);
-                        g.connect(ctx.destination);
-                        o.start();
-                        g.gain.exponentialRampToValueAtTime(0.00001, ctx.currentTime + 0.3);
-                        setTimeout(()=>{ o.stop(); }, 350);
-                    } catch(e) { /* ignore audio errors */ }
+        for (const [zoneName, count] of Object.entries(mappedZoneData)) {
+            if (Number(count) >= ALERT_THRESHOLD) {
+                const alreadyShown = document.querySelector(`#alert-${zoneName.replace(/\s+/g,'-')}`);
+                if (!alreadyShown) {
+                    const alertEl = document.createElement("div");
+                    alertEl.id = `alert-${zoneName.replace(/\s+/g,'-')}`;
+                    alertEl.className = "alert-box capacity-alert alert-error";
+                    alertEl.innerHTML =  `<i class='bx bxs-error-alt'></i> <span><strong>Alert:</strong> ${zoneName} has reached a capacity threshold (${count})</span>`;
+                    document.body.appendChild(alertEl);
+                    setTimeout(() => {
+                        try { alertEl.remove(); } catch(e) {}
+                    }, 3000);
                 }
+                try {
+                    const ctx = new (window.AudioContext || window.webkitAudioContext)();
+                    const o = ctx.createOscillator();
+                    const g = ctx.createGain();
+                    o.type = "sine";
+                    o.frequency.value = 880;
+                    o.connect(g);
+                    g.connect(ctx.destination);
+                    o.start();
+                    g.gain.exponentialRampToValueAtTime(0.00001, ctx.currentTime + 0.3);
+                    setTimeout(()=>{ o.stop(); }, 350);
+                } catch(e) { /* ignore audio errors */ }
             }
-
-            updateAnalysisDisplay();
-
-        } catch (err) {
-            console.error("Error fetching live zone counts:", err);
-            try {
-                await fetch(`${API_BASE}/stop_analysis`, {
-                    method: "POST",
-                    headers: { ...authHeaders() }
-                });
-            } catch (e) {}
-            stopAnalysis();
         }
+
+        updateAnalysisDisplay();
     }
     
     async function loadAnalysisSummary() {
@@ -1257,9 +1354,12 @@ async function loadProfiles() {
             if (!token) return alert("Login required for live analysis.");
 
             try {
+                // Listen before starting: a short video can finish before the POST returns
+                await openEventStream();
                 const res = await fetch(`${API_BASE}/start_analysis`, {
                     method: "POST",
-                    headers: { ...authHeaders() }
+                    headers: { "Content-Type": "application/json", ...authHeaders() },
+                    body: JSON.stringify(uploadedVideoId ? { video_id: uploadedVideoId } : {})
                 });
                 const data = await res.json();
                 if (!res.ok) {
@@ -1268,15 +1368,20 @@ async function loadProfiles() {
                 }
 
                 totalFrames = data.total_frames;
+                const streamToken = await fetchStreamToken();
+                analysisRunning = true;
+                // Finished events sent before analysisRunning was set were ignored
+                syncAnalysisProgress();
                 alert("Analysis session started on server. Fetching data...");
 
-                if (overlayImage) overlayImage.style.display = 'block';
+                if (overlayImage) {
+                    overlayImage.src = analysisStreamUrl("overlay", streamToken);
+                    overlayImage.style.display = 'block';
+                }
                 // Show heatmap on start
-                if (heatmapImage) heatmapImage.style.display = 'block';
-
-                if (!analysisInterval) {
-                    analysisInterval = setInterval(fetchLiveZoneCounts, 100); 
-                    fetchLiveZoneCounts();
+                if (heatmapImage) {
+                    heatmapImage.src = analysisStreamUrl("heatmap", streamToken);
+                    heatmapImage.style.display = 'block';
                 }
 
                 startAnalysisBtn.disabled = true;